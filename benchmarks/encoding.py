@@ -0,0 +1,108 @@
+# Bytes on the wire and encode CPU time of the longread listing endpoints, per JSON provider
+# and per content encoding, against a seeded synthetic dataset (see benchmarks/generate.py).
+# The read cache is off, so every request encodes its body again.
+#
+#   python -m benchmarks.encoding --longreads 2 --chapters 10 --blocks 100 --repeat 20
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+
+from benchmarks.generate import load_service, generate, add_arguments, generate_args
+
+
+def listings(fixture):
+    # name -> request keyword arguments for the test client
+    longread_id, world_id = fixture["longreads"][0]
+    chapter_id = fixture["chapters"][0][0]
+    return {
+        "/longread/blockcontent/all": {"method": "POST", "json": {"longread_id": longread_id, "limit": 1000}},
+        "/longread/blockcontent/all ndjson": {"method": "POST", "json": {"longread_id": longread_id},
+                                              "headers": {"Accept": "application/x-ndjson"}},
+        "/longread/chapter/blockcontent/all": {"method": "POST", "json": {"chapter_id": chapter_id, "limit": 1000}},
+        "/longread/chapter/all": {"method": "POST", "json": {"longread_id": longread_id, "limit": 1000}},
+        "/world/longread/all": {"method": "POST", "json": {"world_id": world_id, "limit": 1000}},
+        "/world/longread/full": {"method": "POST", "json": {"longread_id": longread_id, "with_worldobjs": True}},
+        "/api/longreads/<id>/blockcontents": {"method": "GET", "path": f"/api/longreads/{longread_id}/blockcontents",
+                                              "query_string": {"limit": 1000}},
+    }
+
+
+def request(client, name, spec, encoding):
+    headers = dict(spec.get("headers", {}))
+    if encoding != "identity":
+        headers["Accept-Encoding"] = encoding
+    return client.open(spec.get("path", name.split()[0]), method=spec["method"], json=spec.get("json"),
+                       query_string=spec.get("query_string"), headers=headers)
+
+
+def cpu_ms(fn, repeat):
+    # median process time, so time spent waiting on sqlite's file reads is not counted
+    samples = []
+    for _ in range(repeat):
+        start = time.process_time()
+        fn()
+        samples.append((time.process_time() - start) * 1000)
+    return round(statistics.median(samples), 3)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", help="write the json report here instead of stdout")
+    args = parser.parse_args()
+
+    database = os.path.join(tempfile.mkdtemp(prefix="darts-bench-"), "bench.db")
+    db_service, app = load_service(database)
+    with app.app_context():
+        fixture = generate(db_service, **generate_args(args))
+        encodings = ["identity"] + db_service.available_encodings()
+        levels = app.config["COMPRESSION_LEVELS"]
+
+    providers = [name for name in db_service.JSON_PROVIDERS if name != "orjson" or db_service.orjson is not None]
+    apps = {provider: db_service.create_app({"SQLALCHEMY_DATABASE_URI": app.config["SQLALCHEMY_DATABASE_URI"],
+                                             "JSON_PROVIDER": provider, "READ_CACHE_MAX_ENTRIES": 0})
+            for provider in providers}
+
+    endpoints = {}
+    for name, spec in listings(fixture).items():
+        plain = request(app.test_client(), name, spec, "identity").get_data()
+        result = {"plain_bytes": len(plain), "encode_ms": {}, "wire": {}, "request_cpu_ms": {}}
+        if "ndjson" not in name:
+            payload = json.loads(plain)
+            for provider, provider_app in apps.items():
+                result["encode_ms"][provider] = cpu_ms(lambda: provider_app.json.dumps(payload), args.repeat)
+        for encoding in encodings:
+            body = request(app.test_client(), name, spec, encoding).get_data()
+            wire = {"bytes": len(body), "ratio": round(len(body) / len(plain), 4)}
+            if encoding != "identity":
+                def compress():
+                    compress_chunk, finish = db_service.CONTENT_ENCODERS[encoding](levels[encoding])
+                    compress_chunk(plain) + finish()
+                wire["compress_ms"] = cpu_ms(compress, args.repeat)
+            result["wire"][encoding] = wire
+            for provider, provider_app in apps.items():
+                client = provider_app.test_client()
+                result["request_cpu_ms"][f"{provider}+{encoding}"] = cpu_ms(
+                    lambda: request(client, name, spec, encoding).get_data(), args.repeat)
+        endpoints[name] = result
+        print("%-40s %9d bytes plain  %s" % (name, len(plain), "  ".join(
+            f"{encoding} {wire['bytes']}" for encoding, wire in result["wire"].items())), file=sys.stderr)
+
+    report = {"meta": {"data": generate_args(args), "repeat": args.repeat, "providers": providers,
+                       "encodings": encodings, "levels": levels},
+              "endpoints": endpoints}
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
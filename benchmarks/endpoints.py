@@ -0,0 +1,384 @@
+# Per-endpoint latency and throughput of every route, against a seeded synthetic dataset
+# (see benchmarks/generate.py). Each endpoint is driven on its own for --requests requests
+# spread over --concurrency threads, through the Flask test client or, with --server, over
+# HTTP against an in-process threaded WSGI server. The report is json; --baseline adds the
+# ratio to an earlier report so two commits can be compared.
+#
+#   python -m benchmarks.endpoints --requests 500 --concurrency 8 --output after.json --baseline before.json
+import io
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.generate import load_service, generate, add_arguments, generate_args
+
+IMAGE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          "staticFiles", "images", "font.jpg")
+PERCENTILES = (50, 95, 99)
+
+
+def pick(rng, rows):
+    return rng.choice(rows)
+
+
+def bbox(rng, size):
+    x, y = rng.randrange(4096 - size), rng.randrange(4096 - size)
+    return {"min_x": x, "min_y": y, "max_x": x + size, "max_y": y + size}
+
+
+def post(path, body):
+    return {"method": "POST", "path": path, "json": body}
+
+
+def get(path):
+    return {"method": "GET", "path": path}
+
+
+def upload(path):
+    return {"method": "POST", "path": path, "upload": True}
+
+
+def raw(path, body, content_type):
+    return {"method": "POST", "path": path, "body": body, "content_type": content_type}
+
+
+def scenarios(fixture, archive):
+    # route rule -> function(rng) returning the next request; deletes consume the spare rows
+    # and every import adds a copy of the world archived in archive
+    spares = {name: list(ids) for name, ids in fixture["spares"].items()}
+    lock = threading.Lock()
+
+    def spare(name):
+        with lock:
+            return spares[name].pop()
+
+    worlds, longreads, chapters = fixture["worlds"], fixture["longreads"], fixture["chapters"]
+    blocks, worldobjs, events = fixture["blockcontents"], fixture["worldobjs"], fixture["events"] or fixture["blockcontents"]
+    return {
+        "/worlds/all": lambda rng: post("/worlds/all", {}),
+        "/world": lambda rng: post("/world", {"world_id": pick(rng, worlds)}),
+        "/world/create": lambda rng: post("/world/create", {"name": "bench", "description": "bench world"}),
+        "/world/edit": lambda rng: post("/world/edit", {"world_id": pick(rng, worlds), "name": "bench",
+                                                        "description": "edited world"}),
+        "/world/delete": lambda rng: post("/world/delete", {"world_id": spare("world")}),
+        "/world/<int:world_id>/edit_image": lambda rng: upload("/world/%d/edit_image" % pick(rng, worlds)),
+        "/longreads/all": lambda rng: post("/longreads/all", {}),
+        "/world/longread/all": lambda rng: post("/world/longread/all", {"world_id": pick(rng, worlds)}),
+        "/world/changes": lambda rng: post("/world/changes", {"world_id": pick(rng, worlds), "since": 0}),
+        "/entities": lambda rng: post("/entities", {
+            "blockcontent": [row[0] for row in rng.sample(blocks, min(20, len(blocks)))],
+            "chapter": [row[0] for row in rng.sample(chapters, min(5, len(chapters)))],
+            "longread": [row[0] for row in rng.sample(longreads, min(3, len(longreads)))]}),
+        "/world/longread": lambda rng: post("/world/longread", {"longread_id": pick(rng, longreads)[0]}),
+        "/world/longread/full": lambda rng: post("/world/longread/full", {"longread_id": pick(rng, longreads)[0],
+                                                                         "with_worldobjs": True}),
+        "/world/longread/create": lambda rng: post("/world/longread/create", {
+            "world_id": pick(rng, worlds), "name": "bench", "description": "bench longread"}),
+        "/world/longread/edit": lambda rng: post("/world/longread/edit", {
+            "longread_id": pick(rng, longreads)[0], "name": "bench", "description": "edited longread"}),
+        "/world/longread/delete": lambda rng: post("/world/longread/delete", {"longread_id": spare("longread")[0]}),
+        "/world/longread/<int:longread_id>/edit_image": lambda rng: upload(
+            "/world/longread/%d/edit_image" % pick(rng, longreads)[0]),
+        "/longread/chapter/all": lambda rng: post("/longread/chapter/all", {"longread_id": pick(rng, longreads)[0]}),
+        "/longread/chapter": lambda rng: post("/longread/chapter", {"chapter_id": pick(rng, chapters)[0]}),
+        "/longread/chapter/create": lambda rng: post("/longread/chapter/create", {
+            "longread_id": pick(rng, longreads)[0], "name": "bench"}),
+        "/longread/chapter/edit": lambda rng: post("/longread/chapter/edit", {
+            "chapter_id": pick(rng, chapters)[0], "name": "edited chapter"}),
+        "/longread/chapter/delete": lambda rng: post("/longread/chapter/delete", {"chapter_id": spare("chapter")[0]}),
+        "/longread/chapter/blockcontent/all": lambda rng: post("/longread/chapter/blockcontent/all", {
+            "chapter_id": pick(rng, chapters)[0]}),
+        "/longread/chapter/blockcontent": lambda rng: post("/longread/chapter/blockcontent", {
+            "blockcontent_id": pick(rng, blocks)[0]}),
+        "/longread/chapter/blockcontent/create": lambda rng: post("/longread/chapter/blockcontent/create", dict(
+            zip(("longread_id", "chapter_id"), pick(rng, blocks)[1:]), text="bench block")),
+        "/longread/chapter/blockcontent/edit": lambda rng: post("/longread/chapter/blockcontent/edit", {
+            "blockcontent_id": pick(rng, blocks)[0], "text": "edited block"}),
+        "/longread/chapter/blockcontent/delete": lambda rng: post("/longread/chapter/blockcontent/delete", {
+            "blockcontent_id": spare("blockcontent")[0]}),
+        "/longread/chapter/blockcontent/batch": lambda rng: post("/longread/chapter/blockcontent/batch", {
+            "create": [dict(zip(("longread_id", "chapter_id"), pick(rng, blocks)[1:]), text="bench batch")
+                       for _ in range(5)],
+            "edit": [{"blockcontent_id": pick(rng, blocks)[0], "text": "batch edit"} for _ in range(5)]}),
+        "/longread/chapter/blockcontent/<int:blockcontent_id>/edit_image": lambda rng: upload(
+            "/longread/chapter/blockcontent/%d/edit_image" % pick(rng, blocks)[0]),
+        "/longread/blockcontent/all": lambda rng: post("/longread/blockcontent/all", {
+            "longread_id": pick(rng, longreads)[0]}),
+        "/world/blockcontent/all": lambda rng: post("/world/blockcontent/all", {"world_id": pick(rng, worlds)}),
+        "/longread/blockcontent/event": lambda rng: post("/longread/blockcontent/event", {
+            "blockcontent_id": pick(rng, events)[0]}),
+        "/longread/blockcontent/event/edit": lambda rng: post("/longread/blockcontent/event/edit", {
+            "blockcontent_id": pick(rng, events)[0], "coordx": rng.randrange(4096), "coordy": rng.randrange(4096),
+            "time": rng.randrange(100000), "floating_text": "moved event"}),
+        "/longread/blockcontent/event/delete": lambda rng: post("/longread/blockcontent/event/delete", {
+            "blockcontent_id": pick(rng, blocks)[0]}),
+        "/longread/blockcontent/event/window": lambda rng: post("/longread/blockcontent/event/window", {
+            "longread_id": pick(rng, longreads)[0], "bbox": bbox(rng, 1024), "time_from": 0, "time_to": 50000}),
+        "/longread/blockcontent/event/timeline": lambda rng: post("/longread/blockcontent/event/timeline", {
+            "longread_id": pick(rng, longreads)[0], "width": 1000}),
+        "/longread/map": lambda rng: post("/longread/map", {"longread_id": pick(rng, longreads)[0]}),
+        "/longread/map/tiles": lambda rng: post("/longread/map/tiles", {"longread_id": pick(rng, longreads)[0],
+                                                                       "level": 0}),
+        "/longread/map/<int:longread_id>/edit": lambda rng: upload("/longread/map/%d/edit" % pick(rng, longreads)[0]),
+        "/longread/timeline": lambda rng: post("/longread/timeline", {"longread_id": pick(rng, longreads)[0]}),
+        "/longread/timeline/<int:longread_id>/edit": lambda rng: upload(
+            "/longread/timeline/%d/edit" % pick(rng, longreads)[0]),
+        "/world/worldobj/all": lambda rng: post("/world/worldobj/all", {"world_id": pick(rng, worlds)}),
+        "/world/worldobj": lambda rng: post("/world/worldobj", {"worldobj_id": pick(rng, worldobjs)[0]}),
+        "/world/worldobj/create": lambda rng: post("/world/worldobj/create", {
+            "world_id": pick(rng, worlds), "name": "bench", "description": "bench worldobj"}),
+        "/world/worldobj/edit": lambda rng: post("/world/worldobj/edit", {
+            "worldobj_id": pick(rng, worldobjs)[0], "name": "bench", "description": "edited worldobj"}),
+        "/world/worldobj/delete": lambda rng: post("/world/worldobj/delete", {"worldobj_id": spare("worldobj")[0]}),
+        "/world/worldobj/<int:worldobj_id>/edit_image": lambda rng: upload(
+            "/world/worldobj/%d/edit_image" % pick(rng, worldobjs)[0]),
+        "/search": lambda rng: post("/search", {"query": " ".join(rng.sample(("dragon", "castle", "river", "storm",
+                                                                             "crown", "raven"), 2)), "limit": 20}),
+        "/cache/stats": lambda rng: get("/cache/stats"),
+        "/jobs/stats": lambda rng: get("/jobs/stats"),
+        "/metrics": lambda rng: get("/metrics"),
+        "/api/worlds": lambda rng: get("/api/worlds"),
+        "/api/worlds/<int:world_id>": lambda rng: get("/api/worlds/%d" % pick(rng, worlds)),
+        "/api/worlds/<int:world_id>/longreads": lambda rng: get("/api/worlds/%d/longreads" % pick(rng, worlds)),
+        "/api/worlds/<int:world_id>/worldobjs": lambda rng: get("/api/worlds/%d/worldobjs" % pick(rng, worlds)),
+        "/api/worlds/<int:world_id>/blockcontents": lambda rng: get(
+            "/api/worlds/%d/blockcontents" % pick(rng, worlds)),
+        "/api/longreads": lambda rng: get("/api/longreads"),
+        "/api/longreads/<int:longread_id>": lambda rng: get("/api/longreads/%d" % pick(rng, longreads)[0]),
+        "/api/longreads/<int:longread_id>/full": lambda rng: get(
+            "/api/longreads/%d/full?with_worldobjs=1" % pick(rng, longreads)[0]),
+        "/api/longreads/<int:longread_id>/chapters": lambda rng: get(
+            "/api/longreads/%d/chapters" % pick(rng, longreads)[0]),
+        "/api/longreads/<int:longread_id>/blockcontents": lambda rng: get(
+            "/api/longreads/%d/blockcontents" % pick(rng, longreads)[0]),
+        "/api/chapters/<int:chapter_id>": lambda rng: get("/api/chapters/%d" % pick(rng, chapters)[0]),
+        "/api/chapters/<int:chapter_id>/blockcontents": lambda rng: get(
+            "/api/chapters/%d/blockcontents" % pick(rng, chapters)[0]),
+        "/api/blockcontents/<int:blockcontent_id>": lambda rng: get("/api/blockcontents/%d" % pick(rng, blocks)[0]),
+        "/api/worldobjs/<int:worldobj_id>": lambda rng: get("/api/worldobjs/%d" % pick(rng, worldobjs)[0]),
+        # last, so the worlds they add do not grow the listings measured before them
+        "/world/export": lambda rng: post("/world/export", {"world_id": pick(rng, worlds)}),
+        "/world/import": lambda rng: raw("/world/import", archive, "application/x-tar"),
+    }
+
+
+class TestClientTransport:
+    def __init__(self, app, image):
+        self.app = app
+        self.image = image
+        self.local = threading.local()
+
+    def send(self, request):
+        client = getattr(self.local, "client", None)
+        if client is None:
+            client = self.local.client = self.app.test_client()
+        if request.get("upload"):
+            response = client.post(request["path"], data={"uploaded-file": (io.BytesIO(self.image), "bench.jpg")},
+                                   content_type="multipart/form-data")
+        elif request.get("body") is not None:
+            response = client.open(request["path"], method=request["method"], data=request["body"],
+                                   content_type=request["content_type"])
+        else:
+            response = client.open(request["path"], method=request["method"], json=request.get("json"))
+        response.get_data()
+        response.close()
+        return response.status_code
+
+    def close(self):
+        pass
+
+
+class ServerTransport:
+    # a threaded werkzeug server on an ephemeral port; every worker thread keeps one connection
+    def __init__(self, app, image):
+        from werkzeug.serving import make_server, WSGIRequestHandler
+        from werkzeug.test import encode_multipart
+        from werkzeug.datastructures import FileStorage
+
+        class KeepAliveHandler(WSGIRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_request(self, *args, **kwargs):
+                pass
+
+        self.server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=KeepAliveHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.boundary, self.multipart = encode_multipart(
+            {"uploaded-file": FileStorage(io.BytesIO(image), filename="bench.jpg")})
+        self.local = threading.local()
+
+    def send(self, request):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = self.local.connection = http.client.HTTPConnection("127.0.0.1", self.server.server_port)
+        if request.get("upload"):
+            body = self.multipart
+            headers = {"Content-Type": "multipart/form-data; boundary=" + self.boundary}
+        elif request.get("body") is not None:
+            body = request["body"]
+            headers = {"Content-Type": request["content_type"]}
+        elif request.get("json") is not None:
+            body = json.dumps(request["json"]).encode()
+            headers = {"Content-Type": "application/json"}
+        else:
+            body, headers = None, {}
+        try:
+            connection.request(request["method"], request["path"], body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            self.local.connection = None
+            raise
+        return response.status
+
+    def close(self):
+        self.server.shutdown()
+
+
+def percentile(ordered, p):
+    # nearest rank
+    return ordered[max(0, min(len(ordered) - 1, -(-len(ordered) * p // 100) - 1))]
+
+
+def run_endpoint(transport, scenario, requests, warmup, concurrency, seed):
+    local = threading.local()
+    counter = iter(range(requests + warmup))
+    counter_lock = threading.Lock()
+    latencies, statuses, errors = [], {}, []
+    results_lock = threading.Lock()
+
+    def worker(index):
+        local.rng = random.Random(seed * 1000 + index)
+        while True:
+            with counter_lock:
+                n = next(counter, None)
+            if n is None:
+                return
+            request = scenario(local.rng)
+            start = time.perf_counter()
+            try:
+                status = transport.send(request)
+            except Exception as e:
+                with results_lock:
+                    errors.append(repr(e))
+                continue
+            elapsed = time.perf_counter() - start
+            if n >= warmup:
+                with results_lock:
+                    latencies.append(elapsed)
+                    statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(worker, index) for index in range(concurrency)]:
+            future.result()
+    # the warmup requests are inside the wall time, so throughput is over every request sent
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    report = {"requests": len(latencies), "statuses": {str(k): v for k, v in sorted(statuses.items())},
+              "errors": len(errors), "throughput_rps": round((requests + warmup) / wall, 1) if wall else None}
+    if latencies:
+        report["mean_ms"] = round(sum(latencies) / len(latencies) * 1000, 3)
+        for p in PERCENTILES:
+            report["p%d_ms" % p] = round(percentile(latencies, p) * 1000, 3)
+        report["max_ms"] = round(latencies[-1] * 1000, 3)
+    if errors:
+        report["first_error"] = errors[0]
+    return report
+
+
+def compare(report, baseline):
+    # new / old: below 1 is faster for latencies, above 1 is faster for throughput
+    changes = {}
+    for name, result in report["endpoints"].items():
+        old = baseline.get("endpoints", {}).get(name)
+        if not old:
+            continue
+        changes[name] = {key: round(result[key] / old[key], 3) for key in
+                         ("throughput_rps", "p50_ms", "p95_ms", "p99_ms") if result.get(key) and old.get(key)}
+    return changes
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(IMAGE_PATH)).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    add_arguments(parser)
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=20, help="unmeasured requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--server", action="store_true", help="go over HTTP through a threaded WSGI server")
+    parser.add_argument("--only", help="regex; benchmark only the matching routes")
+    parser.add_argument("--reads-only", action="store_true", help="skip routes that write")
+    parser.add_argument("--output", help="write the json report here instead of stdout")
+    parser.add_argument("--baseline", help="earlier json report to compare against")
+    args = parser.parse_args()
+
+    with open(IMAGE_PATH, "rb") as f:
+        image = f.read()
+    revision = git_revision()
+    workdir = tempfile.mkdtemp(prefix="darts-bench-")
+    db_service, app = load_service(os.path.join(workdir, "bench.db"), workdir)
+    with app.app_context():
+        fixture = generate(db_service, spares=args.requests + args.warmup, **generate_args(args))
+    archive = app.test_client().post("/world/export", json={"world_id": fixture["worlds"][0]}).get_data()
+
+    routes = scenarios(fixture, archive)
+    rules = {rule.rule for rule in app.url_map.iter_rules() if rule.endpoint != "static"}
+    selected = [name for name in routes if name in rules
+                and (not args.only or re.search(args.only, name))
+                and not (args.reads_only and re.search(r"/(create|edit|delete|batch|edit_image|import)$", name))]
+
+    transport = (ServerTransport if args.server else TestClientTransport)(app, image)
+    endpoints = {}
+    try:
+        for name in selected:
+            endpoints[name] = run_endpoint(transport, routes[name], args.requests, args.warmup, args.concurrency,
+                                           args.seed)
+            print("%-60s p50 %8.2f ms  p99 %8.2f ms  %8.1f req/s" % (
+                name, endpoints[name].get("p50_ms", 0), endpoints[name].get("p99_ms", 0),
+                endpoints[name]["throughput_rps"] or 0), file=sys.stderr)
+    finally:
+        transport.close()
+
+    report = {
+        "meta": {"revision": revision, "python": platform.python_version(), "platform": platform.platform(),
+                 "mode": "server" if args.server else "test_client", "requests": args.requests,
+                 "warmup": args.warmup, "concurrency": args.concurrency, "data": generate_args(args),
+                 "rows": {name: len(ids) for name, ids in fixture.items() if name != "spares"}},
+        "endpoints": endpoints,
+        # routes the app serves that have no scenario yet
+        "uncovered": sorted(rules - set(routes)),
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["baseline"] = compare(report, json.load(f))
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
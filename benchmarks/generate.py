@@ -0,0 +1,162 @@
+# Seeded synthetic data for the benchmarks: N worlds x M longreads x K chapters x B blocks,
+# with events on a share of the blocks and WorldObj <-> BlockContent links. The same
+# arguments and seed always produce the same rows, so runs against different commits
+# measure the same data.
+#
+#   python -m benchmarks.generate --out /tmp/bench.db --worlds 4 --longreads 10 --chapters 20 --blocks 25
+import os
+import sys
+import json
+import random
+import argparse
+
+WORDS = ("dragon castle river forest king queen sword shadow tower harbor storm ember frost valley "
+         "temple merchant siege oath crown raven winter bridge ruin lantern pilgrim archive").split()
+MAP_SIZE = 4096
+TIME_SPAN = 100000
+INSERT_CHUNK = 5000
+
+
+def load_service(database_path, workdir=None):
+    # uploads are written relative to the working directory, so a scratch run moves there
+    if workdir is not None:
+        os.makedirs(os.path.join(workdir, "staticFiles", "images"), exist_ok=True)
+        os.chdir(workdir)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import db_service
+    app = db_service.create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.abspath(database_path)})
+    return db_service, app
+
+
+def text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def insert_rows(db_service, model, rows):
+    for start in range(0, len(rows), INSERT_CHUNK):
+        db_service.db.session.execute(db_service.insert(model), rows[start:start + INSERT_CHUNK])
+
+
+def generate(db_service, worlds, longreads, chapters, blocks, worldobjs=20, links=2, events=0.5, spares=0,
+             seed=0):
+    # Expects an empty database; ids are assigned here so the fixture can be returned without
+    # reading anything back. Spares are childless rows reserved for the delete benchmarks.
+    rng = random.Random(seed)
+    rows = {"World": [], "LongRead": [], "Chapter": [], "BlockContent": [], "WorldObj": [], "links": []}
+    fixture = {"worlds": [], "longreads": [], "chapters": [], "blockcontents": [], "worldobjs": [], "events": [],
+               "spares": {"world": [], "longread": [], "chapter": [], "blockcontent": [], "worldobj": []}}
+
+    def add_world(into=None):
+        world_id = len(rows["World"]) + 1
+        rows["World"].append({"id": world_id, "name": text(rng, 2), "description": text(rng, 30),
+                              "img_link": "/staticFiles/images/world_base.jpg"})
+        (fixture["worlds"] if into is None else into).append(world_id)
+        return world_id
+
+    def add_longread(world_id, into=None):
+        longread_id = len(rows["LongRead"]) + 1
+        rows["LongRead"].append({"id": longread_id, "world_id": world_id, "name": text(rng, 3),
+                                 "description": text(rng, 40), "img_link": "/staticFiles/images/font.jpg",
+                                 "map_link": "/staticFiles/images/map_base.jpg",
+                                 "timeline_link": "/staticFiles/images/timeline_base.jpg"})
+        (fixture["longreads"] if into is None else into).append([longread_id, world_id])
+        return longread_id
+
+    def add_chapter(longread_id, into=None):
+        chapter_id = len(rows["Chapter"]) + 1
+        rows["Chapter"].append({"id": chapter_id, "longread_id": longread_id, "name": text(rng, 3)})
+        (fixture["chapters"] if into is None else into).append([chapter_id, longread_id])
+        return chapter_id
+
+    def add_blockcontent(longread_id, chapter_id, world_objs, into=None):
+        blockcontent_id = len(rows["BlockContent"]) + 1
+        row = {"id": blockcontent_id, "longread_id": longread_id, "chapter_id": chapter_id,
+               "text": text(rng, rng.randint(20, 200)), "img_link": "/staticFiles/images/font.jpg",
+               "coordx": None, "coordy": None, "time": None, "floating_text": None}
+        if into is None and rng.random() < events:
+            row.update(coordx=rng.randrange(MAP_SIZE), coordy=rng.randrange(MAP_SIZE),
+                       time=rng.randrange(TIME_SPAN), floating_text=text(rng, 4))
+            fixture["events"].append([blockcontent_id, longread_id])
+        rows["BlockContent"].append(row)
+        for worldobj_id in rng.sample(world_objs, min(links, len(world_objs))):
+            rows["links"].append({"blockcontent_id": blockcontent_id, "worldobj_id": worldobj_id})
+        (fixture["blockcontents"] if into is None else into).append([blockcontent_id, longread_id, chapter_id])
+
+    def add_worldobj(world_id, into=None):
+        worldobj_id = len(rows["WorldObj"]) + 1
+        rows["WorldObj"].append({"id": worldobj_id, "world_id": world_id, "name": text(rng, 2),
+                                 "description": text(rng, 25), "img_link": "/staticFiles/images/worldobj_base.jpg"})
+        (fixture["worldobjs"] if into is None else into).append([worldobj_id, world_id])
+        return worldobj_id
+
+    for _ in range(worlds):
+        world_id = add_world()
+        world_objs = [add_worldobj(world_id) for _ in range(worldobjs)]
+        for _ in range(longreads):
+            longread_id = add_longread(world_id)
+            for _ in range(chapters):
+                chapter_id = add_chapter(longread_id)
+                for _ in range(blocks):
+                    add_blockcontent(longread_id, chapter_id, world_objs)
+
+    if spares:
+        # the spare rows hang off a scratch world that is kept out of the fixture
+        reserved = fixture["spares"]
+        scratch_world = add_world(into=[])
+        scratch_longread = add_longread(scratch_world, into=[])
+        scratch_chapter = add_chapter(scratch_longread, into=[])
+        for _ in range(spares):
+            add_world(into=reserved["world"])
+            add_longread(scratch_world, into=reserved["longread"])
+            add_chapter(scratch_longread, into=reserved["chapter"])
+            add_blockcontent(scratch_longread, scratch_chapter, [], into=reserved["blockcontent"])
+            add_worldobj(scratch_world, into=reserved["worldobj"])
+
+    session = db_service.db.session
+    for model in (db_service.World, db_service.LongRead, db_service.Chapter, db_service.BlockContent,
+                  db_service.WorldObj):
+        insert_rows(db_service, model, rows[model.__tablename__])
+    insert_rows(db_service, db_service.blockcontents, rows["links"])
+    db_service.search_rebuild(session)
+    db_service.event_rebuild(session)
+    db_service.timeline_rebuild(session)
+    session.commit()
+    return fixture
+
+
+def add_arguments(parser):
+    parser.add_argument("--worlds", type=int, default=2)
+    parser.add_argument("--longreads", type=int, default=5, help="per world")
+    parser.add_argument("--chapters", type=int, default=10, help="per longread")
+    parser.add_argument("--blocks", type=int, default=20, help="per chapter")
+    parser.add_argument("--worldobjs", type=int, default=20, help="per world")
+    parser.add_argument("--links", type=int, default=2, help="worldobjs linked to each block")
+    parser.add_argument("--events", type=float, default=0.5, help="share of blocks that are events")
+    parser.add_argument("--seed", type=int, default=0)
+
+
+def generate_args(args):
+    return {"worlds": args.worlds, "longreads": args.longreads, "chapters": args.chapters, "blocks": args.blocks,
+            "worldobjs": args.worldobjs, "links": args.links, "events": args.events, "seed": args.seed}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", required=True, help="sqlite file to create")
+    parser.add_argument("--fixture", help="write the generated ids as json here")
+    add_arguments(parser)
+    args = parser.parse_args()
+    if os.path.exists(args.out):
+        parser.error(args.out + " already exists")
+
+    db_service, app = load_service(args.out)
+    with app.app_context():
+        fixture = generate(db_service, **generate_args(args))
+    if args.fixture:
+        with open(args.fixture, "w") as f:
+            json.dump(fixture, f)
+    print(json.dumps({name: len(ids) for name, ids in fixture.items() if name != "spares"}))
+
+
+if __name__ == "__main__":
+    main()
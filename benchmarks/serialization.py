@@ -0,0 +1,102 @@
+# Before/after comparison of the listing serializer: ORM instances copied through
+# __dict__ (the old model_to_json) versus Core rows encoded straight from the
+# SERIALIZED_FIELDS projections.
+#
+#   python -m benchmarks.serialization --blocks 20000 --repeat 5
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+
+def legacy_model_to_json(obj):
+    return {k: v for k, v in obj.__dict__.items() if k != "_sa_instance_state"}
+
+
+def seed(db_service, blocks, chapters):
+    db = db_service.db
+    db.create_all()
+    world = db_service.World(name="bench", description="bench world")
+    db.session.add(world)
+    db.session.flush()
+    longread = db_service.LongRead(world_id=world.id, name="bench", description="bench longread")
+    db.session.add(longread)
+    db.session.flush()
+    chapter_ids = []
+    for i in range(chapters):
+        chapter = db_service.Chapter(name="chapter %d" % i, longread_id=longread.id)
+        db.session.add(chapter)
+        db.session.flush()
+        chapter_ids.append(chapter.id)
+    rows = [{"longread_id": longread.id,
+             "chapter_id": chapter_ids[i % chapters],
+             "text": "lorem ipsum dolor sit amet " * 40,
+             "img_link": "/staticFiles/images/font.jpg",
+             "coordx": i % 1000, "coordy": i % 777, "time": i, "floating_text": "event %d" % i}
+            for i in range(blocks)]
+    db.session.execute(db_service.insert(db_service.BlockContent), rows)
+    db.session.commit()
+    return longread.id
+
+
+def measure(fn, repeat):
+    best = None
+    for _ in range(repeat):
+        db_service.db.session.expunge_all()
+        start = time.perf_counter()
+        count = fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {"rows": count, "seconds": round(best, 4), "rows_per_sec": round(count / best)}
+
+
+def main():
+    global db_service
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--blocks", type=int, default=20000)
+    parser.add_argument("--chapters", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="darts-bench-")
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import db_service
+
+    app = db_service.create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///" + os.path.join(workdir, "bench.db")})
+    BlockContent = db_service.BlockContent
+    client = app.test_client()
+    with app.app_context():
+        longread_id = seed(db_service, args.blocks, args.chapters)
+
+        def orm_dict():
+            rows = [legacy_model_to_json(bc) for bc in BlockContent.query.filter_by(longread_id=longread_id)]
+            app.json.dumps(rows)
+            return len(rows)
+
+        def core_rows():
+            rows = db_service.fetch_json(BlockContent, BlockContent.longread_id == longread_id)
+            app.json.dumps(rows)
+            return len(rows)
+
+        def endpoint_ndjson():
+            response = client.post("/longread/blockcontent/all", json={"longread_id": longread_id},
+                                   headers={"Accept": "application/x-ndjson"})
+            return response.get_data().count(b"\n")
+
+        def endpoint_page():
+            response = client.post("/longread/blockcontent/all", json={"longread_id": longread_id, "limit": 1000})
+            return len(response.get_json()["items"])
+
+        results = {
+            "before_orm_model_to_json": measure(orm_dict, args.repeat),
+            "after_core_projection": measure(core_rows, args.repeat),
+            "endpoint_longread_blockcontent_all_ndjson": measure(endpoint_ndjson, args.repeat),
+            "endpoint_longread_blockcontent_all_page_1000": measure(endpoint_page, args.repeat),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,44 +1,238 @@
 import os
+import copy
+import re
+import sys
+import json
+import time
+import math
+import base64
+import shutil
+import tarfile
+import tempfile
+import io
+import zlib
+import hashlib
+import heapq
+import itertools
 import datetime
+import functools
+import threading
+import contextlib
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import asyncio
+import click
 import sqlalchemy
-from flask import Flask, render_template, request, url_for, redirect, session, jsonify
+from flask import Flask, Blueprint, current_app, render_template, request, url_for, redirect, session, jsonify, stream_with_context, abort, g, has_request_context
+from flask import make_response
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.types import TIMESTAMP
-from sqlalchemy import func
+from sqlalchemy import func, select, insert, update, delete, or_, event, literal, literal_column, null, table, column, tuple_
+from sqlalchemy.orm import Session
 from werkzeug.utils import secure_filename
+from werkzeug.local import LocalProxy
+from werkzeug.exceptions import HTTPException
 
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
 
-basedir = os.path.abspath(os.path.dirname(__file__))
-UPLOAD_FOLDER = os.path.join('staticFiles', 'images')
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-app = Flask(__name__, template_folder='templates', static_folder='staticFiles')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(basedir, 'sqlite_darts.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.secret_key = 'Secret key'
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
-db = SQLAlchemy(app)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
+try:
+    from sqlalchemy.ext.asyncio import create_async_engine
+except ImportError:
+    create_async_engine = None
 
-def model_to_json(obj):
-    return {k: v for k, v in obj.__dict__.items() if k != "_sa_instance_state"}
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+UPLOAD_FOLDER = os.path.join('staticFiles', 'images')
+
+# Settings of every app; create_app() layers the DARTS_CONFIG file and its own argument on top.
+DEFAULT_CONFIG = {
+    'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(basedir, 'sqlite_darts.db'),
+    'SQLALCHEMY_TRACK_MODIFICATIONS': False,
+    'UPLOAD_FOLDER': UPLOAD_FOLDER,
+    'READ_CACHE_MAX_ENTRIES': 10000,
+    'READ_CACHE_MAX_BYTES': 64 * 1024 * 1024,
+    # the read cache is per process and writers only invalidate their own, so with several
+    # workers the TTL bounds how stale another worker's entries can get
+    'READ_CACHE_TTL': 5,
+    'HTTP_CACHE_MAX_AGE': 0,
+    'SQLITE_PRAGMAS': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'cache_size': -64000,
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+    },
+    'SQLITE_POOL_OPTIONS': {'pool_size': 5, 'max_overflow': 5, 'pool_timeout': 30},
+    'SQLITE_READ_POOL_OPTIONS': {'pool_size': 20, 'max_overflow': 20, 'pool_timeout': 30},
+    'IMAGE_MAX_BYTES': 16 * 1024 * 1024,
+    'IMAGE_MAX_PIXELS': 40_000_000,
+    'IMAGE_VARIANTS': {'thumb': 128, 'medium': 1024, 'full': 2560},
+    'IMAGE_WORKERS': 2,
+    'IMAGE_TIMEOUT': 60,
+    'IMAGE_CACHE_MAX_AGE': 365 * 24 * 3600,
+    'IMAGE_GC_GRACE': 24 * 3600,
+    'JOB_WORKERS': 2,
+    'JOB_MAX_ATTEMPTS': 5,
+    'JOB_RETRY_DELAY': 5,
+    'JOB_LEASE': 600,
+    'JOB_POLL_INTERVAL': 30,
+    'MAP_MAX_BYTES': 64 * 1024 * 1024,
+    'MAP_MAX_PIXELS': 256_000_000,
+    'MAP_VARIANTS': {'thumb': 128, 'medium': 1024, 'full': None},
+    'MAP_TILE_SIZE': 256,
+    'MAP_TILE_OVERLAP': 1,
+    'SLOW_REQUEST_SECONDS': 1.0,
+    'SLOW_REQUEST_MAX_STATEMENTS': 50,
+    'NPLUSONE_MODE': None,
+    'NPLUSONE_THRESHOLD': 10,
+    'JSON_PROVIDER': 'orjson',
+    'COMPRESSION_ENCODINGS': ['zstd', 'br', 'gzip'],
+    'COMPRESSION_LEVELS': {'zstd': 3, 'br': 5, 'gzip': 6},
+    'COMPRESSION_MIN_SIZE': 1024,
+    'COMPRESSION_MIMETYPES': ['application/json', 'application/x-ndjson', 'text/plain', 'text/html', 'text/css',
+                              'text/javascript', 'application/javascript'],
+    'ARCHIVE_MAX_BYTES': 64 * 1024 ** 3,
+    'ASYNC_POOL_OPTIONS': {'pool_size': 20, 'max_overflow': 20, 'pool_timeout': 30},
+    'ASGI_THREADS': 32,
+    'ASGI_SPOOL_MEMORY': 1024 * 1024,
+    'SECRET_KEY': 'Secret key',
+}
+
+# environment variables that override single settings
+ENVIRONMENT_CONFIG = {
+    'DARTS_DATABASE_URI': 'SQLALCHEMY_DATABASE_URI',
+    'DARTS_NPLUSONE': 'NPLUSONE_MODE',
+    'DARTS_ASYNC_DATABASE_URI': 'ASYNC_DATABASE_URI',
+}
+
+
+def sqlite_file_path(uri):
+    url = sqlalchemy.engine.make_url(uri)
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:') or url.database.startswith('file:'):
+        return None
+    return url.database
+
+
+db = SQLAlchemy()
+bp = Blueprint('darts', __name__, cli_group=None)
+
+
+def configure_database(config):
+    # File-backed SQLite gets a tuned writer pool plus a separate read-only pool ("read" bind)
+    # that the read endpoints use, so readers never queue behind the single writer. The ASGI
+    # app reads the same file through aiosqlite.
+    path = sqlite_file_path(config['SQLALCHEMY_DATABASE_URI'])
+    if path:
+        config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', dict(config['SQLITE_POOL_OPTIONS']))
+        config.setdefault('SQLALCHEMY_BINDS', {
+            'read': {'url': 'sqlite:///file:' + path + '?mode=ro&uri=true', **config['SQLITE_READ_POOL_OPTIONS']},
+        })
+        config.setdefault('ASYNC_DATABASE_URI', 'sqlite+aiosqlite:///file:' + path + '?mode=ro&uri=true')
+
+
+def configure_sqlite_engine(engine, pragmas, begin_statement):
+    # pysqlite's own implicit BEGIN is turned off so that writers can take the lock up
+    # front with BEGIN IMMEDIATE (and wait on busy_timeout) instead of failing when a
+    # deferred read transaction tries to upgrade.
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def on_begin(connection):
+        connection.exec_driver_sql(begin_statement)
+
+
+def sqlite_read_pragmas(config):
+    read_pragmas = {k: v for k, v in config['SQLITE_PRAGMAS'].items() if k != 'journal_mode'}
+    read_pragmas['query_only'] = 'ON'
+    return read_pragmas
+
+
+def configure_engines(config):
+    if db.engine.dialect.name == 'sqlite':
+        configure_sqlite_engine(db.engine, config['SQLITE_PRAGMAS'], "BEGIN IMMEDIATE")
+    if 'read' in db.engines:
+        configure_sqlite_engine(db.engines['read'], sqlite_read_pragmas(config), "BEGIN")
+
+
+def read_engine():
+    return db.engines.get('read', db.engine)
+
+
+def read_execute(statement):
+    return db.session.execute(statement, bind_arguments={"bind": read_engine()})
+
+
+def read_scalar(statement):
+    # on a connection of its own, so a job can look something up without keeping a
+    # transaction (and, without a read pool, the write lock) open while it renders
+    with read_engine().connect() as connection:
+        return connection.execute(statement).scalar()
+
+
+PAGE_DEFAULT_LIMIT = 100
+PAGE_MAX_LIMIT = 1000
+STREAM_BATCH_SIZE = 1000
+MERGE_BATCH_SIZE = 50
+
+DEFAULT_IMAGES = {
+    "/staticFiles/images/QuestionMark.jpg",
+    "/staticFiles/images/font.jpg",
+    "/staticFiles/images/map_base.jpg",
+    "/staticFiles/images/timeline_base.jpg",
+    "/staticFiles/images/world_base.jpg",
+    "/staticFiles/images/worldobj_base.jpg",
+}
 
 
 class LongRead(db.Model):
     __tablename__ = 'LongRead'
     id = db.Column(db.Integer, primary_key=True)
-    world_id = db.Column(db.Integer, db.ForeignKey('World.id'), nullable=False)
+    world_id = db.Column(db.Integer, db.ForeignKey('World.id'), nullable=False, index=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.String(1000), nullable=False)
     img_link = db.Column(db.String(200), nullable=True)
+    img_variants = db.Column(db.JSON, nullable=True)
 
     # timeline attributes
     map_link = db.Column(db.String(200), nullable=True)
+    map_variants = db.Column(db.JSON, nullable=True)
+    map_tiles = db.Column(db.JSON, nullable=True)
     timeline_link = db.Column(db.String(200), nullable=True)
+    timeline_variants = db.Column(db.JSON, nullable=True)
+
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
 
     chapters = db.relationship('Chapter', backref='longread', lazy=True)
     blockcontents = db.relationship('BlockContent', backref='longread', lazy=True)
 
+    __table_args__ = (db.Index('ix_LongRead_world_id_version', 'world_id', 'version'),)
+
     def __repr__(self):
         return f'<LongRead {self.name}>'
 
@@ -47,10 +241,13 @@ class Chapter(db.Model):
     __tablename__ = 'Chapter'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    longread_id = db.Column(db.Integer, db.ForeignKey('LongRead.id'), nullable=False)
+    longread_id = db.Column(db.Integer, db.ForeignKey('LongRead.id'), nullable=False, index=True)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
 
     blockcontents = db.relationship('BlockContent', backref='chapter', lazy=True)
 
+    __table_args__ = (db.Index('ix_Chapter_longread_id_version', 'longread_id', 'version'),)
+
     def __repr__(self):
         return f'<Chapter {self.name}>'
 
@@ -58,10 +255,11 @@ class Chapter(db.Model):
 class BlockContent(db.Model):
     __tablename__ = 'BlockContent'
     id = db.Column(db.Integer, primary_key=True)
-    longread_id = db.Column(db.Integer, db.ForeignKey('LongRead.id'), nullable=False)
-    chapter_id = db.Column(db.Integer, db.ForeignKey('Chapter.id'), nullable=False)
+    longread_id = db.Column(db.Integer, db.ForeignKey('LongRead.id'), nullable=False, index=True)
+    chapter_id = db.Column(db.Integer, db.ForeignKey('Chapter.id'), nullable=False, index=True)
     text = db.Column(db.String(10000), nullable=True)
     img_link = db.Column(db.String(200), nullable=True)
+    img_variants = db.Column(db.JSON, nullable=True)
 
     # event attributes
     coordx = db.Column(db.Integer, nullable=True)
@@ -69,6 +267,12 @@ class BlockContent(db.Model):
     time = db.Column(db.Integer, nullable=True)
     floating_text = db.Column(db.String(200), nullable=True)
 
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+
+    __table_args__ = (db.Index('ix_BlockContent_longread_id_version', 'longread_id', 'version'),
+                      db.Index('ix_BlockContent_chapter_id_version', 'chapter_id', 'version'),
+                      db.Index('ix_BlockContent_longread_id_time', 'longread_id', 'time'))
+
     def __repr__(self):
         return f'<BlockContent {self.id}>'
 
@@ -78,7 +282,9 @@ class World(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     img_link = db.Column(db.String(200), nullable=True)
+    img_variants = db.Column(db.JSON, nullable=True)
     description = db.Column(db.String(10000), nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
 
     longreads = db.relationship('LongRead', backref='world', lazy=True)
     worldobjs = db.relationship('WorldObj', backref='world', lazy=True)
@@ -89,7 +295,8 @@ class World(db.Model):
 
 blockcontents = db.Table('blockcontents',
                          db.Column('blockcontent_id', db.Integer, db.ForeignKey('BlockContent.id'), primary_key=True),
-                         db.Column('worldobj_id', db.Integer, db.ForeignKey('WorldObj.id'), primary_key=True)
+                         db.Column('worldobj_id', db.Integer, db.ForeignKey('WorldObj.id'), primary_key=True),
+                         db.Index('ix_blockcontents_worldobj_id', 'worldobj_id', 'blockcontent_id')
                          )
 
 
@@ -97,47 +304,1725 @@ class WorldObj(db.Model):
     __tablename__ = 'WorldObj'
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=True)
-    world_id = db.Column(db.Integer, db.ForeignKey('World.id'), nullable=False)
+    world_id = db.Column(db.Integer, db.ForeignKey('World.id'), nullable=False, index=True)
     description = db.Column(db.String(1000), nullable=False)
     img_link = db.Column(db.String(200), nullable=True)
+    img_variants = db.Column(db.JSON, nullable=True)
+    version = db.Column(db.Integer, nullable=False, default=1, server_default='1')
 
     blockcontents = db.relationship('BlockContent',
                                     secondary=blockcontents,
                                     lazy='subquery',
                                     backref=db.backref('worldobj', lazy=True))
 
+    __table_args__ = (db.Index('ix_WorldObj_world_id_version', 'world_id', 'version'),)
+
     def __repr__(self):
         return f'<WorldObj {self.name}>'
 
 
+# Single-row counter handing out the values stored in every model's version column.
+# The sequence is global, so a re-inserted id never repeats an old version and
+# (count, max(version)) identifies the state of any set of rows.
+change_seq = db.Table('change_seq',
+                      db.Column('id', db.Integer, primary_key=True),
+                      db.Column('value', db.Integer, nullable=False)
+                      )
+
+VERSIONED_MODELS = (World, LongRead, Chapter, BlockContent, WorldObj)
+
+# One row per deleted row of a versioned model, stamped with the change sequence value of the
+# delete, so /world/changes can report deletes next to the rows written since a client's last sync.
+tombstone = db.Table('tombstone',
+                     db.Column('id', db.Integer, primary_key=True),
+                     db.Column('entity', db.String(20), nullable=False),
+                     db.Column('entity_id', db.Integer, nullable=False),
+                     db.Column('world_id', db.Integer, nullable=False),
+                     db.Column('version', db.Integer, nullable=False),
+                     db.Index('ix_tombstone_world_id_version', 'world_id', 'version'),
+                     db.Index('ix_tombstone_version', 'version')
+                     )
+
+# entity names used by /world/changes and the tombstones, parents first
+SYNC_ENTITIES = {World: "world", LongRead: "longread", WorldObj: "worldobj", Chapter: "chapter",
+                 BlockContent: "blockcontent"}
+
+
+def next_change_seq(connection=None):
+    connection = connection or db.session.connection()
+    return connection.execute(update(change_seq).where(change_seq.c.id == 1)
+                              .values(value=change_seq.c.value + 1)
+                              .returning(change_seq.c.value)).scalar_one()
+
+
+@event.listens_for(Session, "before_flush")
+def assign_versions(session, flush_context, instances):
+    changed = [obj for obj in session.new if isinstance(obj, VERSIONED_MODELS)]
+    changed += [obj for obj in session.dirty
+                if isinstance(obj, VERSIONED_MODELS) and session.is_modified(obj, include_collections=False)]
+    if changed:
+        version = next_change_seq(session.connection())
+        for obj in changed:
+            obj.version = version
+
+
+# FTS5 index over the searchable text of every entity. The rowid encodes the source row
+# (id * 4 + SEARCH_CODES[model]) so a document is replaced or removed by rowid lookup.
+SEARCH_INDEX_DDL = ("CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5("
+                    "title, body, entity UNINDEXED, entity_id UNINDEXED, world_id UNINDEXED, longread_id UNINDEXED, "
+                    "tokenize = 'unicode61 remove_diacritics 2')")
+search_index = table('search_index', column('rowid'), column('title'), column('body'), column('entity'),
+                     column('entity_id'), column('world_id'), column('longread_id'), column('search_index'))
+SEARCH_CODES = {BlockContent: 0, LongRead: 1, World: 2, WorldObj: 3}
+SEARCH_ENTITIES = {BlockContent: "blockcontent", LongRead: "longread", World: "world", WorldObj: "worldobj"}
+SEARCH_MODELS = {model.__tablename__: model for model in SEARCH_CODES}
+
+
+def search_documents(model, ids=None):
+    if model is BlockContent:
+        world_id = select(LongRead.world_id).where(LongRead.id == BlockContent.longread_id).scalar_subquery()
+        fields = (BlockContent.floating_text, BlockContent.text, world_id, BlockContent.longread_id)
+    elif model is LongRead:
+        fields = (LongRead.name, LongRead.description, LongRead.world_id, LongRead.id)
+    elif model is World:
+        fields = (World.name, World.description, World.id, null())
+    else:
+        fields = (WorldObj.name, WorldObj.description, WorldObj.world_id, null())
+    statement = select(model.id * 4 + SEARCH_CODES[model], fields[0], fields[1],
+                       literal(SEARCH_ENTITIES[model]), model.id, fields[2], fields[3])
+    if ids is not None:
+        statement = statement.where(model.id.in_(ids))
+    return statement
+
+
+def search_remove(model, ids, executor=None):
+    # works from the ids alone, so it also clears documents whose rows are already deleted
+    executor = executor or db.session
+    rowids = [entity_id * 4 + SEARCH_CODES[model] for entity_id in ids]
+    executor.execute(delete(search_index).where(search_index.c.rowid.in_(rowids)))
+
+
+def search_reindex(model, ids, executor=None):
+    executor = executor or db.session
+    ids = list(ids)
+    if executor is db.session:
+        db.session.flush()
+    search_remove(model, ids, executor)
+    executor.execute(insert(search_index).from_select(
+        ['rowid', 'title', 'body', 'entity', 'entity_id', 'world_id', 'longread_id'], search_documents(model, ids)))
+
+
+def search_rebuild(executor):
+    executor.execute(delete(search_index))
+    for model in SEARCH_CODES:
+        executor.execute(insert(search_index).from_select(
+            ['rowid', 'title', 'body', 'entity', 'entity_id', 'world_id', 'longread_id'], search_documents(model)))
+    executor.execute(insert(search_index).values(search_index="optimize"))
+
+
+# R*Tree over the map position of every event (blockcontents with both coordx and coordy);
+# the id column is the BlockContent id. Time ranges go through ix_BlockContent_longread_id_time.
+EVENT_INDEX_DDL = "CREATE VIRTUAL TABLE IF NOT EXISTS event_index USING rtree_i32(id, min_x, max_x, min_y, max_y)"
+event_index = table('event_index', column('id'), column('min_x'), column('max_x'), column('min_y'), column('max_y'))
+
+
+# rtree_i32 keeps coordinates as 32-bit integers
+EVENT_COORDINATE_MIN, EVENT_COORDINATE_MAX = -2 ** 31, 2 ** 31 - 1
+
+
+def whole_number(value, low, high):
+    # a JSON number without a fraction (or a string of one) from low to high; TypeError or
+    # ValueError otherwise
+    if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+        raise ValueError("not a whole number")
+    value = int(value)
+    if not low <= value <= high:
+        raise ValueError("out of range")
+    return value
+
+
+def event_coordinate(value):
+    # an event is on the map when both coordinates are set
+    return None if value is None else whole_number(value, EVENT_COORDINATE_MIN, EVENT_COORDINATE_MAX)
+
+
+def event_positions(ids=None):
+    statement = (select(BlockContent.id, BlockContent.coordx, BlockContent.coordx, BlockContent.coordy, BlockContent.coordy)
+                 .where(BlockContent.coordx.is_not(None), BlockContent.coordy.is_not(None)))
+    if ids is not None:
+        statement = statement.where(BlockContent.id.in_(ids))
+    return statement
+
+
+def event_remove(ids, executor=None):
+    executor = executor or db.session
+    executor.execute(delete(event_index).where(event_index.c.id.in_(ids)))
+
+
+def event_reindex(ids, executor=None):
+    executor = executor or db.session
+    if executor is db.session:
+        db.session.flush()
+    event_remove(ids, executor)
+    executor.execute(insert(event_index).from_select(
+        ['id', 'min_x', 'max_x', 'min_y', 'max_y'], event_positions(ids)))
+
+
+def event_rebuild(executor):
+    executor.execute(delete(event_index))
+    executor.execute(insert(event_index).from_select(['id', 'min_x', 'max_x', 'min_y', 'max_y'], event_positions()))
+
+
+# Event counts per longread in fixed-width time buckets, one set per timeline zoom level.
+# Writers call timeline_refresh() with the (longread_id, time) of every event they add,
+# move or remove, and only those buckets are recomputed.
+TIMELINE_BUCKET_WIDTHS = (1, 10, 100, 1000, 10000)
+
+timeline_bucket = db.Table('timeline_bucket',
+                           db.Column('longread_id', db.Integer, primary_key=True),
+                           db.Column('width', db.Integer, primary_key=True),
+                           db.Column('bucket', db.Integer, primary_key=True),
+                           db.Column('count', db.Integer, nullable=False),
+                           db.Column('min_time', db.Integer, nullable=False),
+                           db.Column('max_time', db.Integer, nullable=False),
+                           db.Column('floating_text', db.String(200), nullable=True)
+                           )
+
+
+def timeline_bucket_of(width):
+    # floor(time / width); SQLite integer division truncates toward zero
+    return sqlalchemy.case((BlockContent.time >= 0, BlockContent.time // width),
+                           else_=(BlockContent.time - (width - 1)) // width)
+
+
+def timeline_aggregates(width, *criteria):
+    bucket = timeline_bucket_of(width)
+    grouped = (select(BlockContent.longread_id, bucket.label("bucket"), func.count().label("count"),
+                      func.min(BlockContent.time).label("min_time"), func.max(BlockContent.time).label("max_time"))
+               .where(BlockContent.time.is_not(None), *criteria)
+               .group_by(BlockContent.longread_id, bucket)
+               .subquery())
+    # the earliest event of the bucket stands in for it on the timeline
+    representative = (select(BlockContent.floating_text)
+                      .where(BlockContent.longread_id == grouped.c.longread_id,
+                             BlockContent.time == grouped.c.min_time)
+                      .order_by(BlockContent.id).limit(1)
+                      .scalar_subquery())
+    return select(grouped.c.longread_id, literal(width), grouped.c.bucket, grouped.c.count,
+                  grouped.c.min_time, grouped.c.max_time, representative)
+
+
+# SQLite stores integers in 64 bits and raises OverflowError for anything larger; event times
+# keep the widest bucket's width clear of both ends, so bucket bounds never overflow either
+SQLITE_INTEGER_MIN, SQLITE_INTEGER_MAX = -2 ** 63, 2 ** 63 - 1
+EVENT_TIME_MIN = SQLITE_INTEGER_MIN + max(TIMELINE_BUCKET_WIDTHS)
+EVENT_TIME_MAX = SQLITE_INTEGER_MAX - max(TIMELINE_BUCKET_WIDTHS)
+
+
+def event_time(value):
+    # the timeline buckets by integer division, so an event time is a whole number or null
+    return None if value is None else whole_number(value, EVENT_TIME_MIN, EVENT_TIME_MAX)
+
+
+def timeline_refresh(events, executor=None):
+    executor = executor or db.session
+    if executor is db.session:
+        db.session.flush()
+    touched = {}
+    for longread_id, time in events:
+        # anything else (a row written before times were validated) has no bucket
+        if isinstance(time, int):
+            for width in TIMELINE_BUCKET_WIDTHS:
+                touched.setdefault((longread_id, width), set()).add(time // width)
+    for (longread_id, width), buckets in touched.items():
+        executor.execute(delete(timeline_bucket).where(timeline_bucket.c.longread_id == longread_id,
+                                                       timeline_bucket.c.width == width,
+                                                       timeline_bucket.c.bucket.in_(buckets)))
+        executor.execute(insert(timeline_bucket).from_select(
+            ['longread_id', 'width', 'bucket', 'count', 'min_time', 'max_time', 'floating_text'],
+            timeline_aggregates(width, BlockContent.longread_id == longread_id,
+                                BlockContent.time >= min(buckets) * width,
+                                BlockContent.time < (max(buckets) + 1) * width,
+                                timeline_bucket_of(width).in_(buckets))))
+
+
+def timeline_rebuild(executor):
+    executor.execute(delete(timeline_bucket))
+    for width in TIMELINE_BUCKET_WIDTHS:
+        executor.execute(insert(timeline_bucket).from_select(
+            ['longread_id', 'width', 'bucket', 'count', 'min_time', 'max_time', 'floating_text'],
+            timeline_aggregates(width)))
+
+
+# Image files are content-addressed blobs: the link names the hash of the bytes, so equal
+# uploads share one file. image_ref records which entity slot (e.g. LongRead 3 "map") uses
+# which blob. A blob whose last reference goes away gets released_at and is deleted by
+# collect_image_garbage() once it has stayed unreferenced for IMAGE_GC_GRACE seconds.
+image_blob = db.Table('image_blob',
+                      db.Column('link', db.String(200), primary_key=True),
+                      db.Column('created_at', db.Integer, nullable=False),
+                      db.Column('released_at', db.Integer, nullable=True, index=True)
+                      )
+
+image_ref = db.Table('image_ref',
+                     db.Column('entity', db.String(20), primary_key=True),
+                     db.Column('entity_id', db.Integer, primary_key=True),
+                     db.Column('slot', db.String(20), primary_key=True),
+                     db.Column('link', db.String(200), primary_key=True),
+                     db.Index('ix_image_ref_link', 'link')
+                     )
+
+IMAGE_SLOTS = {World: ("img",), LongRead: ("img", "map", "timeline"), BlockContent: ("img",), WorldObj: ("img",)}
+
+
+def mark_released(links, executor=None):
+    executor = executor or db.session
+    referenced = select(image_ref.c.link).where(image_ref.c.link == image_blob.c.link).exists()
+    executor.execute(update(image_blob)
+                     .where(image_blob.c.link.in_(links), ~referenced, image_blob.c.released_at.is_(None))
+                     .values(released_at=int(time.time())))
+    executor.execute(update(image_blob)
+                     .where(image_blob.c.link.in_(links), referenced, image_blob.c.released_at.is_not(None))
+                     .values(released_at=None))
+
+
+def ref_images(entity, entity_id, slot, links, executor=None):
+    # Points one slot of an entity at a new set of blobs, registering blobs seen for the first time.
+    executor = executor or db.session
+    links = {link for link in links if link and link not in DEFAULT_IMAGES}
+    slot_refs = (image_ref.c.entity == entity, image_ref.c.entity_id == entity_id, image_ref.c.slot == slot)
+    old_links = set(executor.scalars(select(image_ref.c.link).where(*slot_refs)))
+    executor.execute(delete(image_ref).where(*slot_refs))
+    if links:
+        now = int(time.time())
+        executor.execute(insert(image_blob).prefix_with("OR IGNORE"),
+                         [{"link": link, "created_at": now} for link in links])
+        executor.execute(insert(image_ref),
+                         [{"entity": entity, "entity_id": entity_id, "slot": slot, "link": link} for link in links])
+    mark_released(old_links | links, executor)
+
+
+def release_images(entity, entity_ids, executor=None):
+    executor = executor or db.session
+    entity_refs = (image_ref.c.entity == entity, image_ref.c.entity_id.in_(entity_ids))
+    links = executor.scalars(select(image_ref.c.link).distinct().where(*entity_refs)).all()
+    executor.execute(delete(image_ref).where(*entity_refs))
+    mark_released(links, executor)
+
+
+# Transactional outbox: handlers insert jobs in their own transaction and a local worker
+# pool runs them after commit (see the job section below). Jobs sharing a target are
+# "latest wins": a job is skipped when a newer one for the same target is queued.
+job_outbox = db.Table('job_outbox',
+                      db.Column('id', db.Integer, primary_key=True),
+                      db.Column('kind', db.String(50), nullable=False),
+                      db.Column('target', db.String(100), nullable=True, index=True),
+                      db.Column('payload', db.JSON, nullable=False),
+                      db.Column('attempts', db.Integer, nullable=False, default=0),
+                      db.Column('run_after', db.Float, nullable=False),
+                      db.Column('failed_at', db.Float, nullable=True),
+                      db.Column('last_error', db.String(1000), nullable=True),
+                      db.Index('ix_job_outbox_due', 'failed_at', 'run_after')
+                      )
+
+
+def migrate_add_versions(connection):
+    for model in VERSIONED_MODELS:
+        connection.exec_driver_sql(
+            f'ALTER TABLE "{model.__tablename__}" ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+    change_seq.create(connection)
+
+
+def migrate_add_foreign_key_indexes(connection):
+    # (parent_id) serves "WHERE parent_id = ? AND id > ? ORDER BY id" pages, since SQLite
+    # appends the rowid to every index; (parent_id, version) covers the ETag aggregates.
+    for statement in (
+        'CREATE INDEX IF NOT EXISTS "ix_LongRead_world_id" ON "LongRead" (world_id)',
+        'CREATE INDEX IF NOT EXISTS "ix_LongRead_world_id_version" ON "LongRead" (world_id, version)',
+        'CREATE INDEX IF NOT EXISTS "ix_Chapter_longread_id" ON "Chapter" (longread_id)',
+        'CREATE INDEX IF NOT EXISTS "ix_Chapter_longread_id_version" ON "Chapter" (longread_id, version)',
+        'CREATE INDEX IF NOT EXISTS "ix_BlockContent_longread_id" ON "BlockContent" (longread_id)',
+        'CREATE INDEX IF NOT EXISTS "ix_BlockContent_chapter_id" ON "BlockContent" (chapter_id)',
+        'CREATE INDEX IF NOT EXISTS "ix_BlockContent_longread_id_version" ON "BlockContent" (longread_id, version)',
+        'CREATE INDEX IF NOT EXISTS "ix_BlockContent_chapter_id_version" ON "BlockContent" (chapter_id, version)',
+        'CREATE INDEX IF NOT EXISTS "ix_WorldObj_world_id" ON "WorldObj" (world_id)',
+        'CREATE INDEX IF NOT EXISTS "ix_WorldObj_world_id_version" ON "WorldObj" (world_id, version)',
+        'CREATE INDEX IF NOT EXISTS "ix_blockcontents_worldobj_id" ON blockcontents (worldobj_id, blockcontent_id)',
+    ):
+        connection.exec_driver_sql(statement)
+
+
+def migrate_add_search_index(connection):
+    connection.exec_driver_sql(SEARCH_INDEX_DDL)
+    search_rebuild(connection)
+
+
+def normalize_event_coordinates(connection):
+    # Coordinates were stored unchecked before the event index existed; rtree_i32 would read
+    # text as 0. A fraction is truncated, and anything else, or outside 32 bits, is cleared.
+    for coordinate in (BlockContent.coordx, BlockContent.coordy):
+        connection.execute(update(BlockContent.__table__).where(func.typeof(coordinate) == "real").values(
+            {coordinate: sqlalchemy.cast(coordinate, sqlalchemy.Integer)}))
+        connection.execute(update(BlockContent.__table__).where(
+            coordinate.is_not(None),
+            or_(func.typeof(coordinate) != "integer",
+                ~coordinate.between(EVENT_COORDINATE_MIN, EVENT_COORDINATE_MAX))).values({coordinate: None}))
+
+
+def migrate_add_event_index(connection):
+    connection.exec_driver_sql(
+        'CREATE INDEX IF NOT EXISTS "ix_BlockContent_longread_id_time" ON "BlockContent" (longread_id, time)')
+    connection.exec_driver_sql(EVENT_INDEX_DDL)
+    normalize_event_coordinates(connection)
+    event_rebuild(connection)
+
+
+def normalize_event_times(connection):
+    # The original contract stored a datetime in BlockContent.time, which SQLite keeps as text.
+    # Text becomes Unix seconds where strftime() can read it, a fraction is truncated, and
+    # anything else, or out of event_time()'s range, is cleared, so the timeline only ever
+    # buckets integers.
+    time_type = func.typeof(BlockContent.time)
+    connection.execute(update(BlockContent.__table__).where(time_type == "text").values(
+        time=sqlalchemy.cast(func.strftime("%s", BlockContent.time), sqlalchemy.Integer)))
+    connection.execute(update(BlockContent.__table__).where(time_type == "real").values(
+        time=sqlalchemy.cast(BlockContent.time, sqlalchemy.Integer)))
+    connection.execute(update(BlockContent.__table__).where(
+        BlockContent.time.is_not(None),
+        or_(time_type != "integer", ~BlockContent.time.between(EVENT_TIME_MIN, EVENT_TIME_MAX))).values(time=None))
+
+
+def migrate_add_timeline_buckets(connection):
+    normalize_event_times(connection)
+    timeline_bucket.create(connection, checkfirst=True)
+    timeline_rebuild(connection)
+
+
+def migrate_add_image_variants(connection):
+    for table_name, column_name in (("World", "img_variants"), ("LongRead", "img_variants"),
+                                    ("LongRead", "map_variants"), ("LongRead", "timeline_variants"),
+                                    ("BlockContent", "img_variants"), ("WorldObj", "img_variants")):
+        connection.exec_driver_sql(f'ALTER TABLE "{table_name}" ADD COLUMN {column_name} JSON')
+
+
+def migrate_add_map_tiles(connection):
+    connection.exec_driver_sql('ALTER TABLE "LongRead" ADD COLUMN map_tiles JSON')
+
+
+def migrate_add_image_store(connection):
+    image_blob.create(connection, checkfirst=True)
+    image_ref.create(connection, checkfirst=True)
+    for model, slots in IMAGE_SLOTS.items():
+        for slot in slots:
+            rows = connection.execute(select(model.id, getattr(model, slot + "_link"),
+                                             getattr(model, slot + "_variants"))).all()
+            for entity_id, link, variants in rows:
+                ref_images(model.__tablename__, entity_id, slot, [link, *(variants or {}).values()], connection)
+    for longread_id, tiles in connection.execute(select(LongRead.id, LongRead.map_tiles)).all():
+        ref_images(LongRead.__tablename__, longread_id, "map_tiles", [(tiles or {}).get("base")], connection)
+
+
+def migrate_add_job_outbox(connection):
+    job_outbox.create(connection, checkfirst=True)
+
+
+def migrate_add_tombstones(connection):
+    tombstone.create(connection, checkfirst=True)
+
+
+def migrate_add_tombstone_version_index(connection):
+    connection.exec_driver_sql('CREATE INDEX IF NOT EXISTS "ix_tombstone_version" ON tombstone (version)')
+
+
+# Applied in order to databases whose PRAGMA user_version is lower than their position.
+# Append new steps; never edit or reorder the ones already released.
+MIGRATIONS = [
+    migrate_add_versions,
+    migrate_add_foreign_key_indexes,
+    migrate_add_search_index,
+    migrate_add_event_index,
+    migrate_add_timeline_buckets,
+    migrate_add_image_variants,
+    migrate_add_map_tiles,
+    migrate_add_image_store,
+    migrate_add_job_outbox,
+    migrate_add_tombstones,
+    migrate_add_tombstone_version_index,
+]
+
+# Objects create_all() does not know about; created directly on a fresh database.
+VIRTUAL_TABLES_DDL = [
+    SEARCH_INDEX_DDL,
+    EVENT_INDEX_DDL,
+]
+
+
+def upgrade_database():
+    with db.engine.begin() as connection:
+        current = connection.exec_driver_sql("PRAGMA user_version").scalar()
+        if not sqlalchemy.inspect(connection).has_table(World.__tablename__):
+            db.metadata.create_all(connection)
+            for statement in VIRTUAL_TABLES_DDL:
+                connection.exec_driver_sql(statement)
+            current = len(MIGRATIONS)
+        for migration in MIGRATIONS[current:]:
+            migration(connection)
+        connection.exec_driver_sql(f"PRAGMA user_version = {len(MIGRATIONS)}")
+        if connection.execute(select(change_seq.c.id)).first() is None:
+            connection.execute(insert(change_seq).values(id=1, value=1))
+
+
+@bp.cli.command("search-rebuild")
+def search_rebuild_command():
+    with db.engine.begin() as connection:
+        search_rebuild(connection)
+        print("indexed", connection.exec_driver_sql("SELECT count(*) FROM search_index").scalar(), "documents")
+
+
+@bp.cli.command("build-map-tiles")
+def build_map_tiles_command():
+    # queues pyramids for maps uploaded before tiling existed and runs them right away
+    longreads = db.session.execute(select(LongRead.id, LongRead.map_link, LongRead.map_tiles)
+                                   .where(LongRead.map_link.not_in(DEFAULT_IMAGES))).all()
+    for longread in longreads:
+        tiles = longread.map_tiles or {}
+        if tiles.get("source") != longread.map_link or tiles.get("status") != "ready":
+            enqueue_map_tiles(longread)
+    db.session.commit()
+    print("ran", run_pending_jobs(), "jobs")
+
+
+@bp.cli.command("run-jobs")
+def run_jobs_command():
+    print("ran", run_pending_jobs(), "jobs")
+
+
+@bp.cli.command("gc-images")
+@click.option("--grace", type=int, default=None, help="Seconds a blob must stay unreferenced; IMAGE_GC_GRACE by default.")
+def gc_images_command(grace):
+    removed = collect_image_garbage(current_app.config["IMAGE_GC_GRACE"] if grace is None else grace)
+    print("removed", len(removed), "image files")
+
+
+@bp.cli.command("db-upgrade")
+def db_upgrade_command():
+    upgrade_database()
+    with db.engine.connect() as connection:
+        print("schema version", connection.exec_driver_sql("PRAGMA user_version").scalar())
+
+
+# _______________________________________________________________________________________________________
+# _______________________________________________________________________________________________________
+
+
+# Read endpoints select these columns with Core and encode the rows directly,
+# so no ORM instance is built for anything that is only serialized.
+SERIALIZED_FIELDS = {
+    World: ("id", "name", "img_link", "img_variants", "description"),
+    LongRead: ("id", "world_id", "name", "description", "img_link", "img_variants", "map_link", "map_variants",
+               "timeline_link", "timeline_variants"),
+    Chapter: ("id", "name", "longread_id"),
+    BlockContent: ("id", "longread_id", "chapter_id", "text", "img_link", "img_variants", "coordx", "coordy", "time",
+                   "floating_text"),
+    WorldObj: ("id", "name", "world_id", "description", "img_link", "img_variants"),
+}
+SERIALIZED_COLUMNS = {model: tuple(getattr(model, field) for field in fields)
+                      for model, fields in SERIALIZED_FIELDS.items()}
+
+
+def select_json(model, *criteria):
+    return select(*SERIALIZED_COLUMNS[model]).where(*criteria)
+
+
+def rows_to_json(model, rows):
+    fields = SERIALIZED_FIELDS[model]
+    return [dict(zip(fields, row)) for row in rows]
+
+
+def fetch_json(model, *criteria):
+    return rows_to_json(model, read_execute(select_json(model, *criteria).order_by(model.id)))
+
+
+def fetch_one_json_or_404(model, ident):
+    row = read_execute(select_json(model, model.id == ident)).first()
+    if row is None:
+        abort(404)
+    return dict(zip(SERIALIZED_FIELDS[model], row))
+
+
+def exists_or_404(model, ident):
+    if read_execute(select(model.id).where(model.id == ident)).scalar() is None:
+        abort(404)
+
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(json.dumps({"after": last_id}).encode()).decode()
+
+
+def decode_cursor_value(cursor):
+    return json.loads(base64.urlsafe_b64decode(str(cursor).encode()))["after"]
+
+
+def decode_cursor(cursor):
+    return int(decode_cursor_value(cursor))
+
+
+def page_args(data):
+    limit = int(data.get("limit", PAGE_DEFAULT_LIMIT))
+    if not 1 <= limit <= PAGE_MAX_LIMIT:
+        raise ValueError("limit out of range")
+    cursor = data.get("cursor")
+    after_id = decode_cursor(cursor) if cursor else 0
+    return limit, after_id
+
+
+def keyset_statement(model, criteria, limit, after_id):
+    return select_json(model, *criteria, model.id > after_id).order_by(model.id).limit(limit + 1)
+
+
+def keyset_result(items, limit):
+    # items holds up to limit + 1 rows; the extra one only tells that there is a next page
+    next_cursor = encode_cursor(items[limit - 1]["id"]) if len(items) > limit else None
+    return {"items": items[:limit], "next_cursor": next_cursor}
+
+
+def keyset_page(model, criteria, limit, after_id):
+    return keyset_result(rows_to_json(model, read_execute(keyset_statement(model, criteria, limit, after_id))), limit)
+
+
+def ndjson_stream(model, criteria, after_id):
+    def generate():
+        fields = SERIALIZED_FIELDS[model]
+        encode = json_encoder()
+        statement = select_json(model, *criteria, model.id > after_id).order_by(model.id)
+        rows = read_execute(statement.execution_options(yield_per=STREAM_BATCH_SIZE))
+        for row in rows:
+            yield encode(dict(zip(fields, row))) + b"\n"
+
+    return current_app.response_class(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+def wants_ndjson():
+    return request.accept_mimetypes.best_match(["application/json", "application/x-ndjson"]) == "application/x-ndjson"
+
+
+def merged_rows(statements, key, limit=None):
+    # SQLite sorts the whole candidate set when an ORDER BY spans an IN list of parents, so a
+    # world-wide page runs one index-ordered query per parent instead and merges them. Rows
+    # are fetched MERGE_BATCH_SIZE at a time, so a page reads about limit rows in all; without
+    # a limit every row is merged.
+    if limit is not None:
+        statements = [statement.limit(limit + 1) for statement in statements]
+    streams = [read_execute(statement.execution_options(yield_per=MERGE_BATCH_SIZE)) for statement in statements]
+    try:
+        return list(itertools.islice(heapq.merge(*streams, key=key), None if limit is None else limit + 1))
+    finally:
+        for stream in streams:
+            stream.close()
+
+
+def merged_keyset_page(model, parent_column, parent_ids, limit, after_id):
+    statements = [select_json(model, parent_column == parent_id, model.id > after_id).order_by(model.id)
+                  for parent_id in parent_ids]
+    return keyset_result(rows_to_json(model, merged_rows(statements, lambda row: row.id, limit)), limit)
+
+
+def list_response(model, criteria, limit, after_id):
+    # "Accept: application/x-ndjson" streams every row after the cursor, one object per
+    # line, instead of a single page; limit is ignored in that mode.
+    if wants_ndjson():
+        return ndjson_stream(model, criteria, after_id)
+    return jsonify(keyset_page(model, criteria, limit, after_id))
+
+
+class ReadCache:
+    # LRU of serialized read responses. Every entry carries one tag such as
+    # ("chapter", 5) or ("longread.chapters", 3); writers invalidate by tag, in their own process only.
+    def __init__(self, max_entries, max_bytes, ttl=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.keys_by_tag = {}
+        self.size = 0
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, encoding=None):
+        # Returns (body, encoding): the stored body in that content encoding when there is
+        # one, otherwise the plain body with encoding None.
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            variants = entry[0]
+            if encoding in variants:
+                return variants[encoding], encoding
+            return variants[None], None
+
+    def set(self, key, tag, body, generation):
+        with self.lock:
+            # an invalidation while the response was being built may have made it stale
+            if generation != self.generation or len(body) > self.max_bytes:
+                return
+            if key in self.entries:
+                self._remove(key)
+            expires_at = time.monotonic() + self.ttl if self.ttl else None
+            self.entries[key] = ({None: body}, tag, expires_at)
+            self.keys_by_tag.setdefault(tag, set()).add(key)
+            self.size += len(body)
+            self._evict()
+
+    def set_variant(self, key, encoding, body):
+        # keeps a compressed copy next to the plain body, counted against max_bytes
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or encoding in entry[0]:
+                return
+            entry[0][encoding] = body
+            self.size += len(body)
+            self._evict()
+
+    def invalidate(self, tags):
+        with self.lock:
+            self.generation += 1
+            for tag in tags:
+                for key in list(self.keys_by_tag.get(tag, ())):
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.keys_by_tag.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self.entries),
+                    "bytes": self.size,
+                    "max_entries": self.max_entries,
+                    "max_bytes": self.max_bytes,
+                    "ttl": self.ttl,
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "invalidations": self.invalidations,
+                    "hit_ratio": self.hits / lookups if lookups else 0.0}
+
+    def _evict(self):
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            self._remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def _remove(self, key):
+        variants, tag, _ = self.entries.pop(key)
+        self.size -= sum(len(body) for body in variants.values())
+        keys = self.keys_by_tag.get(tag)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self.keys_by_tag[tag]
+
+
+read_cache = LocalProxy(lambda: current_app.extensions['read_cache'])
+
+
+def cached_read(entity, id_key=None):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            data = request.get_json(silent=True) or {}
+            if not read_cache.max_entries or not isinstance(data, dict) or wants_ndjson():
+                return view(*args, **kwargs)
+            try:
+                tag = (entity, int(data[id_key]) if id_key else None)
+            except (KeyError, TypeError, ValueError):
+                return view(*args, **kwargs)
+
+            key = (request.path, json.dumps(data, sort_keys=True))
+            encoding = accepted_encoding()
+            cached = read_cache.get(key, encoding)
+            if cached is not None:
+                return precompressed_response(key, *cached, encoding)
+
+            generation = read_cache.generation
+            response = make_response(view(*args, **kwargs))
+            if response.status_code == 200 and not response.is_streamed:
+                body = response.get_data()
+                read_cache.set(key, tag, body, generation)
+                if encoding is not None:
+                    return precompressed_response(key, body, None, encoding)
+            return response
+        return wrapper
+    return decorator
+
+
+def invalidate_on_commit(tags):
+    db.session.info.setdefault("cache_tags", set()).update(tags)
+
+
+@event.listens_for(Session, "after_commit")
+def flush_cache_tags(session):
+    tags = session.info.pop("cache_tags", None)
+    if tags:
+        read_cache.invalidate(tags)
+
+
+@event.listens_for(Session, "after_rollback")
+def drop_cache_tags(session):
+    session.info.pop("cache_tags", None)
+
+
+def world_cache_tags(world_ids, deleted=False):
+    tags = {("worlds", None)}
+    for world_id in world_ids:
+        tags.add(("world", world_id))
+        if deleted:
+            tags.update({("world.longreads", world_id), ("world.worldobjs", world_id),
+                         ("world.blockcontents", world_id)})
+    return tags
+
+
+def longread_cache_tags(longread_ids, deleted=False):
+    tags = {("longreads", None)}
+    for longread_id, world_id in db.session.execute(
+            select(LongRead.id, LongRead.world_id).where(LongRead.id.in_(longread_ids))):
+        tags.update({("longread", longread_id), ("longread.full", longread_id), ("world.longreads", world_id)})
+        if deleted:
+            tags.update({("longread.chapters", longread_id), ("longread.blockcontents", longread_id),
+                         ("world.blockcontents", world_id)})
+    return tags
+
+
+def chapter_cache_tags(chapter_ids, deleted=False):
+    tags = set()
+    for chapter_id, longread_id in db.session.execute(
+            select(Chapter.id, Chapter.longread_id).where(Chapter.id.in_(chapter_ids))):
+        tags.update({("chapter", chapter_id), ("longread.chapters", longread_id), ("longread.full", longread_id)})
+        if deleted:
+            tags.add(("chapter.blockcontents", chapter_id))
+    return tags
+
+
+def blockcontent_cache_tags(blockcontent_ids):
+    tags = set()
+    for blockcontent_id, chapter_id, longread_id, world_id in db.session.execute(
+            select(BlockContent.id, BlockContent.chapter_id, BlockContent.longread_id, LongRead.world_id)
+            .join(LongRead, LongRead.id == BlockContent.longread_id)
+            .where(BlockContent.id.in_(blockcontent_ids))):
+        tags.update({("blockcontent", blockcontent_id), ("chapter.blockcontents", chapter_id),
+                     ("longread.blockcontents", longread_id), ("longread.full", longread_id),
+                     ("world.blockcontents", world_id)})
+    return tags
+
+
+def worldobj_cache_tags(worldobj_ids, deleted=False):
+    tags = set()
+    for worldobj_id, world_id in db.session.execute(
+            select(WorldObj.id, WorldObj.world_id).where(WorldObj.id.in_(worldobj_ids))):
+        tags.update({("worldobj", worldobj_id), ("world.worldobjs", world_id)})
+    if deleted:
+        # /world/longread/full lists the linked worldobj ids of every block
+        for longread_id in db.session.scalars(
+                select(BlockContent.longread_id).distinct()
+                .join(blockcontents, blockcontents.c.blockcontent_id == BlockContent.id)
+                .where(blockcontents.c.worldobj_id.in_(worldobj_ids))):
+            tags.add(("longread.full", longread_id))
+    return tags
+
+
+def longread_full_json(longread_id, with_worldobjs):
+    longread_json = fetch_one_json_or_404(LongRead, longread_id)
+    chapters_json = fetch_json(Chapter, Chapter.longread_id == longread_id)
+    chapter_sel = select(Chapter.id).where(Chapter.longread_id == longread_id)
+    blockcontents_json = fetch_json(BlockContent, BlockContent.chapter_id.in_(chapter_sel))
+
+    if with_worldobjs:
+        worldobj_ids = {}
+        links = read_execute(
+            select(blockcontents.c.blockcontent_id, blockcontents.c.worldobj_id)
+            .join(BlockContent, BlockContent.id == blockcontents.c.blockcontent_id)
+            .where(BlockContent.chapter_id.in_(chapter_sel))
+        )
+        for blockcontent_id, worldobj_id in links:
+            worldobj_ids.setdefault(blockcontent_id, []).append(worldobj_id)
+        for bc_json in blockcontents_json:
+            bc_json["worldobj_ids"] = worldobj_ids.get(bc_json["id"], [])
+
+    chapter_blockcontents = {}
+    for bc_json in blockcontents_json:
+        chapter_blockcontents.setdefault(bc_json["chapter_id"], []).append(bc_json)
+    for chapter_json in chapters_json:
+        chapter_json["blockcontents"] = chapter_blockcontents.get(chapter_json["id"], [])
+
+    longread_json["chapters"] = chapters_json
+    return longread_json
+
+
+def cascade_delete(world_ids=(), longread_ids=(), chapter_ids=(), blockcontent_ids=(), worldobj_ids=()):
+    # Deletes whole subtrees with one bulk DELETE per table, children first, so the
+    # subselects below still see their parents. Image files are only released here;
+    # collect_image_garbage() removes them later.
+    world_ids = list(world_ids)
+    longread_sel = select(LongRead.id).where(or_(LongRead.id.in_(list(longread_ids)),
+                                                 LongRead.world_id.in_(world_ids)))
+    chapter_sel = select(Chapter.id).where(or_(Chapter.id.in_(list(chapter_ids)),
+                                               Chapter.longread_id.in_(longread_sel)))
+    blockcontent_sel = select(BlockContent.id).where(or_(BlockContent.id.in_(list(blockcontent_ids)),
+                                                         BlockContent.chapter_id.in_(chapter_sel),
+                                                         BlockContent.longread_id.in_(longread_sel)))
+    worldobj_sel = select(WorldObj.id).where(or_(WorldObj.id.in_(list(worldobj_ids)),
+                                                 WorldObj.world_id.in_(world_ids)))
+
+    release_images(World.__tablename__, world_ids)
+    release_images(LongRead.__tablename__, longread_sel)
+    release_images(BlockContent.__tablename__, blockcontent_sel)
+    release_images(WorldObj.__tablename__, worldobj_sel)
+    invalidate_on_commit(world_cache_tags(db.session.scalars(select(World.id).where(World.id.in_(world_ids))),
+                                          deleted=True)
+                         | longread_cache_tags(longread_sel, deleted=True)
+                         | chapter_cache_tags(chapter_sel, deleted=True)
+                         | blockcontent_cache_tags(blockcontent_sel)
+                         | worldobj_cache_tags(worldobj_sel, deleted=True))
+    event_remove(blockcontent_sel)
+    version = record_tombstones(world_ids, longread_sel, chapter_sel, blockcontent_sel, worldobj_sel)
+    # the tombstones name every deleted row, so the job needs their version rather than the ids
+    enqueue_job("search_remove_deleted", {"version": version})
+    timeline_events = db.session.execute(select(BlockContent.longread_id, BlockContent.time).where(
+        BlockContent.id.in_(blockcontent_sel), BlockContent.time.is_not(None))).all()
+
+    statements = [
+        delete(blockcontents).where(or_(blockcontents.c.blockcontent_id.in_(blockcontent_sel),
+                                        blockcontents.c.worldobj_id.in_(worldobj_sel))),
+        delete(BlockContent).where(BlockContent.id.in_(blockcontent_sel)),
+        delete(Chapter).where(Chapter.id.in_(chapter_sel)),
+        delete(LongRead).where(LongRead.id.in_(longread_sel)),
+        delete(WorldObj).where(WorldObj.id.in_(worldobj_sel)),
+        delete(World).where(World.id.in_(world_ids)),
+    ]
+    for statement in statements:
+        db.session.execute(statement.execution_options(synchronize_session=False))
+    timeline_refresh(timeline_events)
+
+
+def record_tombstones(world_ids, longread_sel, chapter_sel, blockcontent_sel, worldobj_sel):
+    # Runs before the cascade's DELETEs, while the joins to LongRead still find the world of each
+    # row. Returns the change sequence value every tombstone of this cascade carries.
+    version = next_change_seq()
+    sources = {
+        World: select(World.id, World.id).where(World.id.in_(world_ids)),
+        LongRead: select(LongRead.id, LongRead.world_id).where(LongRead.id.in_(longread_sel)),
+        Chapter: select(Chapter.id, LongRead.world_id)
+        .join(LongRead, LongRead.id == Chapter.longread_id).where(Chapter.id.in_(chapter_sel)),
+        BlockContent: select(BlockContent.id, LongRead.world_id)
+        .join(LongRead, LongRead.id == BlockContent.longread_id).where(BlockContent.id.in_(blockcontent_sel)),
+        WorldObj: select(WorldObj.id, WorldObj.world_id).where(WorldObj.id.in_(worldobj_sel)),
+    }
+    for model, source in sources.items():
+        db.session.execute(insert(tombstone).from_select(["entity_id", "world_id", "entity", "version"],
+                                                         source.add_columns(literal(SYNC_ENTITIES[model]),
+                                                                            literal(version))))
+    return version
+
+
+def remove_image_files(image_links):
+    # a link may also name a directory, such as the tile pyramid of a map
+    for link in image_links:
+        try:
+            if os.path.isdir(link[1:]):
+                shutil.rmtree(link[1:])
+            else:
+                os.remove(link[1:])
+        except FileNotFoundError:
+            pass
+
+
+def collect_image_garbage(grace):
+    # Deletes blobs released more than grace seconds ago, then files and tile directories
+    # in UPLOAD_FOLDER that no blob row knows about: uploads whose transaction rolled back
+    # and leftovers of interrupted writes. Anything modified within grace is kept.
+    cutoff = time.time() - grace
+    referenced = select(image_ref.c.link).where(image_ref.c.link == image_blob.c.link).exists()
+    with db.engine.begin() as connection:
+        released = connection.scalars(delete(image_blob)
+                                      .where(image_blob.c.released_at < cutoff, ~referenced)
+                                      .returning(image_blob.c.link)).all()
+        known = set(connection.scalars(select(image_blob.c.link)))
+
+    folder = current_app.config["UPLOAD_FOLDER"]
+    candidates = set(released)
+    for directory in (folder, os.path.join(folder, "tiles")):
+        if os.path.isdir(directory):
+            for entry in os.scandir(directory):
+                link = "/" + entry.path
+                stored = HASHED_IMAGE_NAME.search(link) or TILES_DIR_NAME.search(link)
+                if link not in known and (stored or STORE_TEMP_NAME.search(link)):
+                    candidates.add(link)
+
+    removed = []
+    for link in candidates:
+        try:
+            if os.path.getmtime(link[1:]) < cutoff:
+                removed.append(link)
+        except FileNotFoundError:
+            pass
+    remove_image_files(removed)
+    return removed
+
+
+# _______________________________________________________________________________________________________
+# _______________________________________________________________________________________________________
+
+
+# Uploads are spooled to disk with their size and type checked as they stream in, then a
+# worker process renders one file per IMAGE_VARIANTS entry. Files are named after the hash
+# of their bytes, so a link never changes content and is served as immutable.
+IMAGE_SIGNATURES = (
+    (b"\xff\xd8\xff", "jpg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+)
+UPLOAD_CHUNK_SIZE = 64 * 1024
+HASHED_IMAGE_NAME = re.compile(r"/([0-9a-f]{32}\.(jpg|png|gif|webp)|tiles/[0-9a-f]{32}/\d+/\d+_\d+\.jpg)$")
+TILES_DIR_NAME = re.compile(r"/tiles/[0-9a-f]{32}$")
+STORE_TEMP_NAME = re.compile(r"\.(upload|part)$")
+
+
+class ImageRejected(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def image_type(head):
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    for signature, extension in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return extension
+    return None
+
+
+def write_hashed_image(folder, data, extension):
+    name = hashlib.sha256(data).hexdigest()[:32] + "." + extension
+    path = os.path.join(folder, name)
+    if os.path.exists(path):
+        # a fresh mtime keeps collect_image_garbage() off a released blob that is being reused
+        os.utime(path)
+    else:
+        fd, temp_path = tempfile.mkstemp(dir=folder, suffix=".part")
+        with os.fdopen(fd, "wb") as temp_file:
+            temp_file.write(data)
+        os.replace(temp_path, path)
+    return name
+
+
+def render_image_variants(source_path, extension, folder, sizes, max_pixels):
+    # Runs in an image worker process; returns {variant: file name}.
+    if Image is None:
+        # without Pillow every variant is the original upload
+        with open(source_path, "rb") as source:
+            return dict.fromkeys(sizes, write_hashed_image(folder, source.read(), extension))
+
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    try:
+        with Image.open(source_path) as image:
+            if None not in sizes.values():
+                # lets JPEG decode at a reduced scale when the largest variant is smaller
+                image.draft("RGB", (max(sizes.values()),) * 2)
+            image = ImageOps.exif_transpose(image)
+            alpha = "A" in image.getbands() or "transparency" in image.info
+            image = image.convert("RGBA" if alpha else "RGB")
+            names = {}
+            for variant, size in sizes.items():
+                # a size of None keeps the original resolution
+                resized = image.copy()
+                if size is not None:
+                    resized.thumbnail((size, size), Image.LANCZOS)
+                buffer = io.BytesIO()
+                if alpha:
+                    resized.save(buffer, "PNG", optimize=True)
+                else:
+                    resized.save(buffer, "JPEG", quality=85, optimize=True, progressive=True)
+                names[variant] = write_hashed_image(folder, buffer.getvalue(), "png" if alpha else "jpg")
+            return names
+    except (OSError, Image.DecompressionBombError) as e:
+        raise ValueError(str(e))
+
+
+image_workers = None
+image_workers_lock = threading.Lock()
+
+
+def image_pool():
+    global image_workers
+    with image_workers_lock:
+        if image_workers is None:
+            image_workers = ProcessPoolExecutor(max_workers=current_app.config["IMAGE_WORKERS"])
+        return image_workers
+
+
+def spool_upload(uploaded_img, max_bytes):
+    head = uploaded_img.stream.read(12)
+    extension = image_type(head)
+    if extension is None:
+        raise ImageRejected("Unsupported image type.", 415)
+    fd, path = tempfile.mkstemp(dir=current_app.config["UPLOAD_FOLDER"], suffix=".upload")
+    try:
+        with os.fdopen(fd, "wb") as spool:
+            spool.write(head)
+            size = len(head)
+            for chunk in iter(lambda: uploaded_img.stream.read(UPLOAD_CHUNK_SIZE), b""):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise ImageRejected("Image is too large.", 413)
+                spool.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    count_upload_bytes(size)
+    return path, extension
+
+
+IMAGE_MODELS = {model.__tablename__: model for model in IMAGE_SLOTS}
+ENTITY_CACHE_TAGS = {World.__tablename__: world_cache_tags, LongRead.__tablename__: longread_cache_tags,
+                     BlockContent.__tablename__: blockcontent_cache_tags, WorldObj.__tablename__: worldobj_cache_tags}
+
+
+def process_image_upload(entity, entity_id, slot, source, extension, limits):
+    # Job: renders the variants of a spooled upload and points the entity slot at them.
+    # limits is the config prefix of the size caps and variants: "IMAGE" or "MAP".
+    future = image_pool().submit(render_image_variants, source, extension, current_app.config["UPLOAD_FOLDER"],
+                                 current_app.config[limits + "_VARIANTS"], current_app.config[limits + "_MAX_PIXELS"])
+    try:
+        names = future.result(timeout=current_app.config["IMAGE_TIMEOUT"])
+    except ValueError as e:
+        remove_image_files(["/" + source])
+        raise JobFailed(f"invalid image: {e}")
+    folder = current_app.config["UPLOAD_FOLDER"]
+    variants = {variant: "/" + os.path.join(folder, name) for variant, name in names.items()}
+
+    obj = db.session.get(IMAGE_MODELS[entity], entity_id)
+    if obj is not None:
+        setattr(obj, slot + "_link", variants["full"])
+        setattr(obj, slot + "_variants", variants)
+        ref_images(entity, entity_id, slot, variants.values())
+        invalidate_on_commit(ENTITY_CACHE_TAGS[entity]([entity_id]))
+        if slot == "map":
+            enqueue_map_tiles(obj)
+    return ["/" + source]
+
+
+def image_upload_response(model, entity_id, slot, message, limits="IMAGE"):
+    # The body is received and spooled before the row is loaded: the first statement of the
+    # session takes the write lock, which must not wait on a slow client.
+    # lets werkzeug refuse an oversized body while it is still being received
+    request.max_content_length = current_app.config[limits + "_MAX_BYTES"] + UPLOAD_CHUNK_SIZE
+    try:
+        uploaded_img = request.files["uploaded-file"]
+    except KeyError:
+        return jsonify({"error": "Invalid form data. Missing uploaded-file."}), 400
+
+    if uploaded_img.filename == "":
+        model.query.get_or_404(entity_id)
+        return jsonify({"message": message}), 200
+    try:
+        source, extension = spool_upload(uploaded_img, current_app.config[limits + "_MAX_BYTES"])
+    except ImageRejected as e:
+        return jsonify({"error": str(e)}), e.status
+
+    obj = db.session.get(model, entity_id)
+    if obj is None:
+        os.remove(source)
+        abort(404)
+
+    # slot is the column prefix: "img", "map" or "timeline"; the links change once the job has run
+    enqueue_job("image_upload", {"entity": obj.__tablename__, "entity_id": obj.id, "slot": slot, "source": source,
+                                 "extension": extension, "limits": limits},
+                target=f"{obj.__tablename__}:{obj.id}:{slot}")
+    db.session.commit()
+
+    return jsonify({"message": message, "status": "processing"}), 202
+
+
+def render_tile_pyramid(source_path, folder, tile_size, overlap, max_pixels):
+    # Runs in an image worker process. Deep Zoom layout: level max_level is the full image,
+    # every level below halves it, down to 1x1 at level 0; tiles are "<level>/<col>_<row>.jpg".
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    digest = hashlib.sha256()
+    with open(source_path, "rb") as source:
+        for chunk in iter(lambda: source.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    base = os.path.join(folder, "tiles", digest.hexdigest()[:32])
+
+    with Image.open(source_path) as image:
+        width, height = image.size
+        max_level = (max(width, height) - 1).bit_length()
+        if os.path.isdir(base):
+            os.utime(base)
+        else:
+            os.makedirs(os.path.dirname(base), exist_ok=True)
+            staging = tempfile.mkdtemp(dir=os.path.dirname(base), suffix=".part")
+            level_image = image.convert("RGB")
+            for level in range(max_level, -1, -1):
+                os.mkdir(os.path.join(staging, str(level)))
+                level_width, level_height = level_image.size
+                for col in range(math.ceil(level_width / tile_size)):
+                    for row in range(math.ceil(level_height / tile_size)):
+                        box = (max(col * tile_size - overlap, 0), max(row * tile_size - overlap, 0),
+                               min((col + 1) * tile_size + overlap, level_width),
+                               min((row + 1) * tile_size + overlap, level_height))
+                        level_image.crop(box).save(os.path.join(staging, str(level), f"{col}_{row}.jpg"),
+                                                   "JPEG", quality=80, optimize=True)
+                level_image = level_image.resize((math.ceil(level_width / 2), math.ceil(level_height / 2)),
+                                                 Image.LANCZOS)
+            try:
+                os.rename(staging, base)
+            except OSError:
+                # another worker finished the same pyramid first
+                shutil.rmtree(staging)
+
+    return {"base": "/" + base, "width": width, "height": height, "max_level": max_level,
+            "tile_size": tile_size, "overlap": overlap, "format": "jpg"}
+
+
+def build_map_tiles(longread_id, source):
+    # Job: cuts the full-resolution map variant into a pyramid. Until it has run,
+    # map_tiles still describes the previous map.
+    if read_scalar(select(LongRead.map_link).where(LongRead.id == longread_id)) != source:
+        return
+    future = image_pool().submit(render_tile_pyramid, source[1:], current_app.config["UPLOAD_FOLDER"],
+                                 current_app.config["MAP_TILE_SIZE"], current_app.config["MAP_TILE_OVERLAP"],
+                                 current_app.config["MAP_MAX_PIXELS"])
+    try:
+        tiles = dict(future.result(timeout=current_app.config["IMAGE_TIMEOUT"]), status="ready")
+    except (OSError, ValueError, Image.DecompressionBombError):
+        current_app.logger.exception("tile pyramid for longread %s failed", longread_id)
+        tiles = {"status": "failed"}
+    tiles["source"] = source
+
+    longread = db.session.get(LongRead, longread_id)
+    if longread is None or longread.map_link != source:
+        return
+    longread.map_tiles = tiles
+    ref_images(LongRead.__tablename__, longread.id, "map_tiles", [tiles.get("base")])
+    invalidate_on_commit(longread_cache_tags([longread.id]))
+
+
+def enqueue_map_tiles(longread):
+    if Image is not None and longread.map_link not in DEFAULT_IMAGES:
+        enqueue_job("map_tiles", {"longread_id": longread.id, "source": longread.map_link},
+                    target=f"{LongRead.__tablename__}:{longread.id}:map_tiles")
+
+
+def visible_tiles(tiles, level, viewport):
+    # viewport is {"x", "y", "width", "height"} in full-resolution pixels
+    scale = 2 ** (tiles["max_level"] - level)
+    span = tiles["tile_size"] * scale
+    cols = math.ceil(math.ceil(tiles["width"] / scale) / tiles["tile_size"])
+    rows = math.ceil(math.ceil(tiles["height"] / scale) / tiles["tile_size"])
+    first_col, first_row, last_col, last_row = 0, 0, cols - 1, rows - 1
+    if viewport is not None:
+        x, y = int(viewport["x"]), int(viewport["y"])
+        first_col, first_row = max(x // span, 0), max(y // span, 0)
+        last_col = min((x + int(viewport["width"]) - 1) // span, cols - 1)
+        last_row = min((y + int(viewport["height"]) - 1) // span, rows - 1)
+    return [f'{tiles["base"]}/{level}/{col}_{row}.{tiles["format"]}'
+            for row in range(first_row, last_row + 1) for col in range(first_col, last_col + 1)]
+
+
+@bp.after_app_request
+def immutable_image_headers(response):
+    if request.endpoint == "static" and response.status_code in (200, 304) and HASHED_IMAGE_NAME.search(request.path):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config["IMAGE_CACHE_MAX_AGE"]
+        response.cache_control.immutable = True
+    return response
+
+
+# _______________________________________________________________________________________________________
+# _______________________________________________________________________________________________________
+
+
+class JobFailed(Exception):
+    # raised by a job that cannot succeed on retry; the job is marked failed at once
+    pass
+
+
+def enqueue_job(kind, payload, target=None):
+    # Part of the caller's transaction: the job exists exactly when the change that needs it does.
+    db.session.execute(insert(job_outbox).values(kind=kind, target=target, payload=payload, attempts=0,
+                                                 run_after=time.time()))
+    db.session.info["jobs_enqueued"] = True
+
+
+def enqueue_search_reindex(model, ids):
+    ids = list(ids)
+    if ids:
+        enqueue_job("search_reindex", {"entity": model.__tablename__, "ids": ids})
+
+
+def reindex_search_job(entity, ids):
+    search_reindex(SEARCH_MODELS[entity], ids)
+
+
+def deleted_search_rowids(model, version):
+    # The documents of the rows one cascade_delete() removed, found through its tombstones.
+    # Ids are not AUTOINCREMENT, so a deleted largest id can come back on a new row, and that
+    # row's search_reindex job may already have run; its document is left alone.
+    reused = select(model.id).where(model.id == tombstone.c.entity_id, model.version > tombstone.c.version)
+    return select(tombstone.c.entity_id * 4 + SEARCH_CODES[model]).where(
+        tombstone.c.version == version, tombstone.c.entity == SEARCH_ENTITIES[model], ~reused.exists())
+
+
+def remove_deleted_search_job(version):
+    for model in SEARCH_ENTITIES:
+        db.session.execute(delete(search_index).where(search_index.c.rowid.in_(deleted_search_rowids(model, version))))
+
+
+JOB_HANDLERS = {
+    "search_reindex": reindex_search_job,
+    "search_remove_deleted": remove_deleted_search_job,
+    "image_upload": process_image_upload,
+    "map_tiles": build_map_tiles,
+}
+
+
+@event.listens_for(Session, "after_commit")
+def wake_job_runner(session):
+    if session.info.pop("jobs_enqueued", False):
+        job_runner.wake()
+
+
+@event.listens_for(Session, "after_rollback")
+def drop_job_wakeup(session):
+    session.info.pop("jobs_enqueued", None)
+
+
+def claim_job():
+    # Leases the oldest due job by pushing its run_after past JOB_LEASE; a worker that dies
+    # mid-job leaves it to be claimed again when the lease runs out.
+    now = time.time()
+    due = (select(job_outbox.c.id)
+           .where(job_outbox.c.failed_at.is_(None), job_outbox.c.run_after <= now)
+           .order_by(job_outbox.c.id).limit(1))
+    with db.engine.begin() as connection:
+        return connection.execute(update(job_outbox)
+                                  .where(job_outbox.c.id.in_(due.scalar_subquery()))
+                                  .values(run_after=now + current_app.config["JOB_LEASE"],
+                                          attempts=job_outbox.c.attempts + 1)
+                                  .returning(job_outbox.c.id, job_outbox.c.kind, job_outbox.c.target,
+                                             job_outbox.c.payload, job_outbox.c.attempts)).first()
+
+
+def newer_job(job):
+    return (select(job_outbox.c.id)
+            .where(job_outbox.c.kind == job.kind, job_outbox.c.target == job.target, job_outbox.c.id > job.id,
+                   job_outbox.c.failed_at.is_(None))
+            .limit(1))
+
+
+def run_job(job):
+    # The job's database changes commit together with the removal of its outbox row.
+    # A job returns the paths of files to remove once that commit has happened. Handlers
+    # render before their first write, so the write transaction only spans the updates.
+    cleanup = []
+    try:
+        with current_app.app_context():
+            # superseded jobs only need the spooled file of an upload cleaned up
+            superseded = ["/" + job.payload["source"]] if job.kind == "image_upload" else []
+            if job.target is not None and read_scalar(newer_job(job)) is not None:
+                cleanup = superseded
+            else:
+                cleanup = JOB_HANDLERS[job.kind](**job.payload) or []
+                if job.target is not None and db.session.execute(newer_job(job)).first() is not None:
+                    # superseded while rendering; rendered files nothing refers to are left to gc-images
+                    db.session.rollback()
+                    cleanup = superseded
+            db.session.execute(delete(job_outbox).where(job_outbox.c.id == job.id))
+            db.session.commit()
+    except Exception as e:
+        log = current_app.logger.warning if isinstance(e, JobFailed) else current_app.logger.exception
+        log("job %s (%s) failed, attempt %s: %s", job.id, job.kind, job.attempts, e)
+        now = time.time()
+        if isinstance(e, JobFailed) or job.attempts >= current_app.config["JOB_MAX_ATTEMPTS"]:
+            values = {"failed_at": now}
+        else:
+            values = {"run_after": now + current_app.config["JOB_RETRY_DELAY"] * 2 ** (job.attempts - 1)}
+        with db.engine.begin() as connection:
+            connection.execute(update(job_outbox).where(job_outbox.c.id == job.id)
+                               .values(last_error=repr(e)[:1000], **values))
+        return False
+    remove_image_files(cleanup)
+    return True
+
+
+def run_pending_jobs():
+    count = 0
+    while (job := claim_job()) is not None:
+        run_job(job)
+        count += 1
+    return count
+
+
+class JobRunner:
+    # JOB_WORKERS daemon threads that drain the outbox whenever a transaction that enqueued
+    # jobs commits, and every JOB_POLL_INTERVAL seconds for retries and leftovers.
+    def __init__(self):
+        self.pending = threading.Event()
+        self.lock = threading.Lock()
+        self.threads = []
+        self.app = None
+
+    def start(self, app, workers):
+        with self.lock:
+            if self.threads:
+                return
+            self.app = app
+            for number in range(workers):
+                thread = threading.Thread(target=self.loop, name=f"job-worker-{number}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def wake(self):
+        self.pending.set()
+
+    def loop(self):
+        while True:
+            self.pending.clear()
+            try:
+                with self.app.app_context():
+                    run_pending_jobs()
+            except Exception:
+                self.app.logger.exception("job worker error")
+            self.pending.wait(self.app.config["JOB_POLL_INTERVAL"])
+
+
+job_runner = LocalProxy(lambda: current_app.extensions['job_runner'])
+
+
+@bp.before_app_request
+def start_job_runner():
+    if not job_runner.threads and current_app.config["JOB_WORKERS"]:
+        job_runner.start(current_app._get_current_object(), current_app.config["JOB_WORKERS"])
+
+
+@bp.route("/jobs/stats", methods=["GET"])
+def job_stats():
+    rows = read_execute(select(job_outbox.c.kind, job_outbox.c.failed_at.is_not(None), func.count())
+                        .group_by(job_outbox.c.kind, job_outbox.c.failed_at.is_not(None))).all()
+    stats = {}
+    for kind, failed, count in rows:
+        stats.setdefault(kind, {"pending": 0, "failed": 0})["failed" if failed else "pending"] += count
+    return jsonify(stats)
+
+
+@bp.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    return jsonify(read_cache.stats())
+
+
+# _______________________________________________________________________________________________________
 # _______________________________________________________________________________________________________
+
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class RequestMetrics:
+    # Per-route histograms and counters, rendered in the Prometheus text format.
+    # Routes are labelled by their rule, so the label set stays as small as the url map.
+    HISTOGRAMS = {
+        "darts_http_request_duration_seconds": ("Request latency, including a streamed body.", LATENCY_BUCKETS),
+        "darts_http_request_sql_statements": ("SQL statements executed per request.", STATEMENT_COUNT_BUCKETS),
+        "darts_http_request_sql_duration_seconds": ("Time spent in SQL per request.", LATENCY_BUCKETS),
+        "darts_http_response_size_bytes": ("Response body size.", SIZE_BUCKETS),
+    }
+    COUNTERS = {
+        "darts_http_requests_total": "Requests by route, method and status.",
+        "darts_upload_bytes_total": "Bytes of uploaded files accepted.",
+    }
+
+    def __init__(self):
+        self.histograms = {name: {} for name in self.HISTOGRAMS}
+        self.counters = {name: {} for name in self.COUNTERS}
+        self.lock = threading.Lock()
+
+    def observe(self, route, method, status, duration, statements, sql_time, response_bytes, upload_bytes):
+        labels = (("route", route), ("method", method))
+        with self.lock:
+            self._add("darts_http_requests_total", labels + (("status", str(status)),), 1)
+            if upload_bytes:
+                self._add("darts_upload_bytes_total", labels, upload_bytes)
+            self._observe("darts_http_request_duration_seconds", labels, duration)
+            self._observe("darts_http_request_sql_statements", labels, statements)
+            self._observe("darts_http_request_sql_duration_seconds", labels, sql_time)
+            if response_bytes is not None:
+                self._observe("darts_http_response_size_bytes", labels, response_bytes)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, (help_text, buckets) in self.HISTOGRAMS.items():
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for labels, (counts, total, count) in sorted(self.histograms[name].items()):
+                    cumulative = 0
+                    for bound, bucket_count in zip(buckets, counts):
+                        cumulative += bucket_count
+                        lines.append(f"{name}_bucket{prometheus_labels(labels + (('le', repr(float(bound))),))} {cumulative}")
+                    lines.append(f"{name}_bucket{prometheus_labels(labels + (('le', '+Inf'),))} {count}")
+                    lines.append(f"{name}_sum{prometheus_labels(labels)} {total!r}")
+                    lines.append(f"{name}_count{prometheus_labels(labels)} {count}")
+            for name, help_text in self.COUNTERS.items():
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                for labels, value in sorted(self.counters[name].items()):
+                    lines.append(f"{name}{prometheus_labels(labels)} {value}")
+        return lines
+
+    def _add(self, name, labels, value):
+        self.counters[name][labels] = self.counters[name].get(labels, 0) + value
+
+    def _observe(self, name, labels, value):
+        buckets = self.HISTOGRAMS[name][1]
+        series = self.histograms[name].get(labels)
+        if series is None:
+            series = self.histograms[name][labels] = [[0] * len(buckets), 0, 0]
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                series[0][index] += 1
+                break
+        series[1] += value
+        series[2] += 1
+
+
+def prometheus_labels(labels):
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+request_metrics = LocalProxy(lambda: current_app.extensions['request_metrics'])
+
+
+@event.listens_for(sqlalchemy.engine.Engine, "before_cursor_execute")
+def sql_timer_start(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(sqlalchemy.engine.Engine, "after_cursor_execute")
+def sql_timer_stop(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_started"].pop()
+    # statements run by job workers, migrations and CLI commands have no request to charge
+    if has_request_context() and "metrics" in g:
+        metrics = g.metrics
+        metrics["statements"] += 1
+        metrics["sql_time"] += elapsed
+        if len(metrics["sql"]) < current_app.config["SLOW_REQUEST_MAX_STATEMENTS"]:
+            metrics["sql"].append((elapsed, statement))
+        shapes = metrics.get("shapes")
+        if shapes is not None and not SQL_TRANSACTION_CONTROL.match(statement):
+            shape = statement_shape(statement)
+            shapes[shape] = shapes.get(shape, 0) + 1
+    for recorded in query_recorders():
+        if not SQL_TRANSACTION_CONTROL.match(statement):
+            route = request.url_rule.rule if has_request_context() and request.url_rule is not None else None
+            recorded.append((request.method if route else None, route, statement))
+
+
+@event.listens_for(sqlalchemy.engine.Engine, "handle_error")
+def sql_timer_drop(exception_context):
+    started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+    if started:
+        started.pop()
+
+
+def count_upload_bytes(size):
+    if has_request_context() and "metrics" in g:
+        g.metrics["upload_bytes"] += size
+
+
+@bp.before_app_request
+def start_request_metrics():
+    g.metrics = {"started": time.perf_counter(), "statements": 0, "sql_time": 0.0, "sql": [], "upload_bytes": 0}
+    if current_app.config["NPLUSONE_MODE"]:
+        g.metrics.update(shapes={}, relationship_loads={})
+
+
+@bp.after_app_request
+def finish_request_metrics(response):
+    metrics = g.get("metrics")
+    if metrics is None:
+        return response
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    method = request.method
+    # record() runs when the server closes the response, after the app context is gone
+    app = current_app._get_current_object()
+    size = [response.content_length]
+    if size[0] is None and response.is_streamed:
+        # the body of a stream is produced, and its queries run, after this hook returns
+        size[0] = 0
+        response.response = counted_body(response.response, size)
+
+    def record():
+        duration = time.perf_counter() - metrics["started"]
+        app.extensions["request_metrics"].observe(route, method, response.status_code, duration,
+                                                  metrics["statements"], metrics["sql_time"], size[0],
+                                                  metrics["upload_bytes"])
+        threshold = app.config["SLOW_REQUEST_SECONDS"]
+        if threshold is not None and duration >= threshold:
+            statements = "".join(f"\n  {elapsed * 1000:8.2f} ms  {' '.join(statement.split())}"
+                                 for elapsed, statement in metrics["sql"])
+            app.logger.warning("slow request %s %s -> %s: %.3f s, %d SQL statements in %.3f s%s",
+                               method, route, response.status_code, duration, metrics["statements"],
+                               metrics["sql_time"], statements)
+
+    response.call_on_close(record)
+    if metrics.get("shapes") is not None:
+        check_n_plus_one(method, route, metrics)
+    return response
+
+
+def counted_body(body, size):
+    for chunk in body:
+        size[0] += len(chunk)
+        yield chunk
+
+
+@bp.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    lines = request_metrics.render()
+    stats = read_cache.stats()
+    for key, kind, help_text in (("hits", "counter", "Read cache hits."),
+                                 ("misses", "counter", "Read cache misses."),
+                                 ("evictions", "counter", "Read cache evictions."),
+                                 ("invalidations", "counter", "Read cache entries invalidated by writes."),
+                                 ("entries", "gauge", "Read cache entries."),
+                                 ("bytes", "gauge", "Read cache size.")):
+        suffix = "_total" if kind == "counter" else ""
+        lines += [f"# HELP darts_read_cache_{key}{suffix} {help_text}", f"# TYPE darts_read_cache_{key}{suffix} {kind}",
+                  f"darts_read_cache_{key}{suffix} {stats[key]}"]
+    return current_app.response_class("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
+
+
 # _______________________________________________________________________________________________________
+# _______________________________________________________________________________________________________
+
+
+# N+1 detection (NPLUSONE_MODE "warn" or "raise", DARTS_NPLUSONE in the environment): within one
+# request, a statement shape or a relationship load that repeats more than NPLUSONE_THRESHOLD
+# times is reported. Only the statements run before the response is returned count, so the
+# deliberate batch queries of a streamed body do not.
+SQL_TRANSACTION_CONTROL = re.compile(r"\s*(BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE)\b", re.IGNORECASE)
+SQL_NUMBER = re.compile(r"\b\d+\b")
+SQL_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+
+
+class NPlusOneDetected(Exception):
+    pass
+
+
+def statement_shape(statement):
+    # statements that differ only in parameters, inlined numbers or IN-list length share a shape
+    return SQL_PLACEHOLDER_LIST.sub("(?)", SQL_NUMBER.sub("?", " ".join(statement.split())))
+
+
+@event.listens_for(Session, "do_orm_execute")
+def count_relationship_loads(orm_execute_state):
+    if orm_execute_state.is_relationship_load and has_request_context():
+        loads = g.get("metrics", {}).get("relationship_loads")
+        if loads is not None:
+            name = str(orm_execute_state.loader_strategy_path.prop)
+            loads[name] = loads.get(name, 0) + 1
+
+
+def check_n_plus_one(method, route, metrics):
+    threshold = current_app.config["NPLUSONE_THRESHOLD"]
+    findings = [f"{name} loaded {count} times" for name, count in metrics["relationship_loads"].items()
+                if count > threshold]
+    findings += [f"{count} x {shape}" for shape, count in metrics["shapes"].items() if count > threshold]
+    # checked once; an error response built from the exception below must not repeat it
+    metrics["shapes"] = None
+    if not findings:
+        return
+    message = f"possible N+1 queries in {method} {route}: " + "; ".join(findings)
+    if current_app.config["NPLUSONE_MODE"] == "raise":
+        raise NPlusOneDetected(message)
+    current_app.logger.warning(message)
+
 
+query_recorder_stack = threading.local()
 
-@app.route("/longread/chapter/blockcontent/all", methods=["POST"])
+
+def query_recorders():
+    return getattr(query_recorder_stack, "stack", ())
+
+
+@contextlib.contextmanager
+def assert_max_queries(limit):
+    # Test helper: fails if the code inside the block, e.g. test client requests, runs more
+    # than limit SQL statements on this thread (transaction control is not counted).
+    #   with assert_max_queries(4):
+    #       client.post("/world/longread/full", json={"longread_id": 1, "with_worldobjs": True})
+    recorded = []
+    query_recorder_stack.stack = query_recorders() + (recorded,)
+    try:
+        yield recorded
+    finally:
+        query_recorder_stack.stack = tuple(r for r in query_recorders() if r is not recorded)
+    if len(recorded) > limit:
+        statements = "".join(f"\n  [{method} {route}] {' '.join(statement.split())}" if route
+                             else f"\n  {' '.join(statement.split())}" for method, route, statement in recorded)
+        raise AssertionError(f"{len(recorded)} SQL statements, expected at most {limit}:{statements}")
+
+
+# _______________________________________________________________________________________________________
+# _______________________________________________________________________________________________________
+
+
+@bp.route("/longread/chapter/blockcontent/all", methods=["POST"])
+@cached_read("chapter.blockcontents", "chapter_id")
 def blockcontents_chapter_getAll():
     try:
         chapter_id = request.json["chapter_id"]
     except KeyError:
         return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
+    try:
+        limit, after_id = page_args(request.json)
+    except (TypeError, ValueError, KeyError):
+        return jsonify({"error": "Invalid pagination parameters."}), 400
 
-    chapter = Chapter.query.get_or_404(chapter_id)
-    blockcontents = [model_to_json(bc) for bc in chapter.blockcontents]
-    return jsonify(blockcontents)
+    exists_or_404(Chapter, chapter_id)
+    return list_response(BlockContent, [BlockContent.chapter_id == chapter_id], limit, after_id)
 
 
-@app.route("/longread/chapter/blockcontent", methods=["POST"])
+@bp.route("/longread/chapter/blockcontent", methods=["POST"])
+@cached_read("blockcontent", "blockcontent_id")
 def blockcontent():
     try:
         blockcontent_id = request.json["blockcontent_id"]
     except KeyError:
         return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
 
-    blockcontent = BlockContent.query.get_or_404(blockcontent_id)
-    return jsonify(model_to_json(blockcontent))
+    return jsonify(fetch_one_json_or_404(BlockContent, blockcontent_id))
 
 
-@app.route("/longread/chapter/blockcontent/create", methods=["POST"])
+@bp.route("/longread/chapter/blockcontent/create", methods=["POST"])
 def blockcontent_create():
     try:
         longread_id = request.json["longread_id"]
@@ -158,12 +2043,15 @@ def blockcontent_create():
                                 img_link = "/staticFiles/images/font.jpg")
 
     db.session.add(blockcontent)
+    db.session.flush()
+    invalidate_on_commit(blockcontent_cache_tags([blockcontent.id]))
+    enqueue_search_reindex(BlockContent, [blockcontent.id])
     db.session.commit()
 
     return jsonify({"message": "BlockContent create successfully."}), 201
 
 
-@app.route("/longread/chapter/blockcontent/edit", methods=["POST"])
+@bp.route("/longread/chapter/blockcontent/edit", methods=["POST"])
 def blockcontent_edit():
     try:
         blockcontent_id = request.json["blockcontent_id"]
@@ -175,12 +2063,14 @@ def blockcontent_edit():
     blockcontent.text = text
 
     db.session.add(blockcontent)
+    invalidate_on_commit(blockcontent_cache_tags([blockcontent.id]))
+    enqueue_search_reindex(BlockContent, [blockcontent.id])
     db.session.commit()
 
     return jsonify({"message": "BlockContent edit successfully."}), 200
 
 
-@app.route("/longread/chapter/blockcontent/delete", methods=["POST"])
+@bp.route("/longread/chapter/blockcontent/delete", methods=["POST"])
 def blockcontent_delete():
     try:
         blockcontent_id = request.json["blockcontent_id"]
@@ -188,66 +2078,114 @@ def blockcontent_delete():
         return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
     
     blockcontent = BlockContent.query.get_or_404(blockcontent_id)
-    if blockcontent.img_link != "/staticFiles/images/font.jpg":
-        os.remove(blockcontent.img_link[1:])
-
-    db.session.delete(blockcontent)
+    cascade_delete(blockcontent_ids=[blockcontent.id])
     db.session.commit()
 
     return jsonify({"message": "BlockContent delete successfully."}), 200
 
 
-@app.route("/longread/chapter/blockcontent/<int:blockcontent_id>/edit_image", methods=["POST"])
-def edit_blockcontent_image(blockcontent_id):
-    try:
-        uploaded_img = request.files["uploaded-file"]
-    except Exception as e:
-        return jsonify({"error": e}), 400
+BLOCKCONTENT_BATCH_EDIT_FIELDS = {"text", "coordx", "coordy", "time", "floating_text"}
 
-    blockcontent = BlockContent.query.get_or_404(blockcontent_id)
 
-    filename = uploaded_img.filename
-    if filename != "":
-        if blockcontent.img_link != "/staticFiles/images/font.jpg":
-            os.remove(blockcontent.img_link[1:])
-        blockcontent_img_name = "blockcontent" + str(blockcontent.id) + ".jpg"
-        uploaded_img.save(os.path.join(app.config["UPLOAD_FOLDER"], blockcontent_img_name))
-        blockcontent.img_link = "/" + os.path.join(app.config["UPLOAD_FOLDER"], blockcontent_img_name)
+@bp.route("/longread/chapter/blockcontent/batch", methods=["POST"])
+def blockcontent_batch():
+    try:
+        creates = [{"longread_id": item["longread_id"],
+                    "chapter_id": item["chapter_id"],
+                    "text": item["text"],
+                    "img_link": "/staticFiles/images/font.jpg"} for item in request.json.get("create", [])]
+        edits = []
+        for item in request.json.get("edit", []):
+            edit = {k: v for k, v in item.items() if k in BLOCKCONTENT_BATCH_EDIT_FIELDS}
+            edit["id"] = int(item["blockcontent_id"])
+            if "time" in edit:
+                edit["time"] = event_time(edit["time"])
+            for coordinate in ("coordx", "coordy"):
+                if coordinate in edit:
+                    edit[coordinate] = event_coordinate(edit[coordinate])
+            edits.append(edit)
+        delete_ids = [int(blockcontent_id) for blockcontent_id in request.json.get("delete", [])]
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
+    # the delete would run first and leave the edit without a row
+    both = {edit["id"] for edit in edits} & set(delete_ids)
+    if both:
+        return jsonify({"error": "BlockContent both edited and deleted.", "blockcontent_ids": sorted(both)}), 400
+
+    touched_ids = {edit["id"] for edit in edits} | set(delete_ids)
+    if touched_ids:
+        found_ids = set(db.session.scalars(select(BlockContent.id).where(BlockContent.id.in_(touched_ids))))
+        if found_ids != touched_ids:
+            return jsonify({"error": "BlockContent not found.",
+                            "blockcontent_ids": sorted(touched_ids - found_ids)}), 404
+
+    if delete_ids:
+        cascade_delete(blockcontent_ids=delete_ids)
+    if edits or creates:
+        version = next_change_seq()
+        for row in edits + creates:
+            row["version"] = version
+    timed_ids = [edit["id"] for edit in edits if "time" in edit]
+    timed_events = select(BlockContent.longread_id, BlockContent.time).where(BlockContent.id.in_(timed_ids))
+    timeline_events = db.session.execute(timed_events).all() if timed_ids else []
+    if edits:
+        db.session.execute(update(BlockContent), edits)
+    created_ids = []
+    if creates:
+        # The ids are handed out here, in request order: the write lock is already held, and
+        # RETURNING sorted by parameter order would cost one INSERT per row on SQLite.
+        start = (db.session.execute(select(func.max(BlockContent.id))).scalar() or 0) + 1
+        created_ids = list(range(start, start + len(creates)))
+        for blockcontent_id, row in zip(created_ids, creates):
+            row["id"] = blockcontent_id
+        db.session.execute(insert(BlockContent), creates)
+    invalidate_on_commit(blockcontent_cache_tags([edit["id"] for edit in edits] + created_ids))
+    enqueue_search_reindex(BlockContent, [edit["id"] for edit in edits] + created_ids)
+    event_reindex([edit["id"] for edit in edits if {"coordx", "coordy"} & edit.keys()])
+    if timed_ids:
+        timeline_refresh(timeline_events + db.session.execute(timed_events).all())
+    db.session.commit()
+
+    return jsonify({"message": "BlockContent batch successfully.", "created_ids": created_ids}), 200
 
-        db.session.add(blockcontent)
-        db.session.commit()
 
-    return jsonify({"message": "BlockContent image edit successfully"}), 200
+@bp.route("/longread/chapter/blockcontent/<int:blockcontent_id>/edit_image", methods=["POST"])
+def edit_blockcontent_image(blockcontent_id):
+    return image_upload_response(BlockContent, blockcontent_id, "img", "BlockContent image edit successfully")
 
 
 # _______________________________________________________________________________________________________
 # _______________________________________________________________________________________________________
 
 
-@app.route("/longread/chapter/all", methods=["POST"])
+@bp.route("/longread/chapter/all", methods=["POST"])
+@cached_read("longread.chapters", "longread_id")
 def chapters_getAll():
     try:
         longread_id = request.json["longread_id"]
     except KeyError:
         return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
+    try:
+        limit, after_id = page_args(request.json)
+    except (TypeError, ValueError, KeyError):
+        return jsonify({"error": "Invalid pagination parameters."}), 400
 
-    longread = LongRead.query.get_or_404(longread_id)
-    chapters = [model_to_json(ch) for ch in longread.chapters]
-    return jsonify(chapters)
+    exists_or_404(LongRead, longread_id)
+    return list_response(Chapter, [Chapter.longread_id == longread_id], limit, after_id)
 
 
-@app.route("/longread/chapter", methods=["POST"])
+@bp.route("/longread/chapter", methods=["POST"])
+@cached_read("chapter", "chapter_id")
 def chapter():
     try:
         chapter_id = request.json["chapter_id"]
     except KeyError:
         return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
 
-    chapter = Chapter.query.get_or_404(chapter_id)
-    return jsonify(model_to_json(chapter))
+    return jsonify(fetch_one_json_or_404(Chapter, chapter_id))
 
 
-@app.route("/longread/chapter/create", methods=["POST"])
+@bp.route("/longread/chapter/create", methods=["POST"])
 def chapters_create():
     try:
         longread_id = request.json["longread_id"]
@@ -258,12 +2196,14 @@ def chapters_create():
     chapter = Chapter(name=name, longread_id=longread_id)
 
     db.session.add(chapter)
+    db.session.flush()
+    invalidate_on_commit(chapter_cache_tags([chapter.id]))
     db.session.commit()
 
     return jsonify({"message": "Chapter create successfully."}), 201
 
 
-@app.route("/longread/chapter/edit", methods=["POST"])
+@bp.route("/longread/chapter/edit", methods=["POST"])
 def chapters_edit():
     try:
         chapter_id = request.json["chapter_id"]
@@ -275,12 +2215,13 @@ def chapters_edit():
     chapter.name = name
 
     db.session.add(chapter)
+    invalidate_on_commit(chapter_cache_tags([chapter.id]))
     db.session.commit()
 
     return jsonify({"message": "Chapter edit successfully."}), 200
 
 
-@app.route("/longread/chapter/delete", methods=["POST"])
+@bp.route("/longread/chapter/delete", methods=["POST"])
 def chapter_delete():
     try:
         chapter_id = request.json["chapter_id"]
@@ -288,10 +2229,7 @@ def chapter_delete():
         return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
 
     chapter = Chapter.query.get_or_404(chapter_id)
-    for blockcontent in chapter.blockcontents:
-        blockcontent_delete(blockcontent.id)
-
-    db.session.delete(chapter)
+    cascade_delete(chapter_ids=[chapter.id])
     db.session.commit()
 
     return jsonify({"message": "Chapter delete successfully."}), 200
@@ -301,37 +2239,57 @@ def chapter_delete():
 # _______________________________________________________________________________________________________
 
 
-@app.route("/longreads/all", methods=["POST"])
+@bp.route("/longreads/all", methods=["POST"])
+@cached_read("longreads")
 def longreads():
-    longreads = LongRead.query.all()
-    longreads_json = [model_to_json(lr) for lr in longreads]
-    return jsonify(longreads_json)
+    try:
+        limit, after_id = page_args(request.get_json(silent=True) or {})
+    except (TypeError, ValueError, KeyError):
+        return jsonify({"error": "Invalid pagination parameters."}), 400
+
+    return list_response(LongRead, [], limit, after_id)
 
 
-@app.route("/world/longread/all", methods=["POST"])
+@bp.route("/world/longread/all", methods=["POST"])
+@cached_read("world.longreads", "world_id")
 def longreads_getAll():
     try:
         world_id = request.json["world_id"]
     except KeyError:
         return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
+    try:
+        limit, after_id = page_args(request.json)
+    except (TypeError, ValueError, KeyError):
+        return jsonify({"error": "Invalid pagination parameters."}), 400
 
-    world = World.query.get_or_404(world_id)
-    longreads = [model_to_json(lr) for lr in world.longreads]
-    return jsonify(longreads)
+    exists_or_404(World, world_id)
+    return list_response(LongRead, [LongRead.world_id == world_id], limit, after_id)
 
 
-@app.route("/world/longread", methods=["POST"]) 
+@bp.route("/world/longread", methods=["POST"]) 
+@cached_read("longread", "longread_id")
 def longread():
     try:
         longread_id = request.json["longread_id"]
     except KeyError:
         return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
 
-    longread = LongRead.query.get_or_404(longread_id)
-    return jsonify(model_to_json(longread))
+    return jsonify(fetch_one_json_or_404(LongRead, longread_id))
 
 
-@app.route("/world/longread/create", methods=["POST"])
+@bp.route("/world/longread/full", methods=["POST"])
+@cached_read("longread.full", "longread_id")
+def longread_full():
+    try:
+        longread_id = request.json["longread_id"]
+    except KeyError:
+        return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
+    with_worldobjs = request.json.get("with_worldobjs", False)
+
+    return jsonify(longread_full_json(longread_id, with_worldobjs))
+
+
+@bp.route("/world/longread/create", methods=["POST"])
 def longread_create():
     try:
         world_id = request.json["world_id"]
@@ -349,12 +2307,15 @@ def longread_create():
                         map_link="/staticFiles/images/map_base.jpg")
 
     db.session.add(longread)
+    db.session.flush()
+    invalidate_on_commit(longread_cache_tags([longread.id]))
+    enqueue_search_reindex(LongRead, [longread.id])
     db.session.commit()
 
     return jsonify({"message": "Longread create successfully."}), 201
 
 
-@app.route("/world/longread/edit", methods=["POST"])
+@bp.route("/world/longread/edit", methods=["POST"])
 def longread_edit():
     try:
         longread_id = request.json["longread_id"]
@@ -369,12 +2330,14 @@ def longread_edit():
     longread.description = description
 
     db.session.add(longread)
+    invalidate_on_commit(longread_cache_tags([longread.id]))
+    enqueue_search_reindex(LongRead, [longread.id])
     db.session.commit()
 
     return jsonify({"message": "Longread edit successfully."}), 200
 
 
-@app.route("/world/longread/delete", methods=["POST"])
+@bp.route("/world/longread/delete", methods=["POST"])
 def longread_delete():
     try:
         longread_id = request.json["longread_id"]
@@ -382,68 +2345,69 @@ def longread_delete():
         return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
 
     longread = LongRead.query.get_or_404(longread_id)
-    for chapter in longread.chapters:
-        chapter_delete(chapter.id)
-    if longread.img_link != "/staticFiles/images/QuestionMark.jpg":
-        os.remove(longread.img_link[1:])
-
-    db.session.delete(longread)
+    cascade_delete(longread_ids=[longread.id])
     db.session.commit()
 
     return jsonify({"message": "Longread delete successfully."}), 200
 
 
-@app.route("/world/longread/<int:longread_id>/edit_image", methods=["POST"])
+@bp.route("/world/longread/<int:longread_id>/edit_image", methods=["POST"])
 def edit_longread_image(longread_id):
-    try:
-        uploaded_img = request.files["uploaded-file"]
-    except Exception as e:
-        return jsonify({"error": e}), 400
-
-    longread = LongRead.query.get_or_404(longread_id)
-
-    filename = uploaded_img.filename
-    if filename != "":
-        if longread.img_link != "/staticFiles/images/QuestionMark.jpg":
-            os.remove(longread.img_link[1:])
-        longread_img_name = "longread" + str(longread.id) + ".jpg"
-        uploaded_img.save(os.path.join(app.config["UPLOAD_FOLDER"], longread_img_name))
-        longread.img_link = "/" + os.path.join(app.config["UPLOAD_FOLDER"], longread_img_name)
-
-        db.session.add(longread)
-        db.session.commit()
-
-    return jsonify({"message": "Longread image edit successfully"}), 200
+    return image_upload_response(LongRead, longread_id, "img", "Longread image edit successfully")
 
 
 # _______________________________________________________________________________________________________
 # _______________________________________________________________________________________________________
 
 
-@app.route("/longread/blockcontent/all", methods=["POST"])
+@bp.route("/longread/blockcontent/all", methods=["POST"])
+@cached_read("longread.blockcontents", "longread_id")
 def blockcontents_longread_getAll():
     try:
         longread_id = request.json["longread_id"]
     except KeyError:
         return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
+    try:
+        limit, after_id = page_args(request.json)
+    except (TypeError, ValueError, KeyError):
+        return jsonify({"error": "Invalid pagination parameters."}), 400
 
-    longread = LongRead.query.get_or_404(longread_id)
-    blockcontents_json = [model_to_json(bc) for bc in longread.blockcontents]
-    return jsonify(blockcontents_json)
+    exists_or_404(LongRead, longread_id)
+    return list_response(BlockContent, [BlockContent.longread_id == longread_id], limit, after_id)
+
+
+@bp.route("/world/blockcontent/all", methods=["POST"])
+@cached_read("world.blockcontents", "world_id")
+def blockcontents_world_getAll():
+    try:
+        world_id = request.json["world_id"]
+    except KeyError:
+        return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
+    try:
+        limit, after_id = page_args(request.json)
+    except (TypeError, ValueError, KeyError):
+        return jsonify({"error": "Invalid pagination parameters."}), 400
 
+    exists_or_404(World, world_id)
+    if wants_ndjson():
+        criteria = [BlockContent.longread_id.in_(select(LongRead.id).where(LongRead.world_id == world_id))]
+        return ndjson_stream(BlockContent, criteria, after_id)
+    longread_ids = read_execute(select(LongRead.id).where(LongRead.world_id == world_id)).scalars().all()
+    return jsonify(merged_keyset_page(BlockContent, BlockContent.longread_id, longread_ids, limit, after_id))
 
-@app.route("/longread/blockcontent/event", methods=["POST"])
-def event():
+
+@bp.route("/longread/blockcontent/event", methods=["POST"])
+@cached_read("blockcontent", "blockcontent_id")
+def blockcontent_event():
     try:
         blockcontent_id = request.json["blockcontent_id"]
     except KeyError:
         return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
 
-    blockcontent = BlockContent.query.get_or_404(blockcontent_id)
-    return jsonify(model_to_json(blockcontent))
+    return jsonify(fetch_one_json_or_404(BlockContent, blockcontent_id))
 
 
-@app.route("/longread/blockcontent/event/edit", methods=["POST"])
+@bp.route("/longread/blockcontent/event/edit", methods=["POST"])
 def event_edit():
     try:
         blockcontent_id = request.json["blockcontent_id"]
@@ -454,20 +2418,33 @@ def event_edit():
 
     except KeyError:
         return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
+    try:
+        time = event_time(time)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid event time."}), 400
+    try:
+        coordx, coordy = event_coordinate(coordx), event_coordinate(coordy)
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid event coordinates."}), 400
 
     blockcontent = BlockContent.query.get_or_404(blockcontent_id)
+    timeline_events = [(blockcontent.longread_id, blockcontent.time)]
     blockcontent.coordx = coordx
     blockcontent.coordy = coordy
-    blockcontent.time = time 
+    blockcontent.time = time
     blockcontent.floating_text = floating_text
 
     db.session.add(blockcontent)
+    invalidate_on_commit(blockcontent_cache_tags([blockcontent.id]))
+    enqueue_search_reindex(BlockContent, [blockcontent.id])
+    event_reindex([blockcontent.id])
+    timeline_refresh(timeline_events + [(blockcontent.longread_id, blockcontent.time)])
     db.session.commit()
 
     return jsonify({"message": "Event edit successfully."}), 200
 
 
-@app.route("/longread/blockcontent/event/delete", methods=["POST"])
+@bp.route("/longread/blockcontent/event/delete", methods=["POST"])
 def event_delete():
     try:
         blockcontent_id = request.json["blockcontent_id"]
@@ -475,116 +2452,231 @@ def event_delete():
         return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
 
     blockcontent = BlockContent.query.get_or_404(blockcontent_id)
+    timeline_events = [(blockcontent.longread_id, blockcontent.time)]
     blockcontent.coordx = None
     blockcontent.coordy = None
     blockcontent.time = None
     blockcontent.floating_text = None
 
     db.session.add(blockcontent)
+    invalidate_on_commit(blockcontent_cache_tags([blockcontent.id]))
+    enqueue_search_reindex(BlockContent, [blockcontent.id])
+    event_reindex([blockcontent.id])
+    timeline_refresh(timeline_events)
     db.session.commit()
 
     return jsonify({"message": "Event delete successfully."}), 200
 
 
+def scope_longread_ids(data):
+    # the longread of "longread_id", or every longread of "world_id"
+    if "longread_id" in data:
+        return [int(data["longread_id"])]
+    return read_execute(select(LongRead.id).where(LongRead.world_id == int(data["world_id"]))).scalars().all()
+
+
+def timeline_buckets(width, longread_id, *criteria):
+    # bucket is unique per longread and width, so the primary key gives the order
+    return (select(timeline_bucket.c.bucket, timeline_bucket.c.count, timeline_bucket.c.min_time,
+                   timeline_bucket.c.max_time, timeline_bucket.c.floating_text)
+            .where(timeline_bucket.c.longread_id == longread_id, timeline_bucket.c.width == width, *criteria)
+            .order_by(timeline_bucket.c.bucket))
+
+
+@bp.route("/longread/blockcontent/event/timeline", methods=["POST"])
+def event_timeline():
+    try:
+        width = int(request.json["width"])
+        criteria = []
+        if "time_from" in request.json:
+            criteria.append(timeline_bucket.c.max_time >= int(request.json["time_from"]))
+        if "time_to" in request.json:
+            criteria.append(timeline_bucket.c.min_time <= int(request.json["time_to"]))
+        longread_ids = scope_longread_ids(request.json)
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
+    if width not in TIMELINE_BUCKET_WIDTHS:
+        return jsonify({"error": "Unsupported bucket width.", "widths": TIMELINE_BUCKET_WIDTHS}), 400
+
+    rows = merged_rows([timeline_buckets(width, longread_id, *criteria) for longread_id in longread_ids],
+                       lambda row: (row.bucket, row.min_time))
+    # a world timeline folds the buckets of its longreads together
+    buckets = {}
+    for bucket, count, min_time, max_time, floating_text in rows:
+        if bucket not in buckets:
+            buckets[bucket] = {"start": bucket * width, "count": count, "min_time": min_time,
+                               "max_time": max_time, "floating_text": floating_text}
+        else:
+            buckets[bucket]["count"] += count
+            buckets[bucket]["max_time"] = max(buckets[bucket]["max_time"], max_time)
+    return jsonify({"width": width, "buckets": list(buckets.values())})
+
+
+def event_window_criteria(data):
+    # bbox and time bounds are inclusive; either may be omitted
+    criteria = [BlockContent.time.is_not(None)] if "time_from" in data or "time_to" in data else []
+    if "time_from" in data:
+        criteria.append(BlockContent.time >= int(data["time_from"]))
+    if "time_to" in data:
+        criteria.append(BlockContent.time <= int(data["time_to"]))
+    if "bbox" in data:
+        bbox = data["bbox"]
+        criteria.append(BlockContent.id.in_(select(event_index.c.id).where(
+            event_index.c.max_x >= int(bbox["min_x"]), event_index.c.min_x <= int(bbox["max_x"]),
+            event_index.c.max_y >= int(bbox["min_y"]), event_index.c.min_y <= int(bbox["max_y"]))))
+    else:
+        criteria.append(or_(BlockContent.coordx.is_not(None), BlockContent.time.is_not(None)))
+    return criteria
+
+
+def event_after_criteria(after):
+    # keyset on (time, id); SQLite sorts events without a time first
+    after_time, after_id = after
+    if after_time is None:
+        return or_(BlockContent.time.is_not(None), BlockContent.id > after_id)
+    return or_(BlockContent.time > after_time, (BlockContent.time == after_time) & (BlockContent.id > after_id))
+
+
+def event_window_rows(longread_id, *criteria):
+    # one longread's events down ix_BlockContent_longread_id_time, whose entries end in the id
+    return (select_json(BlockContent, BlockContent.longread_id == longread_id, *criteria)
+            .order_by(BlockContent.time, BlockContent.id))
+
+
+def event_order(row):
+    # the ORDER BY of event_window_rows(), where an event without a time comes first
+    return row.time is not None, row.time or 0, row.id
+
+
+@bp.route("/longread/blockcontent/event/window", methods=["POST"])
+def event_window():
+    try:
+        criteria = event_window_criteria(request.json)
+        limit = int(request.json.get("limit", PAGE_DEFAULT_LIMIT))
+        cursor = request.json.get("cursor")
+        if cursor:
+            criteria.append(event_after_criteria(decode_cursor_value(cursor)))
+        if not 1 <= limit <= PAGE_MAX_LIMIT:
+            raise ValueError("limit out of range")
+        longread_ids = scope_longread_ids(request.json)
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
+
+    items = rows_to_json(BlockContent, merged_rows(
+        [event_window_rows(longread_id, *criteria) for longread_id in longread_ids], event_order, limit))
+    next_cursor = None
+    if len(items) > limit:
+        next_cursor = encode_cursor([items[limit - 1]["time"], items[limit - 1]["id"]])
+    return jsonify({"items": items[:limit], "next_cursor": next_cursor})
+
+
 # _______________________________________________________________________________________________________
 # _______________________________________________________________________________________________________
 
 
-@app.route("/longread/map", methods=["POST"])
+@bp.route("/longread/map", methods=["POST"])
+@cached_read("longread", "longread_id")
 def map():
     try:
         longread_id = request.json["longread_id"]
     except KeyError:
         return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
 
-    longread = LongRead.query.get_or_404(longread_id)
-    return jsonify(longread.map_link)
+    row = read_execute(select(LongRead.map_link).where(LongRead.id == longread_id)).first()
+    if row is None:
+        abort(404)
+    return jsonify(row.map_link)
 
 
-@app.route("/longread/map/<int:longread_id>/edit", methods=["POST"])
-def map_edit(longread_id):
+@bp.route("/longread/map/tiles", methods=["POST"])
+@cached_read("longread", "longread_id")
+def map_tiles():
     try:
-        uploaded_img = request.files["uploaded-file"]
-    except Exception as e:
-        return jsonify({"error": e}), 400
-
-    longread = LongRead.query.get_or_404(longread_id)
-
-    filename = uploaded_img.filename
-    if filename != "":
-        if longread.map_link != "/staticFiles/images/map_base.jpg":
-            os.remove(longread.img_link[1:])
-        longread_img_name = "map" + str(longread.id) + ".jpg"
-        uploaded_img.save(os.path.join(app.config["UPLOAD_FOLDER"], longread_img_name))
-        longread.map_link = "/" + os.path.join(app.config["UPLOAD_FOLDER"], longread_img_name)
-
-        db.session.add(longread)
-        db.session.commit()
+        longread_id = request.json["longread_id"]
+        level = request.json.get("level")
+        viewport = request.json.get("viewport")
+    except (KeyError, AttributeError):
+        return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
 
-    return jsonify({"message": "Map edit successfully."}), 200
+    row = read_execute(select(LongRead.map_link, LongRead.map_tiles).where(LongRead.id == longread_id)).first()
+    if row is None:
+        abort(404)
+    tiles = row.map_tiles
+    if row.map_link in DEFAULT_IMAGES or not tiles:
+        return jsonify({"status": "none" if row.map_link in DEFAULT_IMAGES else "pending"})
+    if tiles.get("source") != row.map_link:
+        return jsonify({"status": "pending"})
+    if tiles["status"] != "ready":
+        return jsonify({"status": tiles["status"]})
+
+    manifest = {key: tiles[key] for key in ("status", "width", "height", "max_level", "tile_size", "overlap", "format")}
+    manifest["url_template"] = tiles["base"] + "/{level}/{col}_{row}." + tiles["format"]
+    if level is not None:
+        try:
+            level = int(level)
+            if not 0 <= level <= tiles["max_level"]:
+                raise ValueError("level out of range")
+            manifest["tiles"] = visible_tiles(tiles, level, viewport)
+        except (KeyError, TypeError, ValueError):
+            return jsonify({"error": "Invalid level or viewport."}), 400
+    return jsonify(manifest)
+
+
+@bp.route("/longread/map/<int:longread_id>/edit", methods=["POST"])
+def map_edit(longread_id):
+    return image_upload_response(LongRead, longread_id, "map", "Map edit successfully", limits="MAP")
 
 
 # _______________________________________________________________________________________________________
 # _______________________________________________________________________________________________________
 
 
-@app.route("/longread/timeline", methods=["POST"])
+@bp.route("/longread/timeline", methods=["POST"])
+@cached_read("longread", "longread_id")
 def timeline():
     try:
         longread_id = request.json["longread_id"]
     except KeyError:
         return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
 
-    longread = LongRead.query.get_or_404(longread_id)
-    return jsonify(longread.timeline_link)
+    row = read_execute(select(LongRead.timeline_link).where(LongRead.id == longread_id)).first()
+    if row is None:
+        abort(404)
+    return jsonify(row.timeline_link)
 
 
-@app.route("/longread/timeline/<int:longread_id>/edit", methods=["POST"])
+@bp.route("/longread/timeline/<int:longread_id>/edit", methods=["POST"])
 def timeline_edit(longread_id):
-    try:
-        uploaded_img = request.files["uploaded-file"]
-    except Exception as e:
-        return jsonify({"error": e}), 400
-
-    longread = LongRead.query.get_or_404(longread_id)
-
-    filename = uploaded_img.filename
-    if filename != "":
-        if longread.timeline_link != "/staticFiles/images/timeline_base.jpg":
-            os.remove(longread.img_link[1:])
-        longread_img_name = "timeline" + str(longread.id) + ".jpg"
-        uploaded_img.save(os.path.join(app.config["UPLOAD_FOLDER"], longread_img_name))
-        longread.timeline_link = "/" + os.path.join(app.config["UPLOAD_FOLDER"], longread_img_name)
-
-        db.session.add(longread)
-        db.session.commit()
-
-    return jsonify({"message": "Timeline edit successfully"}), 200
+    return image_upload_response(LongRead, longread_id, "timeline", "Timeline edit successfully")
 
 
 # _______________________________________________________________________________________________________
 # _______________________________________________________________________________________________________
 
 
-@app.route("/worlds/all", methods=["POST"])
+@bp.route("/worlds/all", methods=["POST"])
+@cached_read("worlds")
 def worlds():
-    worlds = World.query.all()
-    worlds_json = [model_to_json(w) for w in worlds]
-    return jsonify(worlds_json)
+    try:
+        limit, after_id = page_args(request.get_json(silent=True) or {})
+    except (TypeError, ValueError, KeyError):
+        return jsonify({"error": "Invalid pagination parameters."}), 400
+
+    return list_response(World, [], limit, after_id)
 
 
-@app.route("/world", methods=["POST"])
+@bp.route("/world", methods=["POST"])
+@cached_read("world", "world_id")
 def world():
     try:
         world_id = request.json["world_id"]
     except KeyError:
         return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
 
-    world = World.query.get_or_404(world_id)
-    return jsonify(model_to_json(world))
+    return jsonify(fetch_one_json_or_404(World, world_id))
 
 
-@app.route("/world/create", methods=["POST"])
+@bp.route("/world/create", methods=["POST"])
 def world_create():
     try:
         name = request.json["name"]
@@ -598,12 +2690,15 @@ def world_create():
                   img_link = "/staticFiles/images/world_base.jpg")
 
     db.session.add(world)
+    db.session.flush()
+    invalidate_on_commit(world_cache_tags([world.id]))
+    enqueue_search_reindex(World, [world.id])
     db.session.commit()
 
     return jsonify({"message": "World create successfully."}), 201
 
 
-@app.route("/world/edit", methods=["POST"])
+@bp.route("/world/edit", methods=["POST"])
 def world_edit():
     try:
         world_id = request.json["world_id"]
@@ -618,12 +2713,14 @@ def world_edit():
     world.description = description
 
     db.session.add(world)
+    invalidate_on_commit(world_cache_tags([world.id]))
+    enqueue_search_reindex(World, [world.id])
     db.session.commit()
 
     return jsonify({"message": "World edit successfully."}), 200
 
 
-@app.route("/world/delete", methods=["POST"])
+@bp.route("/world/delete", methods=["POST"])
 def world_delete():
     try:
         world_id = request.json["world_id"]
@@ -631,70 +2728,49 @@ def world_delete():
         return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
 
     world = World.query.get_or_404(world_id)
-    for longread in world.longreads:
-        longread_delete(longread.id)
-    for worldobj in world.worldobjs:
-        worldobj_delete(worldobj.id)
-    if world.img_link != "/staticFiles/images/QuestionMark.jpg":
-        os.remove(world.img_link[1:])
-
-    db.session.delete(world)
+    cascade_delete(world_ids=[world.id])
     db.session.commit()
 
     return jsonify({"message": "World delete successfully."}), 200
 
 
-@app.route("/world/<int:world_id>/edit_image", methods=["POST"])
+@bp.route("/world/<int:world_id>/edit_image", methods=["POST"])
 def edit_world_image(world_id):
-    try:
-        uploaded_img = request.files["uploaded-file"]
-    except Exception as e:
-        return jsonify({"error": e}), 400
-
-    world = World.query.get_or_404(world_id)
-
-    filename = uploaded_img.filename
-    if filename != "":
-        if world.img_link != "/staticFiles/images/world_base.jpg":
-            os.remove(world.img_link[1:])
-        world_img_name = "world" + str(world.id) + ".jpg"
-        uploaded_img.save(os.path.join(app.config["UPLOAD_FOLDER"], world_img_name))
-        world.img_link = "/" + os.path.join(app.config["UPLOAD_FOLDER"], world_img_name)
-
-        db.session.add(world)
-        db.session.commit()
-
-    return jsonify({"message": "World image edit successfully."}), 200
+    return image_upload_response(World, world_id, "img", "World image edit successfully.")
 
 
 # _______________________________________________________________________________________________________
 # _______________________________________________________________________________________________________
 
 
-@app.route("/world/worldobj/all", methods=["POST"])
+@bp.route("/world/worldobj/all", methods=["POST"])
+@cached_read("world.worldobjs", "world_id")
 def worldobj_getAll():
     try:
         world_id = request.json["world_id"]
     except KeyError:
         return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
+    try:
+        limit, after_id = page_args(request.json)
+    except (TypeError, ValueError, KeyError):
+        return jsonify({"error": "Invalid pagination parameters."}), 400
 
-    world = World.query.get_or_404(world_id)
-    worldobjs = [model_to_json(wo) for wo in world.worldobjs]
-    return jsonify(worldobjs)
+    exists_or_404(World, world_id)
+    return list_response(WorldObj, [WorldObj.world_id == world_id], limit, after_id)
 
 
-@app.route("/world/worldobj", methods=["POST"])
+@bp.route("/world/worldobj", methods=["POST"])
+@cached_read("worldobj", "worldobj_id")
 def worldobj():
     try:
         worldobj_id = request.json["worldobj_id"]
     except KeyError:
         return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
     
-    worldobj = WorldObj.query.get_or_404(worldobj_id)
-    return jsonify(model_to_json(worldobj))
+    return jsonify(fetch_one_json_or_404(WorldObj, worldobj_id))
 
 
-@app.route("/world/worldobj/create", methods=["POST"])
+@bp.route("/world/worldobj/create", methods=["POST"])
 def worldobj_create():
     try:
         world_id = request.json["world_id"]
@@ -710,12 +2786,15 @@ def worldobj_create():
                         img_link = "/staticFiles/images/worldobj_base.jpg")
 
     db.session.add(worldobj)
+    db.session.flush()
+    invalidate_on_commit(worldobj_cache_tags([worldobj.id]))
+    enqueue_search_reindex(WorldObj, [worldobj.id])
     db.session.commit()
 
     return jsonify({"message": "World object create successfully."}), 201
 
 
-@app.route("/world/worldobj/edit", methods=["POST"])
+@bp.route("/world/worldobj/edit", methods=["POST"])
 def worldobj_edit():
     try:
         worldobj_id = request.json["worldobj_id"]
@@ -730,12 +2809,14 @@ def worldobj_edit():
     worldobj.description = description
 
     db.session.add(worldobj)
+    invalidate_on_commit(worldobj_cache_tags([worldobj.id]))
+    enqueue_search_reindex(WorldObj, [worldobj.id])
     db.session.commit()
 
     return jsonify({"message": "World object edit successfully."}), 200
 
 
-@app.route("/world/worldobj/delete", methods=["POST"])
+@bp.route("/world/worldobj/delete", methods=["POST"])
 def worldobj_delete():
     try:
         worldobj_id = request.json["worldobj_id"]
@@ -743,34 +2824,1289 @@ def worldobj_delete():
         return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
     
     worldobj = WorldObj.query.get_or_404(worldobj_id)
-    if worldobj.img_link != "/staticFiles/images/worldobj_base.jpg":
-        os.remove(worldobj.img_link[1:])
-
-    db.session.delete(worldobj)
+    cascade_delete(worldobj_ids=[worldobj.id])
     db.session.commit()
 
     return jsonify({"message": "World object delete successfully."}), 200
 
 
-@app.route("/world/worldobj/<int:worldobj_id>/edit_image", methods=["POST"])
+@bp.route("/world/worldobj/<int:worldobj_id>/edit_image", methods=["POST"])
 def edit_worldobj_image(worldobj_id):
+    return image_upload_response(WorldObj, worldobj_id, "img", "World object image edit successfully.")
+
+
+# _______________________________________________________________________________________________________
+# _______________________________________________________________________________________________________
+
+
+# Multi-get: {"blockcontent": [ids], "chapter": [ids], ...} is answered with one IN query per entity.
+# Every requested id gets an entry, null when there is no such row, and the missing ids are also
+# listed under not_found.
+BATCH_GET_MAX_IDS = PAGE_MAX_LIMIT
+
+
+@bp.route("/entities", methods=["POST"])
+def entities_get():
+    models = {entity: model for model, entity in SYNC_ENTITIES.items()}
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not data:
+        return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
+    if not data.keys() <= models.keys():
+        return jsonify({"error": "Unknown entity.", "entities": list(models)}), 400
     try:
-        uploaded_img = request.files["uploaded-file"]
-    except Exception as e:
-        return jsonify({"error": e}), 400
+        requested = {}
+        for entity, ids in data.items():
+            if not isinstance(ids, list):
+                raise TypeError("ids must be a list")
+            requested[entity] = list(dict.fromkeys(int(ident) for ident in ids))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
+    if sum(len(ids) for ids in requested.values()) > BATCH_GET_MAX_IDS:
+        return jsonify({"error": "Too many ids.", "max_ids": BATCH_GET_MAX_IDS}), 400
 
-    worldobj = WorldObj.query.get_or_404(worldobj_id)
+    items, not_found = {}, {}
+    for entity, ids in requested.items():
+        model = models[entity]
+        rows = {row["id"]: row for row in fetch_json(model, model.id.in_(ids))} if ids else {}
+        items[entity] = {str(ident): rows.get(ident) for ident in ids}
+        missing = [ident for ident in ids if ident not in rows]
+        if missing:
+            not_found[entity] = missing
+    return jsonify({"items": items, "not_found": not_found})
+
+
+# _______________________________________________________________________________________________________
+# _______________________________________________________________________________________________________
+
+
+# Delta sync. The version column of every row holds the change sequence value of its last write
+# and every delete leaves a tombstone, so the changes under a world since a client's last sync are
+# the rows and tombstones above its sequence number. They are listed in (version, entity, id) order,
+# parents before children within a version and tombstones last. A row rewritten while a client is
+# paging moves further down that order and is sent again, so nothing is skipped.
+def sync_position(version, ident, rank, after):
+    after_version, after_rank, after_id = after
+    if rank < after_rank:
+        return version > after_version
+    if rank == after_rank:
+        return tuple_(version, ident) > tuple_(after_version, after_id)
+    return version >= after_version
+
+
+def world_criteria(world_id):
+    # model -> where clause selecting the rows that belong to a world
+    longread_sel = select(LongRead.id).where(LongRead.world_id == world_id)
+    return {
+        World: World.id == world_id,
+        LongRead: LongRead.world_id == world_id,
+        WorldObj: WorldObj.world_id == world_id,
+        Chapter: Chapter.longread_id.in_(longread_sel),
+        BlockContent: BlockContent.longread_id.in_(longread_sel),
+    }
+
+
+def world_changes(world_id, since, limit, after):
+    criteria = world_criteria(world_id)
+    # read before any row, in the same read transaction, so every change up to it is in this snapshot
+    sequence = read_execute(select(change_seq.c.value)).scalar()
+    deleted_world = select(tombstone.c.id).where(tombstone.c.world_id == world_id, tombstone.c.entity == "world")
+    world_exists = read_execute(select(World.id).where(criteria[World])).first() is not None
+    if not world_exists and read_execute(deleted_world).first() is None:
+        abort(404)
+
+    # chapters and blocks are read per longread, each down its (longread_id, version) index
+    longread_ids = read_execute(select(LongRead.id).where(criteria[LongRead])).scalars().all()
+    changes = []
+    for rank, (model, entity) in enumerate(SYNC_ENTITIES.items()):
+        statement = select_json(model, model.version > since).add_columns(model.version)
+        if after is not None:
+            statement = statement.where(sync_position(model.version, model.id, rank, after))
+        statement = statement.order_by(model.version, model.id)
+        if model in (Chapter, BlockContent):
+            rows = merged_rows([statement.where(model.longread_id == longread_id) for longread_id in longread_ids],
+                               lambda row: (row.version, row.id), limit)
+        else:
+            rows = read_execute(statement.where(criteria[model]).limit(limit + 1))
+        fields = SERIALIZED_FIELDS[model]
+        for row in rows:
+            changes.append(((row.version, rank, row.id),
+                            {"entity": entity, "op": "upsert", "id": row.id, "version": row.version,
+                             "data": dict(zip(fields, row))}))
+
+    rank = len(SYNC_ENTITIES)
+    statement = select(tombstone.c.id, tombstone.c.entity, tombstone.c.entity_id, tombstone.c.version).where(
+        tombstone.c.world_id == world_id, tombstone.c.version > since)
+    if after is not None:
+        statement = statement.where(sync_position(tombstone.c.version, tombstone.c.id, rank, after))
+    for row in read_execute(statement.order_by(tombstone.c.version, tombstone.c.id).limit(limit + 1)):
+        changes.append(((row.version, rank, row.id),
+                        {"entity": row.entity, "op": "delete", "id": row.entity_id, "version": row.version}))
+
+    changes.sort(key=lambda change: change[0])
+    next_cursor = encode_cursor(list(changes[limit - 1][0])) if len(changes) > limit else None
+    return {"changes": [change for _, change in changes[:limit]], "next_cursor": next_cursor, "sequence": sequence}
+
+
+@bp.route("/world/changes", methods=["POST"])
+def world_changes_view():
+    try:
+        world_id = int(request.json["world_id"])
+        since = int(request.json.get("since", 0))
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
+    try:
+        limit = int(request.json.get("limit", PAGE_DEFAULT_LIMIT))
+        if not 1 <= limit <= PAGE_MAX_LIMIT:
+            raise ValueError("limit out of range")
+        cursor = request.json.get("cursor")
+        after = None
+        if cursor:
+            after = [int(value) for value in decode_cursor_value(cursor)]
+            if len(after) != 3:
+                raise ValueError("malformed cursor")
+    except (TypeError, ValueError, KeyError):
+        return jsonify({"error": "Invalid pagination parameters."}), 400
+
+    return jsonify(world_changes(world_id, since, limit, after))
+
+
+# _______________________________________________________________________________________________________
+# _______________________________________________________________________________________________________
+
+
+# World archives: an uncompressed tar of manifest.json, then every image file the world references
+# (files/<link path>), then its rows as NDJSON members of at most STREAM_BATCH_SIZE rows
+# (rows/<table>.<n>.ndjson), parents before children. Export streams from one read transaction
+# in bounded memory. Import stores the files first, outside any transaction, then inserts the
+# rows in one transaction, with the ids of every table shifted past the target's largest id.
+ARCHIVE_FORMAT = "darts-world"
+ARCHIVE_FORMAT_VERSION = 1
+ARCHIVE_TABLES = (World.__table__, LongRead.__table__, WorldObj.__table__, Chapter.__table__, BlockContent.__table__,
+                  blockcontents)
+ARCHIVE_MODELS = {model.__tablename__: model for model in VERSIONED_MODELS}
+TILE_FILE_NAME = re.compile(r"/tiles/[0-9a-f]{32}/\d+/\d+_\d+\.jpg$")
+
+
+class ArchiveRejected(Exception):
+    pass
+
+
+def archive_columns(table):
+    # versions are not carried over; imported rows get a new one
+    return [column for column in table.columns if column.name != "version"]
+
+
+def archive_id_columns(table):
+    # column -> table whose ids it holds, for the id shift on import
+    refs = {"id": table.name} if "id" in table.columns else {}
+    for column in table.columns:
+        for foreign_key in column.foreign_keys:
+            refs[column.name] = foreign_key.column.table.name
+    return refs
+
+
+def image_slot_links(model, row):
+    # slot -> image links of one row (a dict of column values), default images left out
+    slots = {slot: [row[slot + "_link"], *(row[slot + "_variants"] or {}).values()]
+             for slot in IMAGE_SLOTS.get(model, ())}
+    if model is LongRead:
+        slots["map_tiles"] = [(row["map_tiles"] or {}).get("base")]
+    return {slot: {link for link in links if link and link not in DEFAULT_IMAGES} for slot, links in slots.items()}
+
+
+def archive_path(link):
+    # the file behind a link, when it lies in UPLOAD_FOLDER
+    path = os.path.normpath(link.lstrip("/"))
+    return path if path.startswith(current_app.config["UPLOAD_FOLDER"] + os.sep) else None
+
+
+def tar_member(name, size, chunks, mtime):
+    info = tarfile.TarInfo(name)
+    info.size = size
+    info.mtime = mtime
+    yield info.tobuf(tarfile.PAX_FORMAT)
+    written = 0
+    for chunk in chunks:
+        written += len(chunk)
+        yield chunk
+    if written != size:
+        raise OSError(f"{name} changed size while it was archived")
+    yield tarfile.NUL * (-size % tarfile.BLOCKSIZE)
+
+
+def tar_file(path, name, mtime):
+    try:
+        source = open(path, "rb")
+    except FileNotFoundError:
+        # a dangling link exports as it is
+        return
+    with source:
+        yield from tar_member(name, os.fstat(source.fileno()).st_size,
+                              iter(lambda: source.read(UPLOAD_CHUNK_SIZE), b""), mtime)
+
+
+def world_archive_sources(world_id):
+    criteria = world_criteria(world_id)
+    blockcontent_sel = select(BlockContent.id).where(criteria[BlockContent])
+    worldobj_sel = select(WorldObj.id).where(criteria[WorldObj])
+    sources = [(model.__table__, criteria[model]) for model in (World, LongRead, WorldObj, Chapter, BlockContent)]
+    sources.append((blockcontents, blockcontents.c.blockcontent_id.in_(blockcontent_sel)
+                    & blockcontents.c.worldobj_id.in_(worldobj_sel)))
+    return criteria, sources
+
+
+def world_archive(world_id):
+    criteria, sources = world_archive_sources(world_id)
+    encode = json_encoder()
+    mtime = int(time.time())
+
+    tables = {}
+    for table, where in sources:
+        if "id" in table.columns:
+            rows, min_id = read_execute(select(func.count(), func.min(table.c.id)).where(where)).one()
+            tables[table.name] = {"rows": rows, "min_id": min_id}
+        else:
+            tables[table.name] = {"rows": read_execute(select(func.count()).select_from(table).where(where)).scalar()}
+    manifest = encode({"format": ARCHIVE_FORMAT, "format_version": ARCHIVE_FORMAT_VERSION,
+                       "schema_version": len(MIGRATIONS), "world_id": world_id, "tables": tables})
+    yield from tar_member("manifest.json", len(manifest), [manifest], mtime)
+
+    links = set()
+    for model, slots in IMAGE_SLOTS.items():
+        columns = [getattr(model, slot + suffix) for slot in slots for suffix in ("_link", "_variants")]
+        if model is LongRead:
+            columns.append(LongRead.map_tiles)
+        statement = select(*columns).where(criteria[model]).execution_options(yield_per=STREAM_BATCH_SIZE)
+        for row in read_execute(statement):
+            for slot_links in image_slot_links(model, row._mapping).values():
+                links.update(slot_links)
+    for link in sorted(links):
+        path = archive_path(link)
+        if path is None:
+            continue
+        if TILES_DIR_NAME.search(link) and os.path.isdir(path):
+            for directory, _, names in sorted(os.walk(path)):
+                for name in sorted(names):
+                    file_path = os.path.join(directory, name)
+                    yield from tar_file(file_path, "files/" + file_path, mtime)
+        else:
+            yield from tar_file(path, "files/" + path, mtime)
+
+    for table, where in sources:
+        names = [column.name for column in archive_columns(table)]
+        statement = (select(*archive_columns(table)).where(where).order_by(*table.primary_key.columns)
+                     .execution_options(yield_per=STREAM_BATCH_SIZE))
+        chunk, part = [], 0
+        for row in read_execute(statement):
+            chunk.append(encode(dict(zip(names, row))) + b"\n")
+            if len(chunk) == STREAM_BATCH_SIZE:
+                data = b"".join(chunk)
+                yield from tar_member(f"rows/{table.name}.{part:05d}.ndjson", len(data), [data], mtime)
+                chunk, part = [], part + 1
+        if chunk:
+            data = b"".join(chunk)
+            yield from tar_member(f"rows/{table.name}.{part:05d}.ndjson", len(data), [data], mtime)
+    yield tarfile.NUL * (2 * tarfile.BLOCKSIZE)
+
+
+def spool_archive_file(source, head, directory):
+    # copies the rest of an archive member next to its destination; returns (temp path, sha256 hex)
+    digest = hashlib.sha256(head)
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as temp_file:
+            temp_file.write(head)
+            for chunk in iter(lambda: source.read(UPLOAD_CHUNK_SIZE), b""):
+                digest.update(chunk)
+                temp_file.write(chunk)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return temp_path, digest.hexdigest()
+
+
+def import_archive_file(archive, member, state):
+    # Content-hash names are checked against their bytes and kept; a tile goes into a staging
+    # copy of its pyramid; any other file is stored under the hash of its bytes and its link is
+    # rewritten in the rows that follow.
+    folder = current_app.config["UPLOAD_FOLDER"]
+    path = archive_path(member.name[len("files/"):])
+    if path is None or not member.isreg():
+        raise ArchiveRejected(f"Unexpected archive member {member.name}.")
+    source = archive.extractfile(member)
+    head = source.read(12)
+    extension = image_type(head)
+    if extension is None:
+        raise ArchiveRejected(f"{member.name} is not a supported image.")
+    link = "/" + path
+    state["files"] += 1
+
+    if TILE_FILE_NAME.search(link):
+        base = os.path.dirname(os.path.dirname(path))
+        staging = state["tiles"].get(base)
+        if staging is None:
+            if os.path.isdir(base):
+                os.utime(base)
+                staging = state["tiles"][base] = ""
+            else:
+                os.makedirs(os.path.dirname(base), exist_ok=True)
+                staging = state["tiles"][base] = tempfile.mkdtemp(dir=os.path.dirname(base), suffix=".part")
+        if staging:
+            target = os.path.join(staging, os.path.relpath(path, base))
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            temp_path, _ = spool_archive_file(source, head, os.path.dirname(target))
+            os.replace(temp_path, target)
+        return
+
+    if os.path.dirname(path) != folder:
+        raise ArchiveRejected(f"Unexpected archive member {member.name}.")
+    hashed = HASHED_IMAGE_NAME.search(link)
+    if hashed and os.path.exists(path):
+        os.utime(path)
+        return
+    temp_path, digest = spool_archive_file(source, head, folder)
+    name = digest[:32] + "." + extension
+    if hashed and os.path.basename(path) != name:
+        os.remove(temp_path)
+        raise ArchiveRejected(f"{member.name} does not match its content hash.")
+    os.replace(temp_path, os.path.join(folder, name))
+    if not hashed:
+        state["links"][link] = "/" + os.path.join(folder, name)
+
+
+def finish_archive_tiles(state, complete=True):
+    # a pyramid is only moved into place once all of its tiles are in
+    for base, staging in state["tiles"].items():
+        if staging and complete:
+            try:
+                os.rename(staging, base)
+            except OSError:
+                # the same pyramid arrived some other way in the meantime
+                shutil.rmtree(staging)
+        elif staging:
+            shutil.rmtree(staging, ignore_errors=True)
+    state["tiles"] = {}
+
+
+def start_archive_rows(manifest, state):
+    # the first statement takes the write lock, so the ids above the current maxima stay free
+    state["version"] = next_change_seq()
+    for table in ARCHIVE_TABLES:
+        if "id" in table.columns:
+            start = (db.session.execute(select(func.max(table.c.id))).scalar() or 0) + 1
+            min_id = manifest["tables"][table.name]["min_id"]
+            state["starts"][table.name] = start
+            state["offsets"][table.name] = start - min_id if min_id is not None else 0
+
+
+def remap_image_links(row, links):
+    for name in ("img_link", "map_link", "timeline_link"):
+        if row.get(name) in links:
+            row[name] = links[row[name]]
+    for name in ("img_variants", "map_variants", "timeline_variants"):
+        if row.get(name):
+            row[name] = {variant: links.get(link, link) for variant, link in row[name].items()}
+    tiles = row.get("map_tiles")
+    if tiles and tiles.get("source") in links:
+        row["map_tiles"] = dict(tiles, source=links[tiles["source"]])
+
+
+def insert_archive_rows(table, rows, state):
+    db.session.execute(insert(table), rows)
+    model = ARCHIVE_MODELS.get(table.name)
+    refs = [{"entity": table.name, "entity_id": row["id"], "slot": slot, "link": link}
+            for row in rows for slot, links in image_slot_links(model, row).items() for link in links]
+    if refs:
+        links = {ref["link"] for ref in refs}
+        now = int(time.time())
+        db.session.execute(insert(image_blob).prefix_with("OR IGNORE"), [{"link": link, "created_at": now}
+                                                                          for link in links])
+        db.session.execute(insert(image_ref), refs)
+        mark_released(links)
+    state["rows"][table.name] = state["rows"].get(table.name, 0) + len(rows)
+
+
+def import_archive_rows(archive, member, table, state):
+    columns = [column.name for column in archive_columns(table)]
+    id_columns = archive_id_columns(table)
+    loads = current_app.json.loads
+    rows = []
+    for line in archive.extractfile(member):
+        record = loads(line)
+        row = {column: record.get(column) for column in columns}
+        for column, target in id_columns.items():
+            row[column] = int(row[column]) + state["offsets"][target]
+            # every id must land in the range this import took, and parents are already in
+            upper = row[column] if target == table.name else state["last_ids"].get(target, 0)
+            if not state["starts"][target] <= row[column] <= upper:
+                raise ArchiveRejected(f"{table.name} row refers to a {target} outside the archive.")
+        if "id" in id_columns:
+            if row["id"] <= state["last_ids"].get(table.name, 0):
+                raise ArchiveRejected(f"{table.name} rows are out of order.")
+            state["last_ids"][table.name] = row["id"]
+        if "version" in table.columns:
+            row["version"] = state["version"]
+        remap_image_links(row, state["links"])
+        rows.append(row)
+        if len(rows) == STREAM_BATCH_SIZE:
+            insert_archive_rows(table, rows, state)
+            rows = []
+    if rows:
+        insert_archive_rows(table, rows, state)
+
+
+def check_archive_references(state):
+    # The range checks while reading still let a row through that points into a gap between
+    # the archive's parent ids; one anti-join per foreign key over the imported rows finds it.
+    tables = {table.name: table for table in ARCHIVE_TABLES}
+    for table in ARCHIVE_TABLES:
+        id_columns = archive_id_columns(table)
+        own = "id" if "id" in id_columns else next(iter(id_columns))
+        imported = table.c[own] >= state["starts"][id_columns[own]]
+        for column, target in id_columns.items():
+            if target == table.name:
+                continue
+            parent = tables[target]
+            found = select(parent.c.id).where(parent.c.id == table.c[column]).exists()
+            if db.session.execute(select(table.c[column]).where(imported, ~found).limit(1)).first() is not None:
+                raise ArchiveRejected(f"{table.name} row refers to a {target} outside the archive.")
+
+
+def import_world_archive(fileobj):
+    # Returns {"world_id", "rows", "files"}; the caller commits.
+    state = {"files": 0, "tiles": {}, "links": {}, "rows": {}, "starts": {}, "offsets": {}, "last_ids": {},
+             "version": None}
+    tables = {table.name: table for table in ARCHIVE_TABLES}
+    try:
+        with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+            members = iter(archive)
+            member = next(members, None)
+            if member is None or member.name != "manifest.json":
+                raise ArchiveRejected("Not a world archive: manifest.json must come first.")
+            manifest = json.load(archive.extractfile(member))
+            if manifest.get("format") != ARCHIVE_FORMAT or manifest.get("format_version") != ARCHIVE_FORMAT_VERSION:
+                raise ArchiveRejected("Unsupported archive format.")
+            if manifest["tables"][World.__tablename__]["rows"] != 1:
+                raise ArchiveRejected("An archive holds exactly one world.")
+
+            for member in members:
+                match = re.fullmatch(r"rows/(\w+)\.\d+\.ndjson", member.name)
+                if member.name.startswith("files/") and state["version"] is None:
+                    import_archive_file(archive, member, state)
+                elif match and match.group(1) in tables:
+                    if state["version"] is None:
+                        finish_archive_tiles(state)
+                        start_archive_rows(manifest, state)
+                    import_archive_rows(archive, member, tables[match.group(1)], state)
+                else:
+                    raise ArchiveRejected(f"Unexpected archive member {member.name}.")
+    except (tarfile.TarError, EOFError, ValueError, KeyError, TypeError, AttributeError) as e:
+        finish_archive_tiles(state, complete=False)
+        raise ArchiveRejected(f"Invalid archive: {e}")
+    except sqlalchemy.exc.IntegrityError as e:
+        raise ArchiveRejected(f"Invalid archive rows: {e.orig}")
+    except BaseException:
+        finish_archive_tiles(state, complete=False)
+        raise
+
+    if state["rows"].get(World.__tablename__) != 1:
+        raise ArchiveRejected("An archive holds exactly one world.")
+    check_archive_references(state)
+    starts = state["starts"]
+    for model in SEARCH_CODES:
+        db.session.execute(insert(search_index).from_select(
+            ['rowid', 'title', 'body', 'entity', 'entity_id', 'world_id', 'longread_id'],
+            search_documents(model).where(model.id >= starts[model.__tablename__])))
+    db.session.execute(insert(event_index).from_select(
+        ['id', 'min_x', 'max_x', 'min_y', 'max_y'],
+        event_positions().where(BlockContent.id >= starts[BlockContent.__tablename__])))
+    for width in TIMELINE_BUCKET_WIDTHS:
+        db.session.execute(insert(timeline_bucket).from_select(
+            ['longread_id', 'width', 'bucket', 'count', 'min_time', 'max_time', 'floating_text'],
+            timeline_aggregates(width, BlockContent.longread_id >= starts[LongRead.__tablename__])))
+    world_id = starts[World.__tablename__]
+    invalidate_on_commit(world_cache_tags([world_id]) | {("longreads", None)})
+    return {"world_id": world_id, "rows": state["rows"], "files": state["files"]}
+
+
+@bp.route("/world/export", methods=["POST"])
+def world_export():
+    try:
+        world_id = int(request.json["world_id"])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
+
+    exists_or_404(World, world_id)
+    response = current_app.response_class(stream_with_context(world_archive(world_id)), mimetype="application/x-tar")
+    response.headers["Content-Disposition"] = f"attachment; filename=world-{world_id}.tar"
+    return response
+
+
+@bp.route("/world/import", methods=["POST"])
+def world_import():
+    # the archive is the raw request body; werkzeug refuses it past ARCHIVE_MAX_BYTES
+    request.max_content_length = current_app.config["ARCHIVE_MAX_BYTES"]
+    try:
+        result = import_world_archive(request.stream)
+    except ArchiveRejected as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 400
+    db.session.commit()
+
+    return jsonify({"message": "World import successfully.", **result}), 201
+
+
+@bp.cli.command("export-world")
+@click.argument("world_id", type=int)
+@click.argument("path", type=click.Path(dir_okay=False))
+def export_world_command(world_id, path):
+    if read_execute(select(World.id).where(World.id == world_id)).first() is None:
+        raise click.ClickException(f"no world {world_id}")
+    with open(path, "wb") as archive:
+        for chunk in world_archive(world_id):
+            archive.write(chunk)
+    print("exported world", world_id, "to", path)
+
+
+@bp.cli.command("import-world")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+def import_world_command(path):
+    with open(path, "rb") as archive:
+        try:
+            result = import_world_archive(archive)
+        except ArchiveRejected as e:
+            db.session.rollback()
+            raise click.ClickException(str(e))
+    db.session.commit()
+    print("imported world", result["world_id"], "with", result["rows"], "rows and", result["files"], "files")
+
+
+# _______________________________________________________________________________________________________
+# _______________________________________________________________________________________________________
+
+
+def http_cached(etag, build):
+    # The ETag is computed from versions alone, so a matching If-None-Match never
+    # loads or serializes the body.
+    if request.if_none_match.contains_weak(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = jsonify(build())
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "public, max-age=%d, must-revalidate" % current_app.config["HTTP_CACHE_MAX_AGE"]
+    return response
+
+
+def row_etag(model, ident, version):
+    if version is None:
+        abort(404)
+    return f"{model.__tablename__}-{ident}-{version}"
 
-    filename = uploaded_img.filename
-    if filename != "":
-        if worldobj.img_link != "/staticFiles/images/worldobj_base.jpg":
-            os.remove(worldobj.img_link[1:])
-        worldobj_img_name = "worldobj" + str(worldobj.id) + ".jpg"
-        uploaded_img.save(os.path.join(app.config["UPLOAD_FOLDER"], worldobj_img_name))
-        worldobj.img_link = "/" + os.path.join(app.config["UPLOAD_FOLDER"], worldobj_img_name)
 
-        db.session.add(worldobj)
-        db.session.commit()
+def listing_versions(model, criteria):
+    return select(func.count(), func.max(model.version)).where(*criteria)
 
-    return jsonify({"message": "World object image edit successfully."}), 200
 
+def listing_etag(count, max_version):
+    return hashlib.sha1(repr((request.full_path, count, max_version)).encode()).hexdigest()
+
+
+def api_row(model, ident):
+    etag = row_etag(model, ident, read_execute(select(model.version).where(model.id == ident)).scalar())
+    return http_cached(etag, lambda: fetch_one_json_or_404(model, ident))
+
+
+def api_listing(model, criteria):
+    try:
+        limit, after_id = page_args(request.args)
+    except (TypeError, ValueError, KeyError):
+        return jsonify({"error": "Invalid pagination parameters."}), 400
+    etag = listing_etag(*read_execute(listing_versions(model, criteria)).one())
+    return http_cached(etag, lambda: keyset_page(model, criteria, limit, after_id))
+
+
+@bp.route("/api/worlds", methods=["GET"])
+def api_worlds():
+    return api_listing(World, [])
+
+
+@bp.route("/api/worlds/<int:world_id>", methods=["GET"])
+def api_world(world_id):
+    return api_row(World, world_id)
+
+
+@bp.route("/api/worlds/<int:world_id>/longreads", methods=["GET"])
+def api_world_longreads(world_id):
+    exists_or_404(World, world_id)
+    return api_listing(LongRead, [LongRead.world_id == world_id])
+
+
+@bp.route("/api/worlds/<int:world_id>/worldobjs", methods=["GET"])
+def api_world_worldobjs(world_id):
+    exists_or_404(World, world_id)
+    return api_listing(WorldObj, [WorldObj.world_id == world_id])
+
+
+@bp.route("/api/worlds/<int:world_id>/blockcontents", methods=["GET"])
+def api_world_blockcontents(world_id):
+    exists_or_404(World, world_id)
+    return api_listing(BlockContent, [BlockContent.longread_id.in_(select(LongRead.id).where(LongRead.world_id == world_id))])
+
+
+@bp.route("/api/longreads", methods=["GET"])
+def api_longreads():
+    return api_listing(LongRead, [])
+
+
+@bp.route("/api/longreads/<int:longread_id>", methods=["GET"])
+def api_longread(longread_id):
+    return api_row(LongRead, longread_id)
+
+
+@bp.route("/api/longreads/<int:longread_id>/full", methods=["GET"])
+def api_longread_full(longread_id):
+    with_worldobjs = request.args.get("with_worldobjs", "").lower() in ("1", "true")
+    chapter_sel = select(Chapter.id).where(Chapter.longread_id == longread_id)
+    blockcontent_sel = select(BlockContent.id).where(BlockContent.chapter_id.in_(chapter_sel))
+    versions = read_execute(select(
+        select(LongRead.version).where(LongRead.id == longread_id).scalar_subquery(),
+        select(func.count()).select_from(Chapter).where(Chapter.longread_id == longread_id).scalar_subquery(),
+        select(func.max(Chapter.version)).where(Chapter.longread_id == longread_id).scalar_subquery(),
+        select(func.count()).select_from(BlockContent).where(BlockContent.chapter_id.in_(chapter_sel)).scalar_subquery(),
+        select(func.max(BlockContent.version)).where(BlockContent.chapter_id.in_(chapter_sel)).scalar_subquery(),
+        select(func.count()).select_from(blockcontents)
+        .where(blockcontents.c.blockcontent_id.in_(blockcontent_sel)).scalar_subquery(),
+    )).one()
+    if versions[0] is None:
+        abort(404)
+    etag = hashlib.sha1(repr((request.full_path, tuple(versions))).encode()).hexdigest()
+    return http_cached(etag, lambda: longread_full_json(longread_id, with_worldobjs))
+
+
+@bp.route("/api/longreads/<int:longread_id>/chapters", methods=["GET"])
+def api_longread_chapters(longread_id):
+    exists_or_404(LongRead, longread_id)
+    return api_listing(Chapter, [Chapter.longread_id == longread_id])
+
+
+@bp.route("/api/longreads/<int:longread_id>/blockcontents", methods=["GET"])
+def api_longread_blockcontents(longread_id):
+    exists_or_404(LongRead, longread_id)
+    return api_listing(BlockContent, [BlockContent.longread_id == longread_id])
+
+
+@bp.route("/api/chapters/<int:chapter_id>", methods=["GET"])
+def api_chapter(chapter_id):
+    return api_row(Chapter, chapter_id)
+
+
+@bp.route("/api/chapters/<int:chapter_id>/blockcontents", methods=["GET"])
+def api_chapter_blockcontents(chapter_id):
+    exists_or_404(Chapter, chapter_id)
+    return api_listing(BlockContent, [BlockContent.chapter_id == chapter_id])
+
+
+@bp.route("/api/blockcontents/<int:blockcontent_id>", methods=["GET"])
+def api_blockcontent(blockcontent_id):
+    return api_row(BlockContent, blockcontent_id)
+
+
+@bp.route("/api/worldobjs/<int:worldobj_id>", methods=["GET"])
+def api_worldobj(worldobj_id):
+    return api_row(WorldObj, worldobj_id)
+
+
+# _______________________________________________________________________________________________________
+# _______________________________________________________________________________________________________
+
+
+def hot_statements():
+    # The statements behind the most frequent endpoints, with representative parameters.
+    chapter_sel = select(Chapter.id).where(Chapter.longread_id == 1)
+    return {
+        "/longread/chapter/blockcontent/all": select_json(BlockContent, BlockContent.chapter_id == 1, BlockContent.id > 0)
+        .order_by(BlockContent.id).limit(PAGE_DEFAULT_LIMIT + 1),
+        "/longread/blockcontent/all": select_json(BlockContent, BlockContent.longread_id == 1, BlockContent.id > 0)
+        .order_by(BlockContent.id).limit(PAGE_DEFAULT_LIMIT + 1),
+        "/world/blockcontent/all per longread": select_json(BlockContent, BlockContent.longread_id == 1,
+                                                             BlockContent.id > 0)
+        .order_by(BlockContent.id).limit(PAGE_DEFAULT_LIMIT + 1),
+        "/longread/chapter/all": select_json(Chapter, Chapter.longread_id == 1, Chapter.id > 0)
+        .order_by(Chapter.id).limit(PAGE_DEFAULT_LIMIT + 1),
+        "/world/longread/all": select_json(LongRead, LongRead.world_id == 1, LongRead.id > 0)
+        .order_by(LongRead.id).limit(PAGE_DEFAULT_LIMIT + 1),
+        "/world/worldobj/all": select_json(WorldObj, WorldObj.world_id == 1, WorldObj.id > 0)
+        .order_by(WorldObj.id).limit(PAGE_DEFAULT_LIMIT + 1),
+        "/worlds/all": select_json(World, World.id > 0).order_by(World.id).limit(PAGE_DEFAULT_LIMIT + 1),
+        "/longreads/all": select_json(LongRead, LongRead.id > 0).order_by(LongRead.id).limit(PAGE_DEFAULT_LIMIT + 1),
+        "/longread/chapter/blockcontent": select_json(BlockContent, BlockContent.id == 1),
+        "/world/longread/full chapters": select_json(Chapter, Chapter.longread_id == 1).order_by(Chapter.id),
+        "/world/longread/full blockcontents": select_json(BlockContent, BlockContent.chapter_id.in_(chapter_sel))
+        .order_by(BlockContent.id),
+        "/world/longread/full worldobj links": select(blockcontents.c.blockcontent_id, blockcontents.c.worldobj_id)
+        .join(BlockContent, BlockContent.id == blockcontents.c.blockcontent_id)
+        .where(BlockContent.chapter_id.in_(chapter_sel)),
+        "/api/chapters/<id>/blockcontents etag": select(func.count(), func.max(BlockContent.version))
+        .where(BlockContent.chapter_id == 1),
+        "/api/worlds/<id>/longreads etag": select(func.count(), func.max(LongRead.version))
+        .where(LongRead.world_id == 1),
+        "/longread/blockcontent/event/window time per longread": event_window_rows(
+            1, *event_window_criteria({"time_from": 0, "time_to": 100}), event_after_criteria([5, 3]))
+        .limit(PAGE_DEFAULT_LIMIT + 1),
+        "/longread/blockcontent/event/window bbox per longread": event_window_rows(
+            1, *event_window_criteria({"bbox": {"min_x": 0, "min_y": 0, "max_x": 10, "max_y": 10}}))
+        .limit(PAGE_DEFAULT_LIMIT + 1),
+        "/longread/blockcontent/event/window per longread": event_window_rows(
+            1, *event_window_criteria({}), event_after_criteria([None, 3])).limit(PAGE_DEFAULT_LIMIT + 1),
+        "/longread/blockcontent/event/timeline per longread": timeline_buckets(
+            100, 1, timeline_bucket.c.max_time >= 0, timeline_bucket.c.min_time <= 1000),
+        "timeline_refresh": timeline_aggregates(100, BlockContent.longread_id == 1, BlockContent.time >= 0,
+                                                BlockContent.time < 200, timeline_bucket_of(100).in_([0, 1])),
+        "/world/changes chapters per longread": select_json(
+            Chapter, Chapter.longread_id == 1, Chapter.version > 0,
+            tuple_(Chapter.version, Chapter.id) > tuple_(1, 1)).add_columns(Chapter.version)
+        .order_by(Chapter.version, Chapter.id).limit(PAGE_DEFAULT_LIMIT + 1),
+        "/world/changes blockcontents per longread": select_json(
+            BlockContent, BlockContent.longread_id == 1, BlockContent.version > 0,
+            tuple_(BlockContent.version, BlockContent.id) > tuple_(1, 1)).add_columns(BlockContent.version)
+        .order_by(BlockContent.version, BlockContent.id).limit(PAGE_DEFAULT_LIMIT + 1),
+        "/world/changes tombstones": select(tombstone.c.id, tombstone.c.entity, tombstone.c.entity_id,
+                                            tombstone.c.version)
+        .where(tombstone.c.world_id == 1, tombstone.c.version > 0)
+        .order_by(tombstone.c.version, tombstone.c.id).limit(PAGE_DEFAULT_LIMIT + 1),
+        "search_remove_deleted": deleted_search_rowids(BlockContent, 1),
+        "cascade_delete worldobj links": select(BlockContent.longread_id).distinct()
+        .join(blockcontents, blockcontents.c.blockcontent_id == BlockContent.id)
+        .where(blockcontents.c.worldobj_id.in_([1])),
+    }
+
+
+def query_plan_scans():
+    # Plans are taken on an empty in-memory copy of the live schema, so they reflect the
+    # indexes that exist rather than the row counts of whatever data happens to be loaded.
+    with db.engine.connect() as connection:
+        schema = connection.exec_driver_sql(
+            "SELECT sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'").scalars().all()
+    replica = sqlalchemy.create_engine("sqlite://")
+    scans = {}
+    with replica.connect() as connection:
+        for sql in schema:
+            try:
+                connection.exec_driver_sql(sql)
+            except sqlalchemy.exc.OperationalError:
+                # shadow tables of virtual tables are recreated with the virtual table itself
+                pass
+        for name, statement in hot_statements().items():
+            sql = str(statement.compile(connection, compile_kwargs={"literal_binds": True}))
+            details = [row[-1] for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + sql)]
+            # a virtual table "scan" with a constraint string (e.g. INDEX 2:D1B0) is an R*Tree
+            # lookup, and scanning a materialized subquery reads its result, not a table
+            derived = {detail.split()[1] for detail in details if detail.startswith(("MATERIALIZE ", "CO-ROUTINE "))}
+            table_scans = [detail for detail in details if detail.startswith("SCAN ")
+                           and detail.split()[1] not in derived
+                           and not re.search(r"VIRTUAL TABLE INDEX \d+:\S", detail)]
+            if " LIMIT " in sql or name.endswith(" per longread"):
+                # a page that has to sort its whole candidate set costs as much as reading all of
+                # it, and so does each stream merged_rows() reads
+                table_scans += [detail for detail in details
+                                if detail.startswith("USE TEMP B-TREE FOR") and "ORDER BY" in detail]
+            if table_scans:
+                scans[name] = table_scans
+    replica.dispose()
+    return scans
+
+
+@bp.cli.command("check-query-plans")
+def check_query_plans_command():
+    scans = query_plan_scans()
+    for name, details in scans.items():
+        print(f"{name}: {'; '.join(details)}")
+    if scans:
+        sys.exit(1)
+    print("no table scans or sorted pages in", len(hot_statements()), "hot statements")
+
+
+# _______________________________________________________________________________________________________
+# _______________________________________________________________________________________________________
+
+
+SEARCH_DEFAULT_LIMIT = 20
+
+
+def fts_query(text):
+    # every word becomes a quoted term, so user input can never be parsed as FTS5 syntax
+    return " ".join('"' + term.replace('"', '""') + '"' for term in text.split())
+
+
+@bp.route("/search", methods=["POST"])
+def search():
+    try:
+        query = fts_query(request.json["query"])
+        world_id = request.json.get("world_id")
+        world_id = None if world_id is None else int(world_id)
+        longread_id = request.json.get("longread_id")
+        longread_id = None if longread_id is None else int(longread_id)
+        entities = request.json.get("entities")
+        limit = int(request.json.get("limit", SEARCH_DEFAULT_LIMIT))
+        offset = int(request.json.get("offset", 0))
+    except (KeyError, AttributeError, TypeError, ValueError):
+        return jsonify({"error": "Invalid JSON data. Missing any key."}), 400
+    if not query or not 1 <= limit <= PAGE_MAX_LIMIT or offset < 0:
+        return jsonify({"error": "Invalid search parameters."}), 400
+    known = sorted(SEARCH_ENTITIES.values())
+    if entities is not None and not (isinstance(entities, list)
+                                     and all(isinstance(entity, str) and entity in known for entity in entities)):
+        return jsonify({"error": "Unknown search entities.", "entities": known}), 400
+
+    # title matches weigh more than body matches
+    rank = func.bm25(literal_column("search_index"), 5.0, 1.0)
+    statement = (select(search_index.c.entity, search_index.c.entity_id, search_index.c.world_id,
+                        search_index.c.longread_id, search_index.c.title,
+                        func.snippet(literal_column("search_index"), -1, "<b>", "</b>", "…", 16).label("snippet"),
+                        rank.label("rank"))
+                 .where(literal_column("search_index").op("MATCH")(query))
+                 .order_by(rank).limit(limit + 1).offset(offset))
+    if world_id is not None:
+        statement = statement.where(search_index.c.world_id == world_id)
+    if longread_id is not None:
+        statement = statement.where(search_index.c.longread_id == longread_id)
+    if entities:
+        statement = statement.where(search_index.c.entity.in_(entities))
+
+    rows = [row._asdict() for row in read_execute(statement)]
+    next_offset = offset + limit if len(rows) > limit else None
+    return jsonify({"items": rows[:limit], "next_offset": next_offset})
+
+
+# _______________________________________________________________________________________________________
+# _______________________________________________________________________________________________________
+
+
+# Responses are encoded by the JSON_PROVIDER named in the config and compressed with the first of
+# COMPRESSION_ENCODINGS that the client accepts at its highest quality. Bodies smaller than
+# COMPRESSION_MIN_SIZE and types outside COMPRESSION_MIMETYPES go out as they are. brotli and
+# zstd need the brotli and zstandard packages and are skipped without them.
+class OrjsonProvider(DefaultJSONProvider):
+    # orjson encodes straight to UTF-8 bytes. Keys are still sorted and unknown types still go
+    # through Flask's default hook; the only visible difference is that non-ASCII text is not escaped.
+    def options(self, pretty=False):
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if pretty:
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps_bytes(self, obj):
+        return orjson.dumps(obj, default=self.default, option=self.options())
+
+    def dumps(self, obj, **kwargs):
+        return self.dumps_bytes(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = self.compact is False or (self.compact is None and self._app.debug)
+        body = orjson.dumps(obj, default=self.default, option=self.options(pretty))
+        return self._app.response_class(body + b"\n", mimetype=self.mimetype)
+
+
+JSON_PROVIDERS = {'default': DefaultJSONProvider, 'orjson': OrjsonProvider}
+
+
+def json_provider_class(setting):
+    # JSON_PROVIDER is a name from JSON_PROVIDERS or a JSONProvider subclass
+    if not isinstance(setting, str):
+        return setting
+    if setting == 'orjson' and orjson is None:
+        return DefaultJSONProvider
+    return JSON_PROVIDERS[setting]
+
+
+def json_encoder():
+    provider = current_app.json
+    if isinstance(provider, OrjsonProvider):
+        return provider.dumps_bytes
+    return lambda obj: provider.dumps(obj).encode()
+
+
+def gzip_encoder(level):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress, compressor.flush
+
+
+def brotli_encoder(level):
+    compressor = brotli.Compressor(quality=level)
+    return compressor.process, compressor.finish
+
+
+def zstd_encoder(level):
+    compressor = zstandard.ZstdCompressor(level=level).compressobj()
+    return compressor.compress, compressor.flush
+
+
+CONTENT_ENCODERS = {'gzip': gzip_encoder, 'br': brotli_encoder, 'zstd': zstd_encoder}
+
+
+def available_encodings():
+    installed = {'gzip': True, 'br': brotli is not None, 'zstd': zstandard is not None}
+    return [encoding for encoding in current_app.config['COMPRESSION_ENCODINGS'] if installed[encoding]]
+
+
+def accepted_encoding():
+    available = available_encodings()
+    return request.accept_encodings.best_match(available) if available else None
+
+
+def compress_body(body, encoding):
+    compress, finish = CONTENT_ENCODERS[encoding](current_app.config['COMPRESSION_LEVELS'][encoding])
+    return compress(body) + finish()
+
+
+def compressed_stream(chunks, encoding, level):
+    compress, finish = CONTENT_ENCODERS[encoding](level)
+    for chunk in chunks:
+        data = compress(chunk)
+        if data:
+            yield data
+    yield finish()
+
+
+def precompressed_response(key, body, encoding, wanted):
+    # A cached body is compressed once per encoding; later hits send the stored copy as it is.
+    if encoding is None and wanted is not None and len(body) >= current_app.config['COMPRESSION_MIN_SIZE']:
+        body = compress_body(body, wanted)
+        read_cache.set_variant(key, wanted, body)
+        encoding = wanted
+    response = current_app.response_class(body, mimetype="application/json")
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+# registered after finish_request_metrics, so it runs first and the metrics count wire bytes
+@bp.after_app_request
+def compress_response(response):
+    config = current_app.config
+    if response.mimetype not in config['COMPRESSION_MIMETYPES'] or "Content-Encoding" in response.headers:
+        return response
+    response.vary.add("Accept-Encoding")
+    if response.direct_passthrough or response.status_code in (204, 206, 304):
+        return response
+    encoding = accepted_encoding()
+    if encoding is None:
+        return response
+    if response.is_streamed:
+        # the size of a stream is unknown up front, so it is always compressed
+        response.response = compressed_stream(response.iter_encoded(), encoding,
+                                              config['COMPRESSION_LEVELS'][encoding])
+    else:
+        body = response.get_data()
+        if len(body) < config['COMPRESSION_MIN_SIZE']:
+            return response
+        response.set_data(compress_body(body, encoding))
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        # the compressed bytes differ from the plain ones, so a strong validator would be wrong
+        response.set_etag(etag, weak=True)
+    return response
+
+
+# _______________________________________________________________________________________________________
+# _______________________________________________________________________________________________________
+
+
+def create_app(config=None):
+    # Settings are DEFAULT_CONFIG, then the python file named by DARTS_CONFIG, then the
+    # variables in ENVIRONMENT_CONFIG, then the config argument.
+    app = Flask(__name__, template_folder='templates', static_folder='staticFiles')
+    app.config.update(copy.deepcopy(DEFAULT_CONFIG))
+    app.config.from_envvar('DARTS_CONFIG', silent=True)
+    for variable, key in ENVIRONMENT_CONFIG.items():
+        if variable in os.environ:
+            app.config[key] = os.environ[variable]
+    app.config.update(config or {})
+    app.json = json_provider_class(app.config['JSON_PROVIDER'])(app)
+    configure_database(app.config)
+
+    db.init_app(app)
+    app.extensions['read_cache'] = ReadCache(app.config['READ_CACHE_MAX_ENTRIES'],
+                                             app.config['READ_CACHE_MAX_BYTES'],
+                                             app.config['READ_CACHE_TTL'])
+    app.extensions['job_runner'] = JobRunner()
+    app.extensions['request_metrics'] = RequestMetrics()
+    app.register_blueprint(bp)
+
+    with app.app_context():
+        configure_engines(app.config)
+        upgrade_database()
+    return app
+
+
+# _______________________________________________________________________________________________________
+# _______________________________________________________________________________________________________
+
+
+# The ASGI app receives every request body on the event loop, so a slow client holds no thread.
+# The /api row and listing reads then run on the async engine (ASYNC_DATABASE_URI) inside the
+# event loop; everything else, writes and uploads included, is handed to the Flask app on one of
+# ASGI_THREADS threads with its body already spooled. The entries below mirror the /api views.
+ASYNC_API_ROWS = {
+    "darts.api_world": World,
+    "darts.api_longread": LongRead,
+    "darts.api_chapter": Chapter,
+    "darts.api_blockcontent": BlockContent,
+    "darts.api_worldobj": WorldObj,
+}
+# endpoint: (model, the parent that must exist, the criteria for the parent id)
+ASYNC_API_LISTINGS = {
+    "darts.api_worlds": (World, None, lambda: []),
+    "darts.api_world_longreads": (LongRead, World, lambda world_id: [LongRead.world_id == world_id]),
+    "darts.api_world_worldobjs": (WorldObj, World, lambda world_id: [WorldObj.world_id == world_id]),
+    "darts.api_world_blockcontents": (BlockContent, World, lambda world_id: [
+        BlockContent.longread_id.in_(select(LongRead.id).where(LongRead.world_id == world_id))]),
+    "darts.api_longreads": (LongRead, None, lambda: []),
+    "darts.api_longread_chapters": (Chapter, LongRead, lambda longread_id: [Chapter.longread_id == longread_id]),
+    "darts.api_longread_blockcontents": (BlockContent, LongRead,
+                                         lambda longread_id: [BlockContent.longread_id == longread_id]),
+    "darts.api_chapter_blockcontents": (BlockContent, Chapter,
+                                        lambda chapter_id: [BlockContent.chapter_id == chapter_id]),
+}
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+async def async_http_cached(etag, build):
+    # http_cached() for a body that is loaded with await
+    if request.if_none_match.contains_weak(etag):
+        return http_cached(etag, None)
+    body = await build()
+    return http_cached(etag, lambda: body)
+
+
+async def async_api_row(connection, model, ident):
+    etag = row_etag(model, ident, (await connection.execute(select(model.version).where(model.id == ident))).scalar())
+
+    async def build():
+        row = (await connection.execute(select_json(model, model.id == ident))).first()
+        if row is None:
+            abort(404)
+        return dict(zip(SERIALIZED_FIELDS[model], row))
+
+    return await async_http_cached(etag, build)
+
+
+async def async_api_listing(connection, model, parent, criteria, parent_id=None):
+    if parent is not None and (await connection.execute(select(parent.id).where(parent.id == parent_id))).scalar() is None:
+        abort(404)
+    try:
+        limit, after_id = page_args(request.args)
+    except (TypeError, ValueError, KeyError):
+        return jsonify({"error": "Invalid pagination parameters."}), 400
+    etag = listing_etag(*(await connection.execute(listing_versions(model, criteria))).one())
+
+    async def build():
+        rows = await connection.execute(keyset_statement(model, criteria, limit, after_id))
+        return keyset_result(rows_to_json(model, rows), limit)
+
+    return await async_http_cached(etag, build)
+
+
+async def async_api_view(engine, endpoint, args):
+    # the listing and its ETag, or the row and its version, come from one read transaction
+    async with engine.connect() as connection:
+        if endpoint in ASYNC_API_ROWS:
+            return await async_api_row(connection, ASYNC_API_ROWS[endpoint], *args.values())
+        model, parent, criteria = ASYNC_API_LISTINGS[endpoint]
+        return await async_api_listing(connection, model, parent, criteria(*args.values()), *args.values())
+
+
+def asgi_environ(scope, body, size):
+    # the WSGI environ of an ASGI http scope whose body has been received into body
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+        "PATH_INFO": scope["path"].encode().decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1] or 80),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": body,
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"], environ["REMOTE_PORT"] = scope["client"][0], str(scope["client"][1])
+    for name, value in scope["headers"]:
+        key = name.decode("latin-1").upper().replace("-", "_")
+        if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            key = "HTTP_" + key
+        value = value.decode("latin-1")
+        environ[key] = environ[key] + "," + value if key in environ else value
+    # a chunked body has no Content-Length; the spooled one has
+    environ["CONTENT_LENGTH"] = str(size)
+    return environ
+
+
+def asgi_headers(headers):
+    return [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+
+
+class AsgiApp:
+    def __init__(self, app):
+        self.app = app
+        self.max_body = max(app.config['IMAGE_MAX_BYTES'], app.config['MAP_MAX_BYTES'],
+                            app.config['ARCHIVE_MAX_BYTES']) + UPLOAD_CHUNK_SIZE
+        self.threads = ThreadPoolExecutor(max_workers=app.config['ASGI_THREADS'], thread_name_prefix="asgi")
+        self.engine = None
+        if app.config.get('ASYNC_DATABASE_URI'):
+            if create_async_engine is None:
+                raise RuntimeError("ASYNC_DATABASE_URI needs sqlalchemy.ext.asyncio")
+            self.engine = create_async_engine(app.config['ASYNC_DATABASE_URI'], **app.config['ASYNC_POOL_OPTIONS'])
+            if self.engine.dialect.name == 'sqlite':
+                configure_sqlite_engine(self.engine.sync_engine, sqlite_read_pragmas(app.config), "BEGIN")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.http(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                if self.engine is not None:
+                    await self.engine.dispose()
+                self.threads.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def receive_body(self, receive):
+        # Past ASGI_SPOOL_MEMORY bytes the body goes to a temporary file; those writes land in
+        # the page cache, so they do not hold up the loop the way waiting on the client would.
+        body = tempfile.SpooledTemporaryFile(max_size=self.app.config['ASGI_SPOOL_MEMORY'])
+        size = 0
+        try:
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    raise ConnectionResetError("client disconnected")
+                chunk = message.get("body", b"")
+                size += len(chunk)
+                if size > self.max_body:
+                    raise BodyTooLarge()
+                body.write(chunk)
+                if not message.get("more_body"):
+                    break
+        except BaseException:
+            body.close()
+            raise
+        body.seek(0)
+        return body, size
+
+    async def http(self, scope, receive, send):
+        try:
+            body, size = await self.receive_body(receive)
+        except ConnectionResetError:
+            return
+        except BodyTooLarge:
+            await send({"type": "http.response.start", "status": 413,
+                        "headers": [(b"content-type", b"application/json")]})
+            await send({"type": "http.response.body", "body": b'{"error": "Request body is too large."}\n'})
+            return
+        with body:
+            environ = asgi_environ(scope, body, size)
+            match = self.async_endpoint(environ)
+            if match is not None:
+                await self.run_async(environ, *match, send)
+            else:
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(self.threads, self.run_wsgi, environ, send, loop)
+
+    def async_endpoint(self, environ):
+        if self.engine is None or environ["REQUEST_METHOD"] not in ("GET", "HEAD"):
+            return None
+        try:
+            endpoint, args = self.app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return None
+        if endpoint in ASYNC_API_ROWS or endpoint in ASYNC_API_LISTINGS:
+            return endpoint, args
+        return None
+
+    async def run_async(self, environ, endpoint, args, send):
+        # Flask's full_dispatch_request(), with the view awaited: the request hooks, error
+        # handlers, compression and metrics are the ones the threaded requests get.
+        app = self.app
+        with app.request_context(environ):
+            try:
+                try:
+                    response = app.preprocess_request()
+                    if response is None:
+                        response = await async_api_view(self.engine, endpoint, args)
+                except Exception as e:
+                    response = app.handle_user_exception(e)
+                response = app.finalize_request(response)
+            except Exception as e:
+                response = app.handle_exception(e)
+            body, status, headers = response.get_wsgi_response(environ)
+        try:
+            await send({"type": "http.response.start", "status": response.status_code, "headers": asgi_headers(headers)})
+            await send({"type": "http.response.body", "body": b"".join(body)})
+        finally:
+            response.close()
+
+    def run_wsgi(self, environ, send, loop):
+        # Runs on a pool thread and waits for each send, so a slow reader of a streamed response
+        # holds back the stream rather than buffering it.
+        def send_message(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [{"type": "http.response.start", "status": int(status.split(" ", 1)[0]),
+                           "headers": asgi_headers(headers)}]
+
+        body = self.app(environ, start_response)
+        try:
+            for chunk in body:
+                if chunk:
+                    if started:
+                        send_message(started.pop())
+                    send_message({"type": "http.response.body", "body": chunk, "more_body": True})
+            if started:
+                send_message(started.pop())
+            send_message({"type": "http.response.body", "body": b""})
+        finally:
+            if hasattr(body, "close"):
+                body.close()
+
+
+def create_asgi_app(config=None):
+    # e.g. uvicorn --factory 'db_service:create_asgi_app'
+    return AsgiApp(create_app(config))
+
+
+def __getattr__(name):
+    # "db_service:app" and "from db_service import app" still work: the app is built by
+    # create_app() on first use instead of at import
+    global app
+    if name == "app":
+        app = create_app()
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
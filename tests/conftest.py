@@ -0,0 +1,42 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db_service
+from benchmarks.generate import generate
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # uploads are written relative to the working directory; jobs only run when a test runs them,
+    # and the read cache is off so every request reaches the database
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(os.path.join("staticFiles", "images"))
+    app = db_service.create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///" + str(tmp_path / "test.db"),
+                                 "JOB_WORKERS": 0, "READ_CACHE_MAX_ENTRIES": 0})
+    yield app
+    with app.app_context():
+        for engine in db_service.db.engines.values():
+            engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def fixture(app):
+    # two worlds of two longreads, three chapters each and four blocks per chapter, with
+    # worldobjs linked to the blocks; the generated ids are returned as in benchmarks/
+    with app.app_context():
+        return generate(db_service, worlds=2, longreads=2, chapters=3, blocks=4, worldobjs=3, links=2)
+
+
+def count_rows(app, model):
+    with app.app_context():
+        return db_service.db.session.execute(
+            db_service.select(db_service.func.count()).select_from(model)).scalar()
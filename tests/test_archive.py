@@ -0,0 +1,95 @@
+import io
+import tarfile
+
+from sqlalchemy import func, select
+
+from db_service import Chapter, World, blockcontents, db
+
+
+def count_rows(app, table):
+    with app.app_context():
+        return db.session.execute(select(func.count()).select_from(table)).scalar()
+
+
+def world_content(client, world_id):
+    # the world's rows without their ids, which an import replaces
+    body = {"world_id": world_id, "limit": 1000}
+    longreads = client.post("/world/longread/all", json=body).get_json()["items"]
+    worldobjs = client.post("/world/worldobj/all", json=body).get_json()["items"]
+    blocks = client.post("/world/blockcontent/all", json=body).get_json()["items"]
+    return (sorted(longread["name"] for longread in longreads), sorted(worldobj["name"] for worldobj in worldobjs),
+            sorted(block["text"] for block in blocks))
+
+
+def export(client, world_id):
+    response = client.post("/world/export", json={"world_id": world_id})
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-tar"
+    return response.get_data()
+
+
+def import_archive(client, data):
+    return client.post("/world/import", data=data, content_type="application/x-tar")
+
+
+def rewrite(data, change):
+    # copies an archive, passing the name and bytes of every member through change
+    output = io.BytesIO()
+    with tarfile.open(fileobj=io.BytesIO(data)) as source, tarfile.open(fileobj=output, mode="w") as target:
+        for member in source:
+            content = change(member.name, source.extractfile(member).read())
+            member.size = len(content)
+            target.addfile(member, io.BytesIO(content))
+    return output.getvalue()
+
+
+def test_round_trip_copies_the_world(app, client, fixture):
+    links = count_rows(app, blockcontents)
+    response = import_archive(client, export(client, 1))
+    assert response.status_code == 201
+    body = response.get_json()
+    assert body["world_id"] == 3
+    assert body["rows"] == {"World": 1, "LongRead": 2, "WorldObj": 3, "Chapter": 6, "BlockContent": 24,
+                            "blockcontents": 48}
+    assert world_content(client, 3) == world_content(client, 1)
+    assert count_rows(app, blockcontents) == links + 48
+
+
+def test_export_of_an_imported_world_imports_again(client, fixture):
+    first = import_archive(client, export(client, 2)).get_json()["world_id"]
+    second = import_archive(client, export(client, first)).get_json()["world_id"]
+    assert world_content(client, second) == world_content(client, 2)
+
+
+def test_rejected_archives_leave_nothing_behind(app, client, fixture):
+    data = export(client, 1)
+    worlds, chapters = count_rows(app, World), count_rows(app, Chapter)
+    first_chapter = fixture["chapters"][0][0]
+
+    def drop_first_chapter(name, content):
+        if not name.startswith("rows/Chapter"):
+            return content
+        return b"".join(line for line in content.splitlines(True) if b'"id":%d,' % first_chapter not in line)
+
+    for archive in (rewrite(data, drop_first_chapter), data[:len(data) // 2], b"not an archive"):
+        response = import_archive(client, archive)
+        assert response.status_code == 400
+        assert "error" in response.get_json()
+    assert (count_rows(app, World), count_rows(app, Chapter)) == (worlds, chapters)
+
+
+def test_unknown_world_and_bad_request(client, fixture):
+    assert client.post("/world/export", json={"world_id": 99}).status_code == 404
+    assert client.post("/world/export", json={}).status_code == 400
+
+
+def test_cli_round_trip(app, client, fixture, tmp_path):
+    runner = app.test_cli_runner()
+    path = str(tmp_path / "world.tar")
+    result = runner.invoke(args=["export-world", "2", path])
+    assert result.exit_code == 0, result.output
+    result = runner.invoke(args=["import-world", path])
+    assert result.exit_code == 0, result.output
+    assert "imported world 3" in result.output
+    assert world_content(client, 3) == world_content(client, 2)
+    assert runner.invoke(args=["export-world", "99", path]).exit_code != 0
@@ -0,0 +1,181 @@
+import asyncio
+import importlib.util
+import json
+import os
+
+import pytest
+from flask import Flask
+
+import db_service
+
+
+def http_scope(method, path, query=b"", headers=()):
+    return {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method, "scheme": "http",
+            "path": path, "raw_path": path.encode(), "query_string": query, "root_path": "",
+            "headers": [(name.encode(), value.encode()) for name, value in headers],
+            "client": ("127.0.0.1", 50000), "server": ("testserver", 80)}
+
+
+async def call(asgi, method, path, query=b"", headers=(), body=b"", chunk_size=None):
+    # the request body arrives in chunk_size pieces, as from a slow client
+    chunk_size = chunk_size or max(len(body), 1)
+    messages = [{"type": "http.request", "body": body[start:start + chunk_size],
+                 "more_body": start + chunk_size < len(body)} for start in range(0, max(len(body), 1), chunk_size)]
+    sent = []
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    await asgi(http_scope(method, path, query, headers), receive, send)
+    start, bodies = sent[0], sent[1:]
+    assert start["type"] == "http.response.start"
+    assert bodies[-1].get("more_body", False) is False
+    headers = {name.decode(): value.decode() for name, value in start["headers"]}
+    return start["status"], headers, b"".join(message["body"] for message in bodies)
+
+
+async def lifespan(asgi, event):
+    messages, sent = [{"type": f"lifespan.{event}"}], []
+
+    async def receive():
+        return messages.pop(0) if messages else await asyncio.Future()
+
+    async def send(message):
+        sent.append(message)
+
+    task = asyncio.ensure_future(asgi({"type": "lifespan"}, receive, send))
+    while not sent:
+        await asyncio.sleep(0)
+    task.cancel()
+    assert sent == [{"type": f"lifespan.{event}.complete"}]
+
+
+@pytest.fixture
+def asgi(app):
+    if importlib.util.find_spec("aiosqlite") is None or importlib.util.find_spec("greenlet") is None:
+        # without them every request runs on the threads
+        app.config["ASYNC_DATABASE_URI"] = None
+    asgi = db_service.AsgiApp(app)
+    yield asgi
+    asgi.threads.shutdown()
+
+
+def run(asgi, scenario):
+    async def main():
+        await lifespan(asgi, "startup")
+        try:
+            return await scenario()
+        finally:
+            if asgi.engine is not None:
+                await asgi.engine.dispose()
+
+    return asyncio.run(main())
+
+
+API_PATHS = ["/api/worlds", "/api/worlds/1", "/api/worlds/1/longreads", "/api/worlds/1/worldobjs",
+             "/api/worlds/1/blockcontents", "/api/longreads?limit=1", "/api/longreads/2", "/api/longreads/2/chapters",
+             "/api/longreads/2/blockcontents?limit=5", "/api/chapters/1", "/api/chapters/1/blockcontents",
+             "/api/blockcontents/3", "/api/worldobjs/1", "/api/worlds/99", "/api/worlds/99/longreads",
+             "/api/longreads?limit=0"]
+
+
+def test_api_reads_run_on_the_async_engine(asgi, client, fixture, monkeypatch):
+    pytest.importorskip("aiosqlite")
+    pytest.importorskip("greenlet")
+
+    def threaded(environ, send, loop):
+        raise AssertionError("ran on a thread: " + environ["PATH_INFO"])
+
+    monkeypatch.setattr(asgi, "run_wsgi", threaded)
+
+    async def scenario():
+        results = []
+        for path in API_PATHS:
+            path, _, query = path.partition("?")
+            status, headers, body = await call(asgi, "GET", path, query.encode())
+            etag = headers.get("etag")
+            not_modified = await call(asgi, "GET", path, query.encode(), [("If-None-Match", etag)]) if etag else None
+            results.append((path, query, status, etag, body, not_modified))
+        return results
+
+    for path, query, status, etag, body, not_modified in run(asgi, scenario):
+        expected = client.get(path, query_string=query)
+        assert (status, etag) == (expected.status_code, expected.headers.get("ETag")), path
+        assert body == expected.get_data()
+        if etag:
+            assert not_modified[0] == 304 and not_modified[2] == b""
+
+
+def test_other_requests_run_on_the_flask_app(asgi, client, fixture):
+    expected = client.post("/world/longread/all", json={"world_id": 1}).get_data()
+
+    async def scenario():
+        return [await call(asgi, "POST", "/world/longread/all", body=b'{"world_id": 1}',
+                           headers=[("Content-Type", "application/json")], chunk_size=3),
+                await call(asgi, "POST", "/world/longread/edit", body=json.dumps(
+                    {"longread_id": 1, "name": "renamed", "description": "d"}).encode(),
+                    headers=[("Content-Type", "application/json")]),
+                await call(asgi, "GET", "/api/longreads/1/full"),
+                await call(asgi, "GET", "/api/nothing")]
+
+    listing, edit, full, missing = run(asgi, scenario)
+    assert listing[2] == expected
+    assert edit[0] == 200
+    assert (full[0], json.loads(full[2])["name"]) == (200, "renamed")
+    assert missing[0] == 404
+
+
+def multipart(data):
+    boundary = "darts-boundary"
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="uploaded-file"; filename="a.png"\r\n'
+            f'Content-Type: image/png\r\n\r\n').encode() + data + f"\r\n--{boundary}--\r\n".encode()
+    return body, [("Content-Type", f"multipart/form-data; boundary={boundary}")]
+
+
+def test_uploads_are_spooled_before_a_thread_takes_them(app, asgi, fixture):
+    png = b"\x89PNG\r\n\x1a\n" + os.urandom(300 * 1024)
+    body, headers = multipart(png)
+
+    async def scenario():
+        return await call(asgi, "POST", "/world/longread/1/edit_image", headers=headers, body=body, chunk_size=4096)
+
+    status, _, response = run(asgi, scenario)
+    assert (status, json.loads(response)["status"]) == (202, "processing")
+    with app.app_context():
+        jobs = db_service.db.session.execute(db_service.select(db_service.job_outbox.c.kind)).scalars().all()
+    assert "image_upload" in jobs
+
+
+def test_a_body_over_the_largest_limit_is_refused_while_received(app, asgi):
+    asgi.max_body = 10 * 1024
+    body, headers = multipart(b"\x89PNG\r\n\x1a\n" + bytes(20 * 1024))
+
+    async def scenario():
+        return await call(asgi, "POST", "/world/longread/1/edit_image", headers=headers, body=body, chunk_size=1024)
+
+    status, _, response = run(asgi, scenario)
+    assert status == 413
+    assert json.loads(response) == {"error": "Request body is too large."}
+
+
+def test_module_app_is_built_on_first_use(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("DARTS_DATABASE_URI", "sqlite:///" + str(tmp_path / "module.db"))
+    assert "app" not in vars(db_service)
+    try:
+        app = db_service.app
+        assert isinstance(app, Flask)
+        assert db_service.app is app
+        from db_service import app as imported
+        assert imported is app
+    finally:
+        app = vars(db_service).pop("app", None)
+        if app is not None:
+            with app.app_context():
+                for engine in db_service.db.engines.values():
+                    engine.dispose()
+    with pytest.raises(AttributeError):
+        db_service.nothing_here
@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+
+def batch(client, body):
+    # encoded by the json module, so the tests can send what the test client's encoder refuses
+    return client.post("/longread/chapter/blockcontent/batch", data=json.dumps(body), content_type="application/json")
+
+
+def block(client, blockcontent_id):
+    response = client.post("/longread/chapter/blockcontent", json={"blockcontent_id": blockcontent_id})
+    return response.get_json() if response.status_code == 200 else None
+
+
+def test_creates_edits_and_deletes_in_one_request(client, fixture):
+    (first, longread_id, chapter_id), (second, _, _), (third, _, _) = fixture["blockcontents"][:3]
+    response = batch(client, {
+        "create": [{"longread_id": longread_id, "chapter_id": chapter_id, "text": f"new {number}"}
+                   for number in range(5)],
+        "edit": [{"blockcontent_id": str(first), "text": "edited", "coordx": 3, "coordy": 4, "time": 9},
+                 {"blockcontent_id": second, "time": None}],
+        "delete": [str(third)]})
+    assert response.status_code == 200
+    created_ids = response.get_json()["created_ids"]
+    assert [block(client, blockcontent_id)["text"] for blockcontent_id in created_ids] == [
+        f"new {number}" for number in range(5)]
+    assert created_ids == sorted(created_ids)
+    edited = block(client, first)
+    assert (edited["text"], edited["coordx"], edited["coordy"], edited["time"]) == ("edited", 3, 4, 9)
+    assert block(client, second)["time"] is None
+    assert block(client, third) is None
+
+
+def test_an_id_edited_and_deleted_is_rejected(client, fixture):
+    first, second = fixture["blockcontents"][0][0], fixture["blockcontents"][1][0]
+    before = [block(client, first), block(client, second)]
+    response = batch(client, {"edit": [{"blockcontent_id": first, "text": "edited"}],
+                              "delete": [second, str(first)]})
+    assert response.status_code == 400
+    assert response.get_json()["blockcontent_ids"] == [first]
+    assert [block(client, first), block(client, second)] == before
+
+
+@pytest.mark.parametrize("edit", [{"coordx": "abc"}, {"coordy": [1]}, {"coordx": 1.5}, {"coordy": 2 ** 31},
+                                  {"time": 1e30}, {"time": "soon"}, {"blockcontent_id": "one"}])
+def test_bad_edits_are_rejected(client, fixture, edit):
+    blockcontent_id = fixture["blockcontents"][0][0]
+    before = block(client, blockcontent_id)
+    response = batch(client, {"edit": [{"blockcontent_id": blockcontent_id, "text": "edited", **edit}]})
+    assert response.status_code == 400
+    assert block(client, blockcontent_id) == before
+
+
+def test_missing_ids_are_listed(client, fixture):
+    blockcontent_id = fixture["blockcontents"][0][0]
+    response = batch(client, {"edit": [{"blockcontent_id": blockcontent_id, "text": "edited"},
+                                       {"blockcontent_id": 998, "text": "edited"}], "delete": [999]})
+    assert response.status_code == 404
+    assert response.get_json()["blockcontent_ids"] == [998, 999]
+    assert block(client, blockcontent_id)["text"] != "edited"
@@ -0,0 +1,81 @@
+from collections import Counter
+
+
+def changes(client, world_id, **body):
+    response = client.post("/world/changes", json={"world_id": world_id, **body})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return response.get_json()
+
+
+def all_changes(client, world_id, since=0, limit=7):
+    pages, cursor = [], None
+    while True:
+        page = changes(client, world_id, since=since, limit=limit, **({"cursor": cursor} if cursor else {}))
+        pages.append(page)
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return [change for page in pages for change in page["changes"]], pages[-1]["sequence"]
+
+
+def test_first_sync_lists_every_row_of_the_world(client, fixture):
+    page = changes(client, 1, limit=1000)
+    assert page["next_cursor"] is None
+    assert all(change["op"] == "upsert" for change in page["changes"])
+    assert Counter(change["entity"] for change in page["changes"]) == {
+        "world": 1, "longread": 2, "worldobj": 3, "chapter": 6, "blockcontent": 24}
+    longread_ids = {longread_id for longread_id, world_id in fixture["longreads"] if world_id == 1}
+    blocks = [change for change in page["changes"] if change["entity"] == "blockcontent"]
+    assert {block["data"]["longread_id"] for block in blocks} == longread_ids
+    versions = [change["version"] for change in page["changes"]]
+    assert versions == sorted(versions)
+
+
+def test_cursor_pages_add_up_to_one_page(client, fixture):
+    client.post("/longread/chapter/blockcontent/batch", json={"create": [
+        {"longread_id": longread_id, "chapter_id": chapter_id, "text": "more"}
+        for chapter_id, longread_id in fixture["chapters"] if longread_id in (1, 2)]})
+    paged, sequence = all_changes(client, 1, limit=4)
+    page = changes(client, 1, limit=1000)
+    assert paged == page["changes"]
+    assert sequence == page["sequence"]
+
+
+def test_since_returns_only_later_writes_and_deletes(client, fixture):
+    _, sequence = all_changes(client, 1)
+    chapter_id = fixture["chapters"][0][0]
+    blockcontent_id = fixture["blockcontents"][-1][0]
+    assert client.post("/longread/chapter/edit", json={"chapter_id": chapter_id, "name": "renamed"}).status_code == 200
+    assert client.post("/longread/chapter/blockcontent/delete",
+                       json={"blockcontent_id": blockcontent_id}).status_code == 200
+
+    later, next_sequence = all_changes(client, 1, since=sequence)
+    assert [(change["entity"], change["op"], change["id"]) for change in later] == [
+        ("chapter", "upsert", chapter_id)]
+    assert later[0]["data"]["name"] == "renamed"
+    other, _ = all_changes(client, 2, since=sequence)
+    assert [(change["entity"], change["op"], change["id"]) for change in other] == [
+        ("blockcontent", "delete", blockcontent_id)]
+    assert next_sequence > sequence
+    assert all_changes(client, 1, since=next_sequence)[0] == []
+
+
+def test_deleted_world_syncs_its_tombstones(client, fixture):
+    _, sequence = all_changes(client, 2)
+    assert client.post("/world/delete", json={"world_id": 2}).status_code == 200
+
+    deleted, _ = all_changes(client, 2, since=sequence)
+    assert all(change["op"] == "delete" for change in deleted)
+    assert len({change["version"] for change in deleted}) == 1
+    assert Counter(change["entity"] for change in deleted) == {
+        "world": 1, "longread": 2, "worldobj": 3, "chapter": 6, "blockcontent": 24}
+    assert {change["id"] for change in deleted if change["entity"] == "blockcontent"} == {
+        blockcontent_id for blockcontent_id, longread_id, _ in fixture["blockcontents"]
+        if longread_id in (3, 4)}
+
+
+def test_unknown_world_and_bad_parameters(client, fixture):
+    assert client.post("/world/changes", json={"world_id": 99}).status_code == 404
+    assert client.post("/world/changes", json={}).status_code == 400
+    assert client.post("/world/changes", json={"world_id": 1, "since": "soon"}).status_code == 400
+    assert client.post("/world/changes", json={"world_id": 1, "limit": 0}).status_code == 400
+    assert client.post("/world/changes", json={"world_id": 1, "cursor": "not a cursor"}).status_code == 400
@@ -0,0 +1,35 @@
+def test_every_requested_id_has_an_entry(client, fixture):
+    blockcontent_ids = [blockcontent_id for blockcontent_id, _, _ in fixture["blockcontents"][:3]]
+    response = client.post("/entities", json={"blockcontent": blockcontent_ids + [999], "longread": [2],
+                                              "world": [1, 998]})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert sorted(body["items"]) == ["blockcontent", "longread", "world"]
+    assert sorted(body["items"]["blockcontent"]) == sorted(str(i) for i in blockcontent_ids + [999])
+    for blockcontent_id in blockcontent_ids:
+        assert body["items"]["blockcontent"][str(blockcontent_id)]["id"] == blockcontent_id
+    assert body["items"]["blockcontent"]["999"] is None
+    assert body["items"]["longread"]["2"]["world_id"] == 1
+    assert body["items"]["world"]["998"] is None
+    assert body["not_found"] == {"blockcontent": [999], "world": [998]}
+
+
+def test_entities_match_the_single_reads(client, fixture):
+    chapter_id = fixture["chapters"][0][0]
+    worldobj_id = fixture["worldobjs"][0][0]
+    items = client.post("/entities", json={"chapter": [chapter_id], "worldobj": [worldobj_id]}).get_json()["items"]
+    assert items["chapter"][str(chapter_id)] == client.post("/longread/chapter",
+                                                            json={"chapter_id": chapter_id}).get_json()
+    assert items["worldobj"][str(worldobj_id)] == client.post("/world/worldobj",
+                                                              json={"worldobj_id": worldobj_id}).get_json()
+
+
+def test_rejected_requests(client, fixture):
+    unknown = client.post("/entities", json={"planet": [1]})
+    assert unknown.status_code == 400
+    assert sorted(unknown.get_json()["entities"]) == ["blockcontent", "chapter", "longread", "world", "worldobj"]
+    too_many = client.post("/entities", json={"blockcontent": list(range(1, 600)), "chapter": list(range(1, 600))})
+    assert too_many.status_code == 400
+    assert too_many.get_json() == {"error": "Too many ids.", "max_ids": 1000}
+    assert client.post("/entities", json={}).status_code == 400
+    assert client.post("/entities", json={"chapter": ["one"]}).status_code == 400
@@ -0,0 +1,94 @@
+import json
+
+import pytest
+from sqlalchemy import text
+
+from db_service import db, migrate_add_event_index
+
+
+def window(client, **body):
+    response = client.post("/longread/blockcontent/event/window", json=body)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return response.get_json()
+
+
+def window_pages(client, limit, **body):
+    items, cursor = [], None
+    while True:
+        page = window(client, limit=limit, **body, **({"cursor": cursor} if cursor else {}))
+        items += page["items"]
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return items
+
+
+def expected_window(client, longread_ids, bbox=None, time_from=None, time_to=None):
+    # the window recomputed from every block of the longreads
+    items = []
+    for longread_id in longread_ids:
+        items += client.post("/longread/blockcontent/all",
+                             json={"longread_id": longread_id, "limit": 1000}).get_json()["items"]
+    on_map = [item for item in items if item["coordx"] is not None and item["coordy"] is not None]
+    if bbox:
+        items = [item for item in on_map if bbox["min_x"] <= item["coordx"] <= bbox["max_x"]
+                 and bbox["min_y"] <= item["coordy"] <= bbox["max_y"]]
+    else:
+        items = [item for item in items if item["coordx"] is not None or item["time"] is not None]
+    if time_from is not None or time_to is not None:
+        items = [item for item in items if item["time"] is not None
+                 and (time_from is None or item["time"] >= time_from) and (time_to is None or item["time"] <= time_to)]
+    return sorted(items, key=lambda item: (item["time"] is not None, item["time"] or 0, item["id"]))
+
+
+def edit_event(client, blockcontent_id, coordx, coordy, time=5):
+    return client.post("/longread/blockcontent/event/edit", data=json.dumps({
+        "blockcontent_id": blockcontent_id, "coordx": coordx, "coordy": coordy, "time": time,
+        "floating_text": "event"}), content_type="application/json")
+
+
+def test_pages_add_up_to_the_window(client, fixture):
+    blocks = [blockcontent_id for blockcontent_id, longread_id, _ in fixture["blockcontents"] if longread_id == 1]
+    # equal times across longreads, and events without a time, so the id breaks ties
+    for number, blockcontent_id in enumerate(blocks[:8]):
+        assert edit_event(client, blockcontent_id, number, number, time=None if number < 2 else 100).status_code == 200
+    for scope, longread_ids in (({"longread_id": 1}, [1]), ({"world_id": 1}, [1, 2])):
+        for query in ({}, {"bbox": {"min_x": 0, "min_y": 0, "max_x": 500, "max_y": 500}},
+                      {"time_from": 100, "time_to": 5000}):
+            expected = expected_window(client, longread_ids, **query)
+            assert expected
+            assert window_pages(client, 3, **scope, **query) == expected
+            assert window(client, limit=1000, **scope, **query)["items"] == expected
+
+
+@pytest.mark.parametrize("coordinate", ["abc", [1], {"x": 1}, 1.5, True, 2 ** 31, -2 ** 31 - 1])
+def test_invalid_coordinates_are_rejected(client, fixture, coordinate):
+    blockcontent_id = fixture["blockcontents"][0][0]
+    before = client.post("/longread/blockcontent/event", json={"blockcontent_id": blockcontent_id}).get_json()
+    assert edit_event(client, blockcontent_id, coordinate, 0).status_code == 400
+    assert edit_event(client, blockcontent_id, 0, coordinate).status_code == 400
+    assert client.post("/longread/blockcontent/event", json={"blockcontent_id": blockcontent_id}).get_json() == before
+
+
+def test_valid_coordinates_are_indexed(client, fixture):
+    blockcontent_id = fixture["blockcontents"][0][0]
+    assert edit_event(client, blockcontent_id, 2 ** 31 - 1, -2 ** 31).status_code == 200
+    corner = {"min_x": 2 ** 31 - 1, "max_x": 2 ** 31 - 1, "min_y": -2 ** 31, "max_y": -2 ** 31}
+    assert [item["id"] for item in window(client, longread_id=1, bbox=corner)["items"]] == [blockcontent_id]
+    assert edit_event(client, blockcontent_id, None, 7).status_code == 200
+    assert window(client, longread_id=1, bbox=corner)["items"] == []
+
+
+def test_migration_clears_coordinates_the_index_cannot_hold(app, client, fixture):
+    blocks = [blockcontent_id for blockcontent_id, longread_id, _ in fixture["blockcontents"] if longread_id == 1]
+    with app.app_context():
+        with db.engine.begin() as connection:
+            for blockcontent_id, coordx in zip(blocks, ["abc", 12.5, 2 ** 40]):
+                connection.execute(text('UPDATE "BlockContent" SET coordx = :coordx, coordy = 0 WHERE id = :id'),
+                                   {"coordx": coordx, "id": blockcontent_id})
+            migrate_add_event_index(connection)
+
+    coordinates = [client.post("/longread/blockcontent/event", json={"blockcontent_id": blockcontent_id}).get_json()
+                   ["coordx"] for blockcontent_id in blocks[:3]]
+    assert coordinates == [None, 12, None]
+    around_zero = {"min_x": -1, "max_x": 1, "min_y": -1, "max_y": 1}
+    assert window(client, longread_id=1, bbox=around_zero)["items"] == expected_window(client, [1], bbox=around_zero)
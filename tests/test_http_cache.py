@@ -0,0 +1,80 @@
+import pytest
+
+import db_service
+
+# path and the statements its ETag costs: the version lookup, plus the parent check of a
+# nested listing
+API_PATHS = [("/api/worlds", 1), ("/api/worlds/1", 1), ("/api/worlds/1/longreads", 2), ("/api/worlds/1/worldobjs", 2),
+             ("/api/worlds/1/blockcontents", 2), ("/api/longreads", 1), ("/api/longreads/1", 1),
+             ("/api/longreads/1/full", 1), ("/api/longreads/1/chapters", 2), ("/api/longreads/1/blockcontents", 2),
+             ("/api/chapters/1", 1), ("/api/chapters/1/blockcontents", 2), ("/api/blockcontents/1", 1),
+             ("/api/worldobjs/1", 1)]
+
+
+@pytest.mark.parametrize("path, statements", API_PATHS)
+def test_a_matching_etag_gets_304_without_the_body_queries(client, fixture, path, statements):
+    response = client.get(path)
+    assert response.status_code == 200
+    etag = response.headers["ETag"]
+    assert not etag.startswith("W/")
+    assert response.headers["Cache-Control"] == "public, max-age=0, must-revalidate"
+
+    with db_service.assert_max_queries(statements):
+        again = client.get(path, headers={"If-None-Match": etag})
+    assert (again.status_code, again.get_data(), again.headers["ETag"]) == (304, b"", etag)
+    assert client.get(path, headers={"If-None-Match": '"other"'}).status_code == 200
+    assert client.get(path, headers={"If-None-Match": '"other", ' + etag}).status_code == 304
+
+
+def etags(client):
+    return {path: client.get(path).headers.get("ETag") for path, _ in API_PATHS}
+
+
+def test_writes_change_exactly_the_etags_they_affect(client, fixture):
+    blockcontent_id = next(blockcontent_id for blockcontent_id, _, chapter_id in fixture["blockcontents"]
+                           if chapter_id == 1)
+    before = etags(client)
+    assert client.post("/longread/chapter/blockcontent/edit", json={"blockcontent_id": blockcontent_id,
+                                                                    "text": "edited"}).status_code == 200
+    after = etags(client)
+    changed = {path for path in before if before[path] != after[path]}
+    expected = {"/api/worlds/1/blockcontents", "/api/longreads/1/full", "/api/longreads/1/blockcontents",
+                "/api/chapters/1/blockcontents"}
+    if blockcontent_id == 1:
+        expected.add("/api/blockcontents/1")
+    assert changed == expected
+
+    assert client.post("/world/longread/delete", json={"longread_id": 2}).status_code == 200
+    deleted = etags(client)
+    assert deleted["/api/worlds/1/longreads"] != after["/api/worlds/1/longreads"]
+    assert deleted["/api/longreads"] != after["/api/longreads"]
+    assert deleted["/api/worlds/1"] == after["/api/worlds/1"]
+
+
+def test_pages_have_their_own_etags(client, fixture):
+    first = client.get("/api/longreads", query_string={"limit": 1})
+    second = client.get("/api/longreads", query_string={"limit": 1, "cursor": first.get_json()["next_cursor"]})
+    assert first.headers["ETag"] != second.headers["ETag"]
+    assert first.get_json()["items"] != second.get_json()["items"]
+
+
+def test_a_compressed_body_has_a_weak_etag_that_still_matches(app, client, fixture):
+    app.config["COMPRESSION_MIN_SIZE"] = 0
+    plain = client.get("/api/worlds/1/blockcontents")
+    compressed = client.get("/api/worlds/1/blockcontents", headers={"Accept-Encoding": "gzip"})
+    assert compressed.headers["Content-Encoding"] == "gzip"
+    assert compressed.headers["ETag"] == "W/" + plain.headers["ETag"]
+    revalidated = client.get("/api/worlds/1/blockcontents",
+                             headers={"Accept-Encoding": "gzip", "If-None-Match": compressed.headers["ETag"]})
+    assert revalidated.status_code == 304
+
+
+@pytest.mark.parametrize("path", ["/api/worlds/99", "/api/worlds/99/longreads", "/api/longreads/99/full",
+                                  "/api/chapters/999/blockcontents", "/api/blockcontents/9999"])
+def test_missing_rows_are_404(client, fixture, path):
+    assert client.get(path).status_code == 404
+
+
+def test_bad_page_arguments_are_400(client, fixture):
+    for query in ({"limit": 0}, {"limit": "x"}, {"cursor": "nope"}):
+        assert client.get("/api/longreads", query_string=query).status_code == 400
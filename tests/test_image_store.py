@@ -0,0 +1,111 @@
+import os
+import time
+
+from db_service import World, WorldObj, db, image_blob, image_ref, select, update
+from test_uploads import fresh_image_pool, png, run_jobs, stored, upload  # noqa: F401 (autouse fixture)
+
+
+def blobs(app):
+    with app.app_context():
+        return {link: released_at for link, released_at in db.session.execute(
+            select(image_blob.c.link, image_blob.c.released_at))}
+
+
+def refs(app, link):
+    with app.app_context():
+        return sorted(db.session.execute(select(image_ref.c.entity, image_ref.c.entity_id, image_ref.c.slot)
+                                         .where(image_ref.c.link == link)).all())
+
+
+def image_files():
+    folder = os.path.join("staticFiles", "images")
+    return sorted(name for name in os.listdir(folder) if os.path.isfile(os.path.join(folder, name)))
+
+
+def gc(app, grace=0):
+    result = app.test_cli_runner().invoke(args=["gc-images", "--grace", str(grace)])
+    assert result.exit_code == 0, result.output
+    return result.output
+
+
+def age_released(app, seconds):
+    # as if the blobs had been released seconds ago, files included
+    with app.app_context():
+        db.session.execute(update(image_blob).where(image_blob.c.released_at.is_not(None))
+                           .values(released_at=image_blob.c.released_at - seconds))
+        db.session.commit()
+    past = time.time() - seconds
+    for name in image_files():
+        os.utime(os.path.join("staticFiles", "images", name), (past, past))
+
+
+def test_identical_uploads_share_one_file(app, client, fixture):
+    data = png(16, 16)
+    for path in ("/world/1/edit_image", "/world/2/edit_image", "/world/worldobj/1/edit_image"):
+        assert upload(client, path, data).status_code == 202
+    run_jobs(app)
+    link = stored(app, World, 1)[0]
+    assert stored(app, World, 2)[0] == link == stored(app, WorldObj, 1)[0]
+    assert refs(app, link) == [("World", 1, "img"), ("World", 2, "img"), ("WorldObj", 1, "img")]
+    assert len(set(image_files())) == len(set(stored(app, World, 1)[1].values()))
+    assert blobs(app)[link] is None
+
+
+def test_a_blob_is_released_when_its_last_reference_goes(app, client, fixture):
+    data = png(16, 16)
+    for path in ("/world/1/edit_image", "/world/2/edit_image"):
+        assert upload(client, path, data).status_code == 202
+    run_jobs(app)
+    link = stored(app, World, 1)[0]
+
+    assert upload(client, "/world/1/edit_image", png(16, 16, seed=1)).status_code == 202
+    run_jobs(app)
+    assert blobs(app)[link] is None
+    assert client.post("/world/delete", json={"world_id": 2}).status_code == 200
+    assert blobs(app)[link] is not None
+    assert os.path.exists(link[1:])
+
+
+def test_gc_removes_only_blobs_released_for_the_grace_period(app, client, fixture):
+    assert upload(client, "/world/1/edit_image", png(16, 16)).status_code == 202
+    run_jobs(app)
+    old_link = stored(app, World, 1)[0]
+    assert upload(client, "/world/1/edit_image", png(16, 16, seed=1)).status_code == 202
+    run_jobs(app)
+    new_link = stored(app, World, 1)[0]
+
+    gc(app, grace=3600)
+    assert os.path.exists(old_link[1:])
+    age_released(app, 7200)
+    gc(app, grace=3600)
+    assert not os.path.exists(old_link[1:]) and old_link not in blobs(app)
+    assert os.path.exists(new_link[1:]) and new_link in blobs(app)
+
+
+def test_a_released_blob_that_is_uploaded_again_is_kept(app, client, fixture):
+    data = png(16, 16)
+    assert upload(client, "/world/1/edit_image", data).status_code == 202
+    run_jobs(app)
+    link = stored(app, World, 1)[0]
+    assert client.post("/world/delete", json={"world_id": 1}).status_code == 200
+    age_released(app, 7200)
+
+    assert upload(client, "/world/2/edit_image", data).status_code == 202
+    run_jobs(app)
+    assert stored(app, World, 2)[0] == link and blobs(app)[link] is None
+    gc(app, grace=3600)
+    assert os.path.exists(link[1:])
+
+
+def test_gc_removes_orphans_and_leftovers_but_not_other_files(app, client, fixture):
+    folder = os.path.join("staticFiles", "images")
+    names = ["0123456789abcdef0123456789abcdef.jpg", "leftover.upload", "leftover.part", "world_base.jpg",
+             "notes.txt"]
+    for name in names:
+        with open(os.path.join(folder, name), "wb") as file:
+            file.write(b"x")
+    gc(app, grace=3600)
+    assert image_files() == sorted(names)
+    age_released(app, 7200)
+    gc(app, grace=3600)
+    assert image_files() == ["notes.txt", "world_base.jpg"]
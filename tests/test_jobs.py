@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+
+import db_service
+from db_service import JobFailed, World, claim_job, db, enqueue_job, job_outbox, select, update
+from test_uploads import fresh_image_pool, png, run_jobs, spooled_files, stored, upload  # noqa: F401 (autouse fixture)
+
+
+def jobs(app):
+    with app.app_context():
+        return db.session.execute(select(job_outbox).order_by(job_outbox.c.id)).all()
+
+
+def queue(app, kind, **payload):
+    with app.app_context():
+        enqueue_job(kind, payload)
+        db.session.commit()
+
+
+def make_due(app):
+    with app.app_context():
+        db.session.execute(update(job_outbox).where(job_outbox.c.failed_at.is_(None)).values(run_after=0))
+        db.session.commit()
+
+
+def test_a_job_commits_with_the_change_that_needs_it(app, client, fixture):
+    blockcontent_id = fixture["blockcontents"][0][0]
+    response = client.post("/longread/chapter/blockcontent/batch", json={
+        "edit": [{"blockcontent_id": blockcontent_id, "text": "edited"}], "delete": [9999]})
+    assert response.status_code == 404
+    assert jobs(app) == []
+
+    assert client.post("/longread/chapter/blockcontent/edit", json={"blockcontent_id": blockcontent_id,
+                                                                    "text": "edited"}).status_code == 200
+    assert [job.kind for job in jobs(app)] == ["search_reindex"]
+    assert client.get("/jobs/stats").get_json() == {"search_reindex": {"pending": 1, "failed": 0}}
+    assert run_jobs(app) == 1
+    assert jobs(app) == [] and client.get("/jobs/stats").get_json() == {}
+
+
+def test_failures_are_retried_with_backoff(app, client, monkeypatch):
+    calls = []
+
+    def flaky(number):
+        calls.append(number)
+        raise RuntimeError("disk on fire")
+
+    monkeypatch.setitem(db_service.JOB_HANDLERS, "flaky", flaky)
+    app.config.update(JOB_MAX_ATTEMPTS=3, JOB_RETRY_DELAY=10)
+    queue(app, "flaky", number=7)
+    for attempt in (1, 2):
+        started = time.time()
+        assert run_jobs(app) == 1
+        job, = jobs(app)
+        assert (job.attempts, job.failed_at, "disk on fire" in job.last_error) == (attempt, None, True)
+        assert started + 10 * 2 ** (attempt - 1) <= job.run_after <= time.time() + 10 * 2 ** (attempt - 1)
+        assert run_jobs(app) == 0
+        make_due(app)
+
+    assert run_jobs(app) == 1
+    job, = jobs(app)
+    assert job.attempts == 3 and job.failed_at is not None
+    assert calls == [7, 7, 7]
+    make_due(app)
+    assert run_jobs(app) == 0
+    assert client.get("/jobs/stats").get_json() == {"flaky": {"pending": 0, "failed": 1}}
+
+
+def test_a_job_that_cannot_succeed_fails_at_once(app, monkeypatch):
+    def hopeless():
+        raise JobFailed("bad input")
+
+    monkeypatch.setitem(db_service.JOB_HANDLERS, "hopeless", hopeless)
+    queue(app, "hopeless")
+    assert run_jobs(app) == 1
+    job, = jobs(app)
+    assert job.attempts == 1 and job.failed_at is not None
+
+
+def test_a_job_whose_worker_died_is_claimed_again_after_its_lease(app, monkeypatch):
+    monkeypatch.setitem(db_service.JOB_HANDLERS, "noop", lambda: None)
+    queue(app, "noop")
+    with app.app_context():
+        claimed = claim_job()
+        assert claim_job() is None
+    make_due(app)
+    with app.app_context():
+        again = claim_job()
+    assert (again.id, again.attempts) == (claimed.id, 2)
+
+
+def test_a_newer_upload_for_the_same_slot_wins(app, client, fixture):
+    first, second = png(16, 16), png(16, 16, seed=1)
+    assert upload(client, "/world/1/edit_image", first).status_code == 202
+    assert upload(client, "/world/1/edit_image", second).status_code == 202
+    assert len(spooled_files()) == 2
+    assert run_jobs(app) == 2
+    assert spooled_files() == []
+    link, _ = stored(app, World, 1)
+    if db_service.Image is None:
+        with open(link[1:], "rb") as full:
+            assert full.read() == second
+    assert len([name for name in os.listdir(os.path.join("staticFiles", "images"))
+                if name.endswith(".png") or name.endswith(".jpg")]) == len(set(stored(app, World, 1)[1].values()))
+
+
+def test_workers_run_jobs_after_the_commit(app, client, fixture, monkeypatch):
+    done = threading.Event()
+    monkeypatch.setitem(db_service.JOB_HANDLERS, "signal", lambda: done.set())
+    # only the commit of a transaction that queued jobs wakes the worker
+    app.config.update(JOB_WORKERS=1, JOB_POLL_INTERVAL=3600)
+    assert client.get("/jobs/stats").status_code == 200
+    queue(app, "signal")
+    assert done.wait(10)
+    for _ in range(100):
+        if not jobs(app):
+            break
+        time.sleep(0.05)
+    assert jobs(app) == []
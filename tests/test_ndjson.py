@@ -0,0 +1,45 @@
+import json
+
+import pytest
+
+from test_pagination import LISTINGS, expected_ids
+
+NDJSON = {"Accept": "application/x-ndjson"}
+
+
+def ndjson_items(response):
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    body = response.get_data(as_text=True)
+    assert body == "" or body.endswith("\n")
+    return [json.loads(line) for line in body.splitlines()]
+
+
+@pytest.mark.parametrize("path, body, model, criteria", LISTINGS)
+def test_stream_holds_every_row_after_the_cursor(app, client, fixture, path, body, model, criteria):
+    ids = expected_ids(app, model, criteria)
+    response = client.post(path, json={**body, "limit": 1}, headers=NDJSON)
+    assert response.is_streamed
+    items = ndjson_items(response)
+    assert items == client.post(path, json={**body, "limit": 1000}).get_json()["items"]
+    assert [item["id"] for item in items] == ids
+
+    cursor = client.post(path, json={**body, "limit": 1}).get_json()["next_cursor"]
+    rest = ndjson_items(client.post(path, json={**body, "cursor": cursor}, headers=NDJSON))
+    assert [item["id"] for item in rest] == ids[1:]
+
+
+def test_json_is_still_the_default(client, fixture):
+    for accept in (None, "application/json", "application/json, application/x-ndjson;q=0.5", "*/*"):
+        response = client.post("/longread/blockcontent/all", json={"longread_id": 1},
+                               headers={"Accept": accept} if accept else {})
+        assert response.mimetype == "application/json"
+        assert "items" in response.get_json()
+
+
+def test_an_empty_listing_streams_nothing(client, fixture):
+    assert client.post("/world/longread/create", json={"world_id": 1, "name": "empty",
+                                                       "description": "d"}).status_code == 201
+    longread_id = client.post("/longreads/all", json={}).get_json()["items"][-1]["id"]
+    assert ndjson_items(client.post("/longread/blockcontent/all", json={"longread_id": longread_id},
+                                    headers=NDJSON)) == []
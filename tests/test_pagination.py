@@ -0,0 +1,62 @@
+import pytest
+
+from db_service import BlockContent, Chapter, LongRead, World, WorldObj, db, select
+
+# endpoint, body, model and criteria of the rows it lists
+LISTINGS = [
+    ("/worlds/all", {}, World, lambda: []),
+    ("/longreads/all", {}, LongRead, lambda: []),
+    ("/world/longread/all", {"world_id": 1}, LongRead, lambda: [LongRead.world_id == 1]),
+    ("/world/worldobj/all", {"world_id": 2}, WorldObj, lambda: [WorldObj.world_id == 2]),
+    ("/longread/chapter/all", {"longread_id": 2}, Chapter, lambda: [Chapter.longread_id == 2]),
+    ("/longread/blockcontent/all", {"longread_id": 3}, BlockContent, lambda: [BlockContent.longread_id == 3]),
+    ("/longread/chapter/blockcontent/all", {"chapter_id": 4}, BlockContent, lambda: [BlockContent.chapter_id == 4]),
+    ("/world/blockcontent/all", {"world_id": 1}, BlockContent,
+     lambda: [BlockContent.longread_id.in_(select(LongRead.id).where(LongRead.world_id == 1))]),
+]
+
+
+def expected_ids(app, model, criteria):
+    with app.app_context():
+        return db.session.execute(select(model.id).where(*criteria()).order_by(model.id)).scalars().all()
+
+
+def pages(client, path, body, limit):
+    items, cursor, sizes = [], None, []
+    while True:
+        response = client.post(path, json={**body, "limit": limit, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200, response.get_data(as_text=True)
+        page = response.get_json()
+        items += page["items"]
+        sizes.append(len(page["items"]))
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return items, sizes
+
+
+@pytest.mark.parametrize("path, body, model, criteria", LISTINGS)
+def test_pages_walk_every_row_once_in_id_order(app, client, fixture, path, body, model, criteria):
+    ids = expected_ids(app, model, criteria)
+    assert len(ids) > 1
+    for limit in (1, 2, len(ids) - 1, len(ids), 1000):
+        items, sizes = pages(client, path, body, limit)
+        assert [item["id"] for item in items] == ids
+        assert all(size == limit for size in sizes[:-1]) and 0 < sizes[-1] <= limit
+    whole = client.post(path, json=body).get_json()
+    assert [item["id"] for item in whole["items"]] == ids and whole["next_cursor"] is None
+
+
+@pytest.mark.parametrize("path, body, model, criteria", LISTINGS)
+@pytest.mark.parametrize("bad", [{"limit": 0}, {"limit": 1001}, {"limit": "many"}, {"cursor": "not a cursor"}])
+def test_bad_page_arguments_are_rejected(client, fixture, path, body, model, criteria, bad):
+    response = client.post(path, json={**body, **bad})
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Invalid pagination parameters."}
+
+
+def test_a_cursor_skips_rows_created_before_it(client, fixture):
+    first = client.post("/world/longread/all", json={"world_id": 1, "limit": 1}).get_json()
+    assert client.post("/world/longread/create", json={"world_id": 1, "name": "new", "description": "d"}).status_code == 201
+    rest = client.post("/world/longread/all", json={"world_id": 1, "cursor": first["next_cursor"]}).get_json()
+    ids = [item["id"] for item in first["items"] + rest["items"]]
+    assert ids == sorted(ids) and len(ids) == 3
@@ -0,0 +1,115 @@
+import pytest
+from sqlalchemy import insert
+
+from db_service import assert_max_queries, blockcontents, db
+
+# name -> (method, path, json body) for the ids of the big or the small case; the big world, longread
+# and chapter hold hundreds more rows than the small ones, and both must stay within LIMITS
+READS = {
+    "chapter blockcontents": lambda ids: ("POST", "/longread/chapter/blockcontent/all",
+                                          {"chapter_id": ids["chapter"], "limit": 1000}),
+    "api chapter blockcontents": lambda ids: ("GET", f"/api/chapters/{ids['chapter']}/blockcontents?limit=1000",
+                                              None),
+    "longread blockcontents": lambda ids: ("POST", "/longread/blockcontent/all",
+                                           {"longread_id": ids["longread"], "limit": 1000}),
+    "longread chapters": lambda ids: ("POST", "/longread/chapter/all", {"longread_id": ids["longread"]}),
+    "longread full": lambda ids: ("POST", "/world/longread/full",
+                                  {"longread_id": ids["longread"], "with_worldobjs": True}),
+    "api longread full": lambda ids: ("GET", f"/api/longreads/{ids['longread']}/full?with_worldobjs=1", None),
+    "world longreads": lambda ids: ("POST", "/world/longread/all", {"world_id": ids["world"]}),
+    "world worldobjs": lambda ids: ("POST", "/world/worldobj/all", {"world_id": ids["world"]}),
+    "entities": lambda ids: ("POST", "/entities", {"blockcontent": ids["blockcontents"],
+                                                  "chapter": ids["chapters"], "longread": [ids["longread"]]}),
+}
+LIMITS = {
+    "chapter blockcontents": 2,
+    "api chapter blockcontents": 3,
+    "longread blockcontents": 2,
+    "longread chapters": 2,
+    "longread full": 4,
+    "api longread full": 5,
+    "world longreads": 2,
+    "world worldobjs": 2,
+    "entities": 3,
+}
+# a fixed number of statements plus some per longread of the world (chapters and blocks are read
+# down each longread's index)
+PER_LONGREAD_READS = {
+    "world blockcontents": (lambda ids: ("POST", "/world/blockcontent/all", {"world_id": ids["world"], "limit": 1000}),
+                            2, 1),
+    "api world blockcontents": (lambda ids: ("GET", f"/api/worlds/{ids['world']}/blockcontents?limit=1000", None),
+                                1, 1),
+    "world changes": (lambda ids: ("POST", "/world/changes", {"world_id": ids["world"], "limit": 1000}), 7, 2),
+}
+
+
+def statement_count(client, request, limit):
+    method, path, body = request
+    with assert_max_queries(limit) as recorded:
+        response = client.open(path, method=method, json=body)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return len(recorded)
+
+
+@pytest.fixture
+def sizes(app, client, fixture):
+    # grows the first longread of world 1 through the API; world 2 keeps the generated size
+    big_longread = fixture["longreads"][0][0]
+    small_longread = next(longread_id for longread_id, world_id in fixture["longreads"] if world_id == 2)
+    big_chapter = next(chapter_id for chapter_id, longread_id in fixture["chapters"] if longread_id == big_longread)
+    small_chapter = next(chapter_id for chapter_id, longread_id in fixture["chapters"]
+                         if longread_id == small_longread)
+    for number in range(20):
+        assert client.post("/longread/chapter/create",
+                           json={"longread_id": big_longread, "name": f"more {number}"}).status_code == 201
+    response = client.post("/longread/chapter/blockcontent/batch", json={"create": [
+        {"longread_id": big_longread, "chapter_id": big_chapter, "text": f"block {number}"} for number in range(400)]})
+    created_ids = response.get_json()["created_ids"]
+    worldobj_ids = [worldobj_id for worldobj_id, world_id in fixture["worldobjs"] if world_id == 1]
+    with app.app_context():
+        db.session.execute(insert(blockcontents), [{"blockcontent_id": blockcontent_id, "worldobj_id": worldobj_id}
+                                                   for blockcontent_id in created_ids for worldobj_id in worldobj_ids])
+        db.session.commit()
+    big = {"world": 1, "longread": big_longread, "chapter": big_chapter, "blockcontents": created_ids,
+           "chapters": list(range(1, 25))}
+    small = {"world": 2, "longread": small_longread, "chapter": small_chapter,
+             "blockcontents": [created_ids[0]], "chapters": [1]}
+    return big, small
+
+
+@pytest.mark.parametrize("name", sorted(READS))
+def test_read_statements_do_not_grow_with_rows(client, sizes, name):
+    big, small = sizes
+    assert statement_count(client, READS[name](big), LIMITS[name]) == \
+        statement_count(client, READS[name](small), LIMITS[name])
+
+
+@pytest.mark.parametrize("name", sorted(PER_LONGREAD_READS))
+def test_world_reads_run_per_longread_not_per_row(client, fixture, sizes, name):
+    big, small = sizes
+    request, fixed, per_longread = PER_LONGREAD_READS[name]
+    longreads = sum(1 for _, world_id in fixture["longreads"] if world_id == 1)
+    limit = fixed + per_longread * longreads
+    assert statement_count(client, request(big), limit) == statement_count(client, request(small), limit)
+
+
+def test_batch_statements_do_not_grow_with_items(client, fixture):
+    # every item stays in one longread: the timeline buckets are refreshed per longread
+    longread_id, chapter_id = fixture["longreads"][0][0], fixture["chapters"][0][0]
+    created_ids = client.post("/longread/chapter/blockcontent/batch", json={"create": [
+        {"longread_id": longread_id, "chapter_id": chapter_id, "text": "block"} for _ in range(300)]}
+    ).get_json()["created_ids"]
+
+    def batch(creates, edits, deletes):
+        return ("POST", "/longread/chapter/blockcontent/batch", {
+            "create": [{"longread_id": longread_id, "chapter_id": chapter_id, "text": "new"}] * creates,
+            "edit": [{"blockcontent_id": blockcontent_id, "text": "edited", "time": 50 * number,
+                      "coordx": 1, "coordy": 2, "floating_text": "event"}
+                     for number, blockcontent_id in enumerate(edits)],
+            "delete": deletes})
+
+    # most of these keep the side tables in step: images, tombstones, search, events and the
+    # two statements per bucket width of the timeline
+    small = statement_count(client, batch(1, created_ids[:1], created_ids[1:2]), 58)
+    big = statement_count(client, batch(200, created_ids[2:150], created_ids[150:]), 58)
+    assert big == small
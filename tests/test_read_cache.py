@@ -0,0 +1,124 @@
+import time
+
+import pytest
+
+import db_service
+
+
+@pytest.fixture
+def cached_app(app):
+    # a second app on the same database with the read cache on; the writes go through it, so
+    # its own cache is the one they invalidate
+    cached_app = db_service.create_app({"SQLALCHEMY_DATABASE_URI": app.config["SQLALCHEMY_DATABASE_URI"],
+                                        "JOB_WORKERS": 0, "READ_CACHE_TTL": None})
+    yield cached_app
+    with cached_app.app_context():
+        for engine in db_service.db.engines.values():
+            engine.dispose()
+
+
+def reads(fixture):
+    chapter_id = next(chapter_id for chapter_id, longread_id in fixture["chapters"] if longread_id == 1)
+    blockcontent_id = next(blockcontent_id for blockcontent_id, _, chapter in fixture["blockcontents"]
+                           if chapter == chapter_id)
+    worldobj_id = next(worldobj_id for worldobj_id, world_id in fixture["worldobjs"] if world_id == 1)
+    return [("/worlds/all", {}), ("/world", {"world_id": 1}), ("/world/longread/all", {"world_id": 1}),
+            ("/world/worldobj/all", {"world_id": 1}), ("/world/worldobj", {"worldobj_id": worldobj_id}),
+            ("/world/blockcontent/all", {"world_id": 1}), ("/longreads/all", {}),
+            ("/world/longread", {"longread_id": 1}), ("/world/longread/full", {"longread_id": 1}),
+            ("/world/longread/full", {"longread_id": 1, "with_worldobjs": True}),
+            ("/longread/chapter/all", {"longread_id": 1}), ("/longread/chapter", {"chapter_id": chapter_id}),
+            ("/longread/blockcontent/all", {"longread_id": 1}),
+            ("/longread/chapter/blockcontent/all", {"chapter_id": chapter_id}),
+            ("/longread/chapter/blockcontent", {"blockcontent_id": blockcontent_id}),
+            ("/longread/blockcontent/event", {"blockcontent_id": blockcontent_id}),
+            ("/longread/map", {"longread_id": 1}), ("/longread/timeline", {"longread_id": 1})]
+
+
+def assert_cache_is_fresh(cached, uncached, fixture):
+    # twice, so the second round is served from the cache
+    for _ in range(2):
+        for path, body in reads(fixture):
+            expected = uncached.post(path, json=body)
+            response = cached.post(path, json=body)
+            assert (response.status_code, response.get_data()) == (expected.status_code, expected.get_data()), path
+
+
+def test_every_write_invalidates_what_it_changed(cached_app, client, fixture):
+    cached = cached_app.test_client()
+    chapter_id = next(chapter_id for chapter_id, longread_id in fixture["chapters"] if longread_id == 1)
+    blocks = [blockcontent_id for blockcontent_id, _, chapter in fixture["blockcontents"] if chapter == chapter_id]
+    worldobj_ids = [worldobj_id for worldobj_id, world_id in fixture["worldobjs"] if world_id == 1]
+    writes = [
+        ("/world/edit", {"world_id": 1, "name": "renamed world", "description": "d"}),
+        ("/world/longread/edit", {"longread_id": 1, "name": "renamed longread", "description": "d"}),
+        ("/longread/chapter/edit", {"chapter_id": chapter_id, "name": "renamed chapter"}),
+        ("/longread/chapter/blockcontent/edit", {"blockcontent_id": blocks[0], "text": "edited"}),
+        ("/longread/blockcontent/event/edit", {"blockcontent_id": blocks[0], "coordx": 1, "coordy": 2, "time": 3,
+                                               "floating_text": "event"}),
+        ("/longread/blockcontent/event/delete", {"blockcontent_id": blocks[0]}),
+        ("/longread/chapter/blockcontent/create", {"longread_id": 1, "chapter_id": chapter_id, "text": "new"}),
+        ("/longread/chapter/blockcontent/batch", {"edit": [{"blockcontent_id": blocks[1], "text": "batched"}],
+                                                  "delete": [blocks[2]]}),
+        ("/world/worldobj/edit", {"worldobj_id": worldobj_ids[0], "name": "renamed object", "description": "d"}),
+        ("/world/worldobj/delete", {"worldobj_id": worldobj_ids[1]}),
+        ("/world/worldobj/create", {"world_id": 1, "name": "new object", "description": "d"}),
+        ("/longread/chapter/create", {"longread_id": 1, "name": "new chapter"}),
+        ("/world/longread/create", {"world_id": 1, "name": "new longread", "description": "d"}),
+        ("/world/longread/delete", {"longread_id": 2}),
+        ("/world/create", {"name": "new world", "description": "d"}),
+        ("/longread/chapter/blockcontent/delete", {"blockcontent_id": blocks[1]}),
+        ("/longread/chapter/delete", {"chapter_id": chapter_id}),
+        ("/world/delete", {"world_id": 1}),
+    ]
+    assert_cache_is_fresh(cached, client, fixture)
+    for path, body in writes:
+        assert cached.post(path, json=body).status_code in (200, 201), path
+        assert_cache_is_fresh(cached, client, fixture)
+    stats = cached.get("/cache/stats").get_json()
+    assert stats["hits"] > 0 and stats["invalidations"] > 0
+
+
+def test_hits_skip_the_database(cached_app, fixture):
+    cached = cached_app.test_client()
+    first = cached.post("/world/longread/full", json={"longread_id": 1})
+    with db_service.assert_max_queries(0):
+        again = cached.post("/world/longread/full", json={"longread_id": 1})
+    assert again.get_data() == first.get_data()
+    stats = cached.get("/cache/stats").get_json()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+
+def test_a_failed_write_keeps_the_entries(cached_app, fixture):
+    cached = cached_app.test_client()
+    cached.post("/world", json={"world_id": 1})
+    assert cached.post("/world/edit", json={"world_id": 1}).status_code == 400
+    assert cached.get("/cache/stats").get_json()["invalidations"] == 0
+
+
+def test_entries_are_evicted_least_recently_used_first():
+    cache = db_service.ReadCache(max_entries=2, max_bytes=10)
+    for key in "abc":
+        if key == "c":
+            assert cache.get("a") == (b"aa", None)
+        cache.set(key, ("tag", None), key.encode() * 2, cache.generation)
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == ((b"aa", None), None, (b"cc", None))
+    cache.set("d", ("tag", None), b"d" * 9, cache.generation)
+    assert cache.stats()["bytes"] <= 10 and cache.get("d") == (b"d" * 9, None)
+    assert cache.stats()["evictions"] == 3
+
+
+def test_entries_expire_after_the_ttl():
+    cache = db_service.ReadCache(max_entries=10, max_bytes=100, ttl=0.05)
+    cache.set("a", ("tag", None), b"a", cache.generation)
+    assert cache.get("a") == (b"a", None)
+    time.sleep(0.1)
+    assert cache.get("a") is None
+
+
+def test_a_response_built_across_an_invalidation_is_not_stored():
+    cache = db_service.ReadCache(max_entries=10, max_bytes=100)
+    generation = cache.generation
+    cache.invalidate({("world", 1)})
+    cache.set("a", ("world", 1), b"stale", generation)
+    assert cache.get("a") is None
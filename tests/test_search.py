@@ -0,0 +1,137 @@
+import pytest
+from sqlalchemy import delete, update
+
+from db_service import db, job_outbox, run_pending_jobs, search_index
+
+
+def run_jobs(app):
+    with app.app_context():
+        return run_pending_jobs()
+
+
+def search(client, query, **body):
+    response = client.post("/search", json={"query": query, **body})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return sorted((item["entity"], item["entity_id"]) for item in response.get_json()["items"])
+
+
+def test_cascade_delete_removes_the_documents(app, client, fixture):
+    longread_id, chapter_id = fixture["longreads"][0][0], fixture["chapters"][0][0]
+    created_ids = client.post("/longread/chapter/blockcontent/batch", json={"create": [
+        {"longread_id": longread_id, "chapter_id": chapter_id, "text": "zephyrine"}] * 3}).get_json()["created_ids"]
+    assert client.post("/world/longread/edit", json={"longread_id": longread_id, "name": "zephyrine",
+                                                     "description": "d"}).status_code == 200
+    run_jobs(app)
+    assert search(client, "zephyrine") == [("blockcontent", blockcontent_id) for blockcontent_id in created_ids] + [
+        ("longread", longread_id)]
+
+    assert client.post("/world/delete", json={"world_id": 1}).status_code == 200
+    run_jobs(app)
+    assert search(client, "zephyrine") == []
+    assert search(client, "zephyrine", world_id=1) == []
+
+
+def test_removal_keeps_the_document_of_a_reused_id(app, client, fixture):
+    # the largest id is deleted and handed out again; the new row's reindex job runs before
+    # the removal job of the delete
+    longread_id, chapter_id = fixture["longreads"][0][0], fixture["chapters"][0][0]
+    last_id = client.post("/longread/chapter/blockcontent/batch", json={"create": [
+        {"longread_id": longread_id, "chapter_id": chapter_id, "text": "zephyrine"}]}).get_json()["created_ids"][0]
+    run_jobs(app)
+    assert client.post("/longread/chapter/blockcontent/delete", json={"blockcontent_id": last_id}).status_code == 200
+    reused_id = client.post("/longread/chapter/blockcontent/batch", json={"create": [
+        {"longread_id": longread_id, "chapter_id": chapter_id, "text": "quillon"}]}).get_json()["created_ids"][0]
+    assert reused_id == last_id
+
+    with app.app_context():
+        db.session.execute(update(job_outbox).where(job_outbox.c.kind == "search_remove_deleted")
+                           .values(run_after=job_outbox.c.run_after + 3600))
+        db.session.commit()
+    assert run_jobs(app) == 1
+    with app.app_context():
+        db.session.execute(update(job_outbox).values(run_after=0))
+        db.session.commit()
+    assert run_jobs(app) == 1
+
+    assert search(client, "quillon") == [("blockcontent", reused_id)]
+    assert search(client, "zephyrine") == []
+
+
+def test_edits_are_reindexed(app, client, fixture):
+    longread_id, world_id = fixture["longreads"][0]
+    blockcontent_id = fixture["blockcontents"][0][0]
+    worldobj_id = next(worldobj_id for worldobj_id, world in fixture["worldobjs"] if world == world_id)
+    writes = [("/world/edit", {"world_id": world_id, "name": "w", "description": "zephyrine valley"}),
+              ("/world/longread/edit", {"longread_id": longread_id, "name": "zephyrine", "description": "d"}),
+              ("/world/worldobj/edit", {"worldobj_id": worldobj_id, "name": "zephyrine", "description": "d"}),
+              ("/longread/chapter/blockcontent/edit", {"blockcontent_id": blockcontent_id, "text": "zephyrine"})]
+    for path, body in writes:
+        assert client.post(path, json=body).status_code == 200
+    run_jobs(app)
+    assert search(client, "zephyrine") == sorted([("world", world_id), ("longread", longread_id),
+                                                  ("worldobj", worldobj_id), ("blockcontent", blockcontent_id)])
+
+    assert client.post("/longread/chapter/blockcontent/edit", json={"blockcontent_id": blockcontent_id,
+                                                                    "text": "plain"}).status_code == 200
+    assert client.post("/longread/blockcontent/event/edit", json={
+        "blockcontent_id": blockcontent_id, "coordx": 1, "coordy": 1, "time": 1,
+        "floating_text": "quillon"}).status_code == 200
+    run_jobs(app)
+    assert ("blockcontent", blockcontent_id) not in search(client, "zephyrine")
+    assert search(client, "quillon") == [("blockcontent", blockcontent_id)]
+
+
+def test_results_are_scoped_and_filtered(app, client, fixture):
+    (first, world_id), (second, _), (other, other_world) = fixture["longreads"][:3]
+    for longread_id in (first, second, other):
+        assert client.post("/world/longread/edit", json={"longread_id": longread_id, "name": "zephyrine",
+                                                         "description": "d"}).status_code == 200
+    chapter_id = next(chapter_id for chapter_id, longread_id in fixture["chapters"] if longread_id == first)
+    created_ids = client.post("/longread/chapter/blockcontent/batch", json={"create": [
+        {"longread_id": first, "chapter_id": chapter_id, "text": "zephyrine"}]}).get_json()["created_ids"]
+    run_jobs(app)
+    assert search(client, "zephyrine", world_id=other_world) == [("longread", other)]
+    assert search(client, "zephyrine", longread_id=first) == [("blockcontent", created_ids[0]), ("longread", first)]
+    assert search(client, "zephyrine", world_id=world_id, entities=["longread"]) == [("longread", first),
+                                                                                     ("longread", second)]
+    response = client.post("/search", json={"query": "zephyrine", "limit": 2})
+    assert response.get_json()["next_offset"] == 2
+    rest = client.post("/search", json={"query": "zephyrine", "limit": 2, "offset": 2}).get_json()
+    assert (len(rest["items"]), rest["next_offset"]) == (2, None)
+
+
+def test_title_matches_rank_first_and_snippets_mark_the_match(app, client, fixture):
+    (first, _), (second, _) = fixture["longreads"][:2]
+    assert client.post("/world/longread/edit", json={"longread_id": first, "name": "n",
+                                                     "description": "a long text about Zéphyrine"}).status_code == 200
+    assert client.post("/world/longread/edit", json={"longread_id": second, "name": "Zéphyrine",
+                                                     "description": "d"}).status_code == 200
+    run_jobs(app)
+    items = client.post("/search", json={"query": "ZEPHYRINE"}).get_json()["items"]
+    assert [item["entity_id"] for item in items] == [second, first]
+    assert "<b>Zéphyrine</b>" in items[1]["snippet"]
+
+
+@pytest.mark.parametrize("body", [{}, {"query": ""}, {"query": "a", "limit": 0}, {"query": "a", "offset": -1},
+                                  {"query": "a", "entities": ["chapter"]}, {"query": "a", "entities": "world"},
+                                  {"query": "a", "world_id": "one"}])
+def test_bad_searches_are_rejected(client, fixture, body):
+    assert client.post("/search", json=body).status_code == 400
+
+
+def test_fts_syntax_is_searched_as_words(client, fixture):
+    for query in ('zephyrine OR "', "NEAR(a b)", "*", "a AND", '"'):
+        assert client.post("/search", json={"query": query}).status_code == 200
+
+
+def test_rebuild_restores_the_index(app, client, fixture):
+    assert client.post("/world/longread/edit", json={"longread_id": 1, "name": "zephyrine",
+                                                     "description": "d"}).status_code == 200
+    run_jobs(app)
+    with app.app_context():
+        db.session.execute(delete(search_index))
+        db.session.commit()
+    assert search(client, "zephyrine") == []
+    result = app.test_cli_runner().invoke(args=["search-rebuild"])
+    assert result.exit_code == 0, result.output
+    assert search(client, "zephyrine") == [("longread", 1)]
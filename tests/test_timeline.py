@@ -0,0 +1,141 @@
+import json
+
+import pytest
+from sqlalchemy import text
+
+from db_service import EVENT_TIME_MAX, EVENT_TIME_MIN, TIMELINE_BUCKET_WIDTHS, db, migrate_add_timeline_buckets
+
+
+def timeline(client, width, **body):
+    response = client.post("/longread/blockcontent/event/timeline", json={"width": width, **body})
+    assert response.status_code == 200
+    return response.get_json()["buckets"]
+
+
+def expected_timeline(client, longread_ids, width):
+    # the buckets recomputed from the events themselves
+    items = []
+    for longread_id in longread_ids:
+        items += client.post("/longread/blockcontent/all",
+                             json={"longread_id": longread_id, "limit": 1000}).get_json()["items"]
+    buckets = {}
+    for item in sorted(items, key=lambda item: (item["time"] is None, item["time"], item["id"])):
+        if item["time"] is None:
+            continue
+        bucket = buckets.setdefault(item["time"] // width, {"start": item["time"] // width * width, "count": 0,
+                                                            "min_time": item["time"],
+                                                            "floating_text": item["floating_text"]})
+        bucket["count"] += 1
+        bucket["max_time"] = item["time"]
+    return [buckets[key] for key in sorted(buckets)]
+
+
+def assert_timeline_matches_events(client, longread_id):
+    for width in TIMELINE_BUCKET_WIDTHS:
+        assert timeline(client, width, longread_id=longread_id) == expected_timeline(client, [longread_id], width)
+
+
+def post_json(client, path, body):
+    # encoded by the json module, which also writes integers past 64 bits
+    return client.post(path, data=json.dumps(body), content_type="application/json")
+
+
+def edit_event(client, blockcontent_id, time, **fields):
+    return post_json(client, "/longread/blockcontent/event/edit", {
+        "blockcontent_id": blockcontent_id, "coordx": 1, "coordy": 1, "time": time, "floating_text": "event", **fields})
+
+
+def set_time(app, blockcontent_id, value):
+    # writes the column directly, as a database from before time validation could hold
+    with app.app_context():
+        with db.engine.begin() as connection:
+            connection.execute(text('UPDATE "BlockContent" SET time = :time WHERE id = :id'),
+                               {"time": value, "id": blockcontent_id})
+
+
+def test_buckets_follow_every_write(client, fixture):
+    blocks = [blockcontent_id for blockcontent_id, longread_id, _ in fixture["blockcontents"] if longread_id == 1]
+    assert_timeline_matches_events(client, 1)
+
+    for number, blockcontent_id in enumerate(blocks[:6]):
+        assert edit_event(client, blockcontent_id, 995 + 7 * number - 30 * (number % 2)).status_code == 200
+    assert_timeline_matches_events(client, 1)
+    assert client.post("/longread/blockcontent/event/delete", json={"blockcontent_id": blocks[0]}).status_code == 200
+    assert_timeline_matches_events(client, 1)
+    assert client.post("/longread/chapter/blockcontent/delete", json={"blockcontent_id": blocks[1]}).status_code == 200
+    assert_timeline_matches_events(client, 1)
+    assert client.post("/longread/chapter/blockcontent/batch", json={
+        "edit": [{"blockcontent_id": blocks[2], "time": -15}, {"blockcontent_id": blocks[3], "time": None}],
+        "delete": [blocks[4]]}).status_code == 200
+    assert_timeline_matches_events(client, 1)
+    chapter_id = fixture["chapters"][1][0]
+    assert client.post("/longread/chapter/delete", json={"chapter_id": chapter_id}).status_code == 200
+    assert_timeline_matches_events(client, 1)
+
+
+def without_text(buckets):
+    # the floating text of a bucket whose earliest time is shared across longreads may be either
+    return [{key: value for key, value in bucket.items() if key != "floating_text"} for bucket in buckets]
+
+
+def test_world_timeline_adds_up_its_longreads(client, fixture):
+    blocks = [blockcontent_id for blockcontent_id, _, _ in fixture["blockcontents"][::5]]
+    for number, blockcontent_id in enumerate(blocks):
+        assert edit_event(client, blockcontent_id, 40 * number - 95).status_code == 200
+    for width in TIMELINE_BUCKET_WIDTHS:
+        assert without_text(timeline(client, width, world_id=1)) == without_text(
+            expected_timeline(client, [1, 2], width))
+        # bounds select the buckets of each longread, which are then folded
+        folded = {}
+        for longread_id in (1, 2):
+            for bucket in without_text(timeline(client, width, longread_id=longread_id, time_from=-20, time_to=150)):
+                if bucket["start"] in folded:
+                    bucket = {**bucket, "count": folded[bucket["start"]]["count"] + bucket["count"],
+                              "min_time": min(folded[bucket["start"]]["min_time"], bucket["min_time"]),
+                              "max_time": max(folded[bucket["start"]]["max_time"], bucket["max_time"])}
+                folded[bucket["start"]] = bucket
+        bounded = timeline(client, width, world_id=1, time_from=-20, time_to=150)
+        assert without_text(bounded) == [folded[start] for start in sorted(folded)]
+
+
+@pytest.mark.parametrize("time", [12.5, True, "soon", [1], 1e30, 2 ** 63, -2 ** 63 - 1, EVENT_TIME_MAX + 1])
+def test_invalid_times_are_rejected(client, fixture, time):
+    blockcontent_id = fixture["blockcontents"][0][0]
+    before = client.post("/longread/blockcontent/event", json={"blockcontent_id": blockcontent_id}).get_json()
+    assert edit_event(client, blockcontent_id, time).status_code == 400
+    assert post_json(client, "/longread/chapter/blockcontent/batch", {
+        "edit": [{"blockcontent_id": blockcontent_id, "time": time}]}).status_code == 400
+    assert client.post("/longread/blockcontent/event", json={"blockcontent_id": blockcontent_id}).get_json() == before
+
+
+def test_times_at_the_ends_of_the_range_are_bucketed(client, fixture):
+    blocks = [blockcontent_id for blockcontent_id, longread_id, _ in fixture["blockcontents"] if longread_id == 1]
+    assert edit_event(client, blocks[0], EVENT_TIME_MAX).status_code == 200
+    assert edit_event(client, blocks[1], EVENT_TIME_MIN).status_code == 200
+    assert edit_event(client, blocks[2], float(2 ** 40)).status_code == 200
+    assert_timeline_matches_events(client, 1)
+    assert client.post("/longread/blockcontent/event/delete", json={"blockcontent_id": blocks[0]}).status_code == 200
+    assert_timeline_matches_events(client, 1)
+
+
+def test_migration_converts_stored_times(app, client, fixture):
+    blocks = [blockcontent_id for blockcontent_id, longread_id, _ in fixture["blockcontents"] if longread_id == 1]
+    for blockcontent_id, value in zip(blocks, ["2023-05-01 10:00:00", "not a date", 12.5, 1e30]):
+        set_time(app, blockcontent_id, value)
+    with app.app_context():
+        with db.engine.begin() as connection:
+            migrate_add_timeline_buckets(connection)
+
+    times = [client.post("/longread/blockcontent/event", json={"blockcontent_id": blockcontent_id}).get_json()["time"]
+             for blockcontent_id in blocks[:4]]
+    assert times == [1682935200, None, 12, None]
+    assert_timeline_matches_events(client, 1)
+
+
+def test_unconverted_times_do_not_break_deletes(app, client, fixture):
+    blocks = [blockcontent_id for blockcontent_id, longread_id, _ in fixture["blockcontents"] if longread_id == 1]
+    for blockcontent_id in blocks[:3]:
+        set_time(app, blockcontent_id, "2023-05-01 10:00:00")
+    assert client.post("/longread/blockcontent/event/delete", json={"blockcontent_id": blocks[0]}).status_code == 200
+    assert client.post("/longread/chapter/blockcontent/delete", json={"blockcontent_id": blocks[1]}).status_code == 200
+    assert client.post("/world/delete", json={"world_id": 1}).status_code == 200
@@ -0,0 +1,153 @@
+import io
+import os
+import struct
+import zlib
+
+import pytest
+
+import db_service
+from db_service import LongRead, World, db, job_outbox, run_pending_jobs, select
+
+UPLOAD_PATHS = ["/world/1/edit_image", "/world/longread/1/edit_image", "/longread/map/1/edit",
+                "/longread/timeline/1/edit", "/world/worldobj/1/edit_image",
+                "/longread/chapter/blockcontent/1/edit_image"]
+
+
+def png(width, height, seed=0):
+    # a valid RGB PNG, with the seed in its pixels so different seeds give different bytes
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    rows = b"".join(b"\x00" + bytes((x * 7 + y + seed) % 256 for x in range(width * 3)) for y in range(height))
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b""))
+
+
+def upload(client, path, data, filename="image.png"):
+    return client.post(path, data={"uploaded-file": (io.BytesIO(data), filename)},
+                       content_type="multipart/form-data")
+
+
+def run_jobs(app):
+    with app.app_context():
+        return run_pending_jobs()
+
+
+def stored(app, model, ident, slot="img"):
+    with app.app_context():
+        row = db.session.execute(select(getattr(model, slot + "_link"), getattr(model, slot + "_variants"))
+                                 .where(model.id == ident)).one()
+    return row[0], row[1]
+
+
+def spooled_files():
+    return [name for name in os.listdir(os.path.join("staticFiles", "images")) if name.endswith(".upload")]
+
+
+@pytest.fixture(autouse=True)
+def fresh_image_pool():
+    # the workers resolve UPLOAD_FOLDER against the directory they were started in, which is a
+    # different temporary directory in every test
+    yield
+    if db_service.image_workers is not None:
+        db_service.image_workers.shutdown()
+        db_service.image_workers = None
+
+
+@pytest.mark.parametrize("path", UPLOAD_PATHS)
+def test_uploads_are_answered_before_they_are_processed(app, client, fixture, path):
+    response = upload(client, path, png(8, 8))
+    assert response.status_code == 202
+    assert response.get_json()["status"] == "processing"
+    assert spooled_files()
+    with app.app_context():
+        jobs = db.session.execute(select(job_outbox.c.kind, job_outbox.c.target)).all()
+    assert [kind for kind, _ in jobs if kind == "image_upload"] == ["image_upload"]
+
+    assert run_jobs(app) >= 1
+    assert spooled_files() == []
+
+
+def test_variants_get_content_hash_names(app, client, fixture):
+    link_before, _ = stored(app, World, 1)
+    assert upload(client, "/world/1/edit_image", png(300, 200)).status_code == 202
+    assert stored(app, World, 1)[0] == link_before
+    run_jobs(app)
+
+    link, variants = stored(app, World, 1)
+    assert set(variants) == {"thumb", "medium", "full"} and variants["full"] == link
+    for variant in variants.values():
+        name = os.path.basename(variant)
+        assert len(name.split(".")[0]) == 32 and os.path.exists(variant[1:])
+    assert client.post("/world", json={"world_id": 1}).get_json()["img_variants"] == variants
+
+
+def test_pillow_resizes_the_variants(app, client, fixture):
+    Image = pytest.importorskip("PIL.Image")
+    assert upload(client, "/world/1/edit_image", png(3000, 1500)).status_code == 202
+    run_jobs(app)
+    _, variants = stored(app, World, 1)
+    sizes = {variant: Image.open(link[1:]).size for variant, link in variants.items()}
+    assert sizes == {"thumb": (128, 64), "medium": (1024, 512), "full": (2560, 1280)}
+
+
+def test_maps_keep_their_resolution(app, client, fixture):
+    data = png(40, 30)
+    assert upload(client, "/longread/map/1/edit", data).status_code == 202
+    run_jobs(app)
+    link, variants = stored(app, LongRead, 1, "map")
+    assert set(variants) == {"thumb", "medium", "full"} and variants["full"] == link
+    if db_service.Image is None:
+        with open(link[1:], "rb") as full:
+            assert full.read() == data
+    else:
+        assert db_service.Image.open(link[1:]).size == (40, 30)
+
+
+def test_maps_are_cut_into_tiles(app, client, fixture):
+    pytest.importorskip("PIL")
+    assert upload(client, "/longread/map/1/edit", png(600, 300)).status_code == 202
+    assert run_jobs(app) == 2
+    with app.app_context():
+        tiles = db.session.execute(select(LongRead.map_tiles).where(LongRead.id == 1)).scalar()
+    assert (tiles["status"], tiles["width"], tiles["height"], tiles["max_level"]) == ("ready", 600, 300, 10)
+    assert os.path.exists(os.path.join(tiles["base"][1:], "10", "2_1.jpg"))
+
+
+@pytest.mark.parametrize("data, status", [(b"GIF89a" + bytes(100), 202), (b"not an image at all", 415),
+                                          (b"<svg xmlns='http://www.w3.org/2000/svg'/>", 415)])
+def test_the_type_comes_from_the_bytes(client, fixture, data, status):
+    assert upload(client, "/world/1/edit_image", data, filename="image.png").status_code == status
+
+
+def test_oversized_uploads_are_refused_while_streaming(app, client, fixture):
+    app.config["IMAGE_MAX_BYTES"] = 64 * 1024
+    response = upload(client, "/world/1/edit_image", png(8, 8) + bytes(100 * 1024))
+    assert response.status_code == 413
+    assert spooled_files() == []
+    app.config["IMAGE_MAX_BYTES"] = 1024 * 1024
+    huge = upload(client, "/world/1/edit_image", png(8, 8) + bytes(2 * 1024 * 1024))
+    assert huge.status_code == 413
+
+
+def test_missing_files_and_entities(app, client, fixture):
+    assert client.post("/world/1/edit_image", data={}, content_type="multipart/form-data").status_code == 400
+    assert upload(client, "/world/1/edit_image", b"", filename="").status_code == 200
+    assert upload(client, "/world/99/edit_image", png(8, 8)).status_code == 404
+    assert spooled_files() == []
+    with app.app_context():
+        assert db.session.execute(select(job_outbox.c.kind)).scalars().all() == []
+
+
+def test_hashed_files_are_served_as_immutable(app, client, fixture, tmp_path):
+    app.static_folder = str(tmp_path / "staticFiles")
+    assert upload(client, "/world/1/edit_image", png(8, 8)).status_code == 202
+    run_jobs(app)
+    link, _ = stored(app, World, 1)
+    response = client.get(link)
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == "public, max-age=31536000, immutable"
+
+    with open(os.path.join("staticFiles", "plain.txt"), "w") as plain:
+        plain.write("x")
+    assert "immutable" not in client.get("/staticFiles/plain.txt").headers.get("Cache-Control", "")